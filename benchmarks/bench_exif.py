@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+"""
+Compare reading GPS locations with exifread (all tags, as
+extract_location used to) against the header-only read_gps_header, on a
+synthetic set of geotagged JPEGs with a camera-like MakerNote.
+
+usage: python benchmarks/bench_exif.py [-n IMAGES] [-s WIDTHxHEIGHT]
+"""
+import argparse
+import os
+import tempfile
+import time
+from fractions import Fraction
+
+import exifread
+from PIL import Image
+
+from odk2odm import extract_location_from_exif as exif
+
+EXIF_IFD = 0x8769
+MAKER_NOTE = 0x927C
+
+
+def dms(degrees):
+    d = int(degrees)
+    m = int((degrees - d) * 60)
+    s = (degrees - d - m / 60) * 3600
+    return (Fraction(d), Fraction(m), Fraction(s).limit_denominator(10000))
+
+
+def make_images(outdir, n, size):
+    """Write n noisy JPEGs with GPS tags and a 32 KB MakerNote"""
+    noise = Image.effect_noise(size, 64).convert('RGB')
+    for i in range(n):
+        lat, lon = -6.8 + i * 1e-4, 39.28 + i * 1e-4
+        tags = Image.Exif()
+        tags[0x010F] = 'odk2odm'
+        tags.get_ifd(EXIF_IFD)[MAKER_NOTE] = os.urandom(32 * 1024)
+        tags[exif.TIFF_GPS_IFD] = {1: 'S', 2: dms(abs(lat)),
+                                   3: 'E', 4: dms(lon),
+                                   5: 0, 6: Fraction(100 + i)}
+        noise.save(os.path.join(outdir, f'IMG_{i:05d}.JPG'), exif=tags,
+                   quality=90)
+
+
+def exifread_all_tags(path):
+    """GPS location the way extract_location read it before"""
+    with open(path, 'rb') as f:
+        tags = exifread.process_file(f)
+    lat = exif.exif_GPS_to_decimal_degrees(tags['GPS GPSLatitude'])
+    lon = exif.exif_GPS_to_decimal_degrees(tags['GPS GPSLongitude'])
+    if tags['GPS GPSLatitudeRef'].values == 'S':
+        lat = -lat
+    if tags['GPS GPSLongitudeRef'].values == 'W':
+        lon = -lon
+    return lat, lon, exif.exif_GPS_alt_to_decimal_m(tags['GPS GPSAltitude'])
+
+
+def timed(label, paths, read):
+    start = time.monotonic()
+    for path in paths:
+        read(path)
+    elapsed = time.monotonic() - start
+    print(f'{label:>18}: {len(paths) / elapsed:8.1f} images/s')
+    return elapsed
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser()
+    p.add_argument('-n', '--images', type=int, default=200)
+    p.add_argument('-s', '--size', default='4000x3000',
+                   help='Image size in pixels')
+    args = p.parse_args()
+    size = tuple(int(x) for x in args.size.split('x'))
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        make_images(tmpdir, args.images, size)
+        paths = sorted(os.path.join(tmpdir, f) for f in os.listdir(tmpdir))
+        with open(paths[0], 'rb') as f:
+            exif.read_exif_segment(f)
+            header_bytes = f.tell()
+        print(f'{args.images} images of {os.path.getsize(paths[0]) / 1e6:.1f}'
+              f' MB; the header-only reader reads {header_bytes / 1e3:.1f} KB'
+              f' of each')
+        for path in paths:
+            assert exif.read_gps_header(path) == exifread_all_tags(path)
+        before = timed('exifread all tags', paths, exifread_all_tags)
+        after = timed('read_gps_header', paths, exif.read_gps_header)
+        print(f'{"speed-up":>18}: {before / after:8.1f}x')
@@ -0,0 +1,45 @@
+#!/usr/bin/python3
+"""
+Compare requests/s of plain requests.get calls (a new connection per
+request) against the shared pooled session of odk2odm.session, by listing
+the projects of the local stub ODK Central server over and over.
+
+usage: python benchmarks/bench_session.py [-n REQUESTS]
+"""
+import argparse
+import time
+
+import requests
+
+from tests.stub_servers import StubServer
+
+from odk2odm import odk_requests
+from odk2odm import session
+
+
+def timed(label, n, call):
+    start = time.monotonic()
+    for _ in range(n):
+        call().raise_for_status()
+    elapsed = time.monotonic() - start
+    print(f'{label:>24}: {n / elapsed:8.1f} requests/s')
+    return n / elapsed
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser()
+    p.add_argument('-n', '--requests', type=int, default=500,
+                   help='Number of requests per run')
+    args = p.parse_args()
+
+    server = StubServer().start()
+    url = server.url
+    aut = ('user', 'password')
+
+    before = timed('requests.get', args.requests,
+                   lambda: requests.get(f'{url}/v1/projects', auth=aut))
+    after = timed('shared pooled session', args.requests,
+                  lambda: odk_requests.projects(url, aut))
+    print(f'{"speed-up":>24}: {after / before:8.1f}x')
+    session.get_session().close()
+    server.stop()
@@ -0,0 +1,158 @@
+#!/usr/bin/python3
+"""
+Measure files/s and MB/s of the bulk operations against the local stub
+servers of tests/stub_servers.py:
+
+download  attachments.threaded_download, ODK Central to disk
+upload    batch_upload.upload_images, disk to a WebODM task
+transfer  transfer.transfer_form_to_task, ODK Central to WebODM in memory
+asset     odm_assets.download_asset, a large WebODM output in segments
+
+Latency, bandwidth per connection and injected failures make the stub
+behave more like a real server over a real network. Add --json to append
+the results, with the settings, to a file of JSON lines, so that runs
+before and after a change can be compared.
+
+usage: python benchmarks/bench_transfer.py [-n SUBMISSIONS] [-l LATENCY_MS]
+           [-b MB_PER_S] [-f FAILURE_RATE] [--json FILE] [SCENARIO ...]
+"""
+import argparse
+import contextlib
+import dataclasses
+import datetime
+import io
+import json
+import os
+import tempfile
+
+from tests.stub_servers import StubConfig, StubServer
+
+from odk2odm import attachments
+from odk2odm import batch_upload
+from odk2odm import odm_assets
+from odk2odm import transfer
+from odk2odm.odm_client import TokenAuth
+from odk2odm.throughput import Throughput
+
+SCENARIOS = ('download', 'upload', 'transfer', 'asset')
+AUT = ('user', 'password')
+PROJECT = 1
+FORM = 'form_0'
+
+
+def run_download(server, workdir, args):
+    outdir = os.path.join(workdir, 'download')
+    os.makedirs(outdir, exist_ok=True)
+    return attachments.threaded_download(server.url, AUT, PROJECT, FORM,
+                                         outdir, threads=args.threads)
+
+
+def run_upload(server, workdir, args):
+    indir = os.path.join(workdir, 'download')
+    if not os.path.isdir(indir):
+        run_download(server, workdir, args)
+    images = sorted(os.path.join(indir, f) for f in os.listdir(indir)
+                    if f.endswith('.jpg'))
+    token = TokenAuth(server.url, *AUT)
+    task_id, stats, failed = batch_upload.upload_images(
+        server.url, token, PROJECT, images)
+    return stats
+
+
+def run_transfer(server, workdir, args):
+    token = TokenAuth(server.url, *AUT)
+    task_id, downloaded, uploaded = transfer.transfer_form_to_task(
+        server.url, AUT, PROJECT, FORM, server.url, token, PROJECT,
+        download_threads=args.threads, upload_threads=args.upload_threads)
+    return uploaded
+
+
+def run_asset(server, workdir, args):
+    token = TokenAuth(server.url, *AUT)
+    stats = Throughput('assets')
+    try:
+        stats.add(odm_assets.download_asset(
+            server.url, token, PROJECT, 'task', 'all.zip',
+            os.path.join(workdir, 'all.zip'), segments=args.segments))
+    except IOError as e:
+        print(e)
+        stats.fail()
+    return stats
+
+
+RUNS = {'download': run_download, 'upload': run_upload,
+        'transfer': run_transfer, 'asset': run_asset}
+
+
+def result(stats):
+    files_s, mb_s = stats.rates()
+    return {'files': stats.files, 'mb': stats.nbytes / 1e6,
+            'seconds': stats.elapsed(), 'files_per_s': files_s,
+            'mb_per_s': mb_s, 'failed': stats.failed}
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser()
+    p.add_argument('scenarios', nargs='*', default=SCENARIOS,
+                   help=f'What to measure, any of {", ".join(SCENARIOS)} '
+                   f'(default: all)')
+    p.add_argument('-n', '--submissions', type=int, default=200)
+    p.add_argument('-a', '--attachments', type=int, default=2,
+                   help='Attachments per submission')
+    p.add_argument('-s', '--size', type=int, default=500,
+                   help='Attachment size in KB')
+    p.add_argument('--asset_size', type=int, default=64,
+                   help='Asset size in MB')
+    p.add_argument('-l', '--latency', type=float, default=20,
+                   help='Latency added to every request in ms')
+    p.add_argument('-b', '--bandwidth', type=float, default=0,
+                   help='Bandwidth per connection in MB/s (default: no '
+                   'limit)')
+    p.add_argument('-f', '--failure_rate', type=float, default=0,
+                   help='Share of requests answered with a 503')
+    p.add_argument('--truncate_rate', type=float, default=0,
+                   help='Share of response bodies broken off half way')
+    p.add_argument('-t', '--threads', type=int, default=10,
+                   help='Download threads')
+    p.add_argument('-ut', '--upload_threads', type=int, default=4,
+                   help='Upload threads of the transfer scenario')
+    p.add_argument('--segments', type=int, default=4,
+                   help='Parallel ranges of the asset scenario')
+    p.add_argument('-v', '--verbose', action='store_true',
+                   help='Show the output of the functions measured')
+    p.add_argument('--json', help='Append the results to this file')
+    args = p.parse_args()
+    for name in args.scenarios:
+        if name not in SCENARIOS:
+            p.error(f'unknown scenario {name}')
+
+    config = StubConfig(submissions=args.submissions,
+                        attachments=args.attachments,
+                        attachment_size=args.size * 1024,
+                        asset_size=args.asset_size * 1024 * 1024,
+                        latency=args.latency / 1000,
+                        bandwidth=args.bandwidth * 1e6,
+                        failure_rate=args.failure_rate,
+                        truncate_rate=args.truncate_rate)
+    results = {}
+    with StubServer(config) as server, \
+            tempfile.TemporaryDirectory() as workdir:
+        for name in args.scenarios:
+            quiet = contextlib.redirect_stdout(io.StringIO())
+            with contextlib.nullcontext() if args.verbose else quiet:
+                stats = RUNS[name](server, workdir, args)
+            print(f'{name:>9}: {stats.summary()}')
+            results[name] = result(stats)
+        print(f'{"requests":>9}: {sum(server.requests.values())}, '
+              f'{server.bytes_sent / 1e6:.1f} MB sent, '
+              f'{server.bytes_received / 1e6:.1f} MB received by the stub')
+
+    if args.json:
+        record = {'time': datetime.datetime.now().isoformat(timespec='seconds'),
+                  'config': dataclasses.asdict(config),
+                  'threads': args.threads,
+                  'upload_threads': args.upload_threads,
+                  'segments': args.segments,
+                  'results': results}
+        with open(args.json, 'a') as outfile:
+            outfile.write(json.dumps(record) + '\n')
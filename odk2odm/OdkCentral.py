@@ -28,6 +28,8 @@ import codecs
 import urllib
 from datetime import tzinfo, datetime
 
+from odk2odm.metadata_cache import get_cache
+
 
 class OdkCentral(object):
     def __init__(self, url=None, user=None, passwd=None):
@@ -71,10 +73,25 @@ class OdkCentral(object):
         # Use a persistant connect, better for multiple requests
         self.session = requests.Session()
 
-        # These are just cached data from the queries
+        # These are just cached data from the queries. The get* methods
+        # fill them from the shared metadata cache (see metadata_cache.py),
+        # so the lists are only fetched again once they have expired.
         self.projects = dict()
         self.users = None
 
+    def cacheKey(self, *path):
+        """Metadata cache key for a list on this server, as seen by this user"""
+        return (self.url, self.user) + tuple(str(p) for p in path)
+
+    def cached(self, key, fetch):
+        """The JSON of the response of fetch(), from the metadata cache if
+        it hasn't expired. Error responses are raised, not cached."""
+        def fetchJson():
+            result = fetch()
+            result.raise_for_status()
+            return result.json()
+        return get_cache().get(self.cacheKey(*key), fetchJson)
+
     def authenticate(self, url=None, user=None, passwd=None):
         """Setup authenticate to an ODK Central server"""
         if not self.url:
@@ -100,10 +117,26 @@ class OdkCentral(object):
             self.projects[project['id']] = project
         return result
 
-    def createProject(name=None):
+    def getProjects(self):
+        """The projects on the server indexed by id, from the cache if it
+        hasn't expired"""
+        projects = self.cached(('projects',), self.listProjects)
+        self.projects = {project['id']: project for project in projects}
+        return self.projects
+
+    def findProject(self, name=None):
+        """Get the id of the project with the given name, or None"""
+        for id, data in self.getProjects().items():
+            if data['name'] == name:
+                return id
+        return None
+
+    def createProject(self, name=None):
         """Create a new project on an ODK Central server"""
-        url = f'{self.base}/v1/projects'
+        url = self.base + "projects"
         result = self.session.post(url, auth=self.auth, json={'name': name})
+        get_cache().invalidate(*self.cacheKey('projects'))
+        return result
 
     def listUsers(self):
         """Fetch a list of users on the ODK Central server"""
@@ -112,7 +145,12 @@ class OdkCentral(object):
         result = self.session.get(url, auth=self.auth)
         self.users = result.json()
         return result
-        
+
+    def getUsers(self):
+        """The users on the server, from the cache if it hasn't expired"""
+        self.users = self.cached(('users',), self.listUsers)
+        return self.users
+
     def dump(self):
         """Dump internal data structures, for debugging purposes only"""
         # print("URL: %s" % self.url)
@@ -151,6 +189,11 @@ class OdkProject(OdkCentral):
         self.forms = result.json()
         return result
 
+    def getForms(self, id=None):
+        """The forms in a project, from the cache if it hasn't expired"""
+        self.forms = self.cached((id, 'forms'), lambda: self.listForms(id))
+        return self.forms
+
     def listSubmissions(self, projectId, formId):
         """Fetch a list of submission instances for a given form."""
         url = self.base + f'projects/{projectId}/forms/{formId}/submissions'
@@ -194,6 +237,12 @@ class OdkProject(OdkCentral):
         self.appusers = result.json()
         return result
 
+    def getAppUsers(self, projectId=None):
+        """The app users of a project, from the cache if it hasn't expired"""
+        self.appusers = self.cached((projectId, 'app-users'),
+                                    lambda: self.listAppUsers(projectId))
+        return self.appusers
+
     def dump(self):
         """Dump internal data structures, for debugging purposes only"""
         super().dump()
@@ -307,7 +356,7 @@ class OdkForm(OdkCentral):
         logging.info("Read %d bytes from %s" % (len(xml), filespec))
 
         result = self.session.post(url, auth=self.auth,  data=xml, headers=headers)
-        # FIXME: should update self.forms with the new form
+        get_cache().invalidate(*self.cacheKey(projectId, 'forms'))
         return result
 
     def deleteForm(self, projectId=None, formId=None):
@@ -315,10 +364,11 @@ class OdkForm(OdkCentral):
         # FIXME: If your goal is to prevent it from showing up on survey clients like ODK Collect, consider
         # setting its state to closing or closed
         if self.draft:
-            url = f'{self.base}projects/{projectId}/forms/{xmlFormId}/draft'
+            url = f'{self.base}projects/{projectId}/forms/{formId}/draft'
         else:
-            url = f'{self.base}projects/{projectId}/forms/{xmlFormId}'
+            url = f'{self.base}projects/{projectId}/forms/{formId}'
         result = self.session.delete(url, auth=self.auth)
+        get_cache().invalidate(*self.cacheKey(projectId, 'forms'))
         return result
 
     def publish(self, projectId=None, xmlFormId=None, filespec=None):
@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+"""
+Asynchronous versions of the functions in odk_requests.py.
+
+Every function is a coroutine taking an httpx.AsyncClient as its first
+argument, followed by the same arguments as its namesake in odk_requests,
+and returns an httpx.Response (which has the same status_code, json() and
+content as a requests.Response). All requests made through one client share
+its connection pool, so a single process can keep hundreds of requests in
+flight without a thread per request:
+
+import asyncio
+from odk2odm import async_odk_requests as aodk
+
+async def attachment_lists(url, aut, project, form):
+    async with aodk.client() as c:
+        subs = (await aodk.submissions(c, url, aut, project, form)).json()
+        return await asyncio.gather(*[
+            aodk.attachment_list(c, url, aut, project, form, s['instanceId'])
+            for s in subs])
+
+Requires the httpx library (pip install httpx).
+"""
+import os
+
+import httpx
+
+from odk2odm import download
+
+
+def client(max_connections=100, timeout=60.0):
+    """
+    An httpx.AsyncClient with a pool of at most max_connections kept-alive
+    connections. Requests beyond that wait for a free connection.
+    """
+    limits = httpx.Limits(max_connections=max_connections,
+                          max_keepalive_connections=max_connections)
+    return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+
+async def projects(client, base_url, aut):
+    """Fetch a list of projects on an ODK Central server."""
+    url = f'{base_url}/v1/projects'
+    return await client.get(url, auth=aut)
+
+
+async def project(client, base_url, aut, projectId):
+    """Fetch details of a specific project on an ODK Central server"""
+    url = f'{base_url}/v1/projects/{projectId}'
+    return await client.get(url, auth=aut)
+
+
+async def project_id(client, base_url, aut, projectName):
+    """Fetch the id of a project based on the name on an ODK Central server."""
+    projects_list = (await projects(client, base_url, aut)).json()
+    return [p for p in projects_list if p['name'] == projectName][0]['id']
+
+
+async def forms(client, base_url, aut, projectId):
+    """Fetch a list of forms in a project."""
+    url = f'{base_url}/v1/projects/{projectId}/forms'
+    return await client.get(url, auth=aut)
+
+
+async def form(client, base_url, aut, projectId, formId):
+    """Fetch details of a form in a project."""
+    url = f'{base_url}/v1/projects/{projectId}/forms/{formId}'
+    return await client.get(url, auth=aut)
+
+
+async def submissions(client, base_url, aut, projectId, formId):
+    """Fetch a list of submission instances for a given form."""
+    url = f'{base_url}/v1/projects/{projectId}/forms/{formId}/submissions'
+    return await client.get(url, auth=aut)
+
+
+async def users(client, base_url, aut):
+    """Fetch a list of users."""
+    url = f'{base_url}/v1/users'
+    return await client.get(url, auth=aut)
+
+
+async def app_users(client, base_url, aut, projectId):
+    """Fetch a list of app-users."""
+    url = f'{base_url}/v1/projects/{projectId}/app-users'
+    return await client.get(url, auth=aut)
+
+
+async def csv_submissions(client, base_url, aut, projectId, formId):
+    """Fetch a CSV file of the submissions to a survey form."""
+    url = f'{base_url}/v1/projects/{projectId}/forms/{formId}/submissions.csv.zip'
+    return await client.get(url, auth=aut)
+
+
+async def odata_submissions(client, base_url, aut, projectId, formId,
+                            params=None):
+    """Fetch the submissions using the odata api, see odk_requests."""
+    url = f'{base_url}/v1/projects/{projectId}/forms/{formId}.svc/Submissions'
+    return await client.get(url, auth=aut, params=params)
+
+
+async def attachment_list(client, base_url, aut, projectId, formId,
+                          instanceId):
+    """Fetch the list of media file attachments of a submission."""
+    url = f'{base_url}/v1/projects/{projectId}/forms/{formId}/submissions/'\
+        f'{instanceId}/attachments'
+    return await client.get(url, auth=aut)
+
+
+async def attachment(client, base_url, aut, projectId, formId, instanceId,
+                     filename):
+    """Fetch a specific attachment by filename from a submission to a form."""
+    url = f'{base_url}/v1/projects/{projectId}/forms/{formId}/submissions/'\
+        f'{instanceId}/attachments/{filename}'
+    return await client.get(url, auth=aut)
+
+
+async def attachment_to_file(client, base_url, aut, projectId, formId,
+                             instanceId, filename, outfilepath,
+                             chunk_size=download.CHUNK_SIZE):
+    """
+    Stream an attachment to outfilepath in chunks through a .part file that
+    is renamed into place when complete, like download.stream_to_file.
+    Returns the number of bytes written.
+    """
+    url = f'{base_url}/v1/projects/{projectId}/forms/{formId}/submissions/'\
+        f'{instanceId}/attachments/{filename}'
+    partpath = download.part_path(outfilepath)
+    nbytes = 0
+    async with client.stream('GET', url, auth=aut) as response:
+        response.raise_for_status()
+        try:
+            with open(partpath, 'wb') as outfile:
+                async for chunk in response.aiter_bytes(chunk_size):
+                    outfile.write(chunk)
+                    nbytes += len(chunk)
+            os.replace(partpath, outfilepath)
+        except BaseException:
+            if os.path.exists(partpath):
+                os.remove(partpath)
+            raise
+    return nbytes
+
+
+async def create_project(client, base_url, aut, project_name):
+    """Create a new project on an ODK Central server"""
+    url = f'{base_url}/v1/projects'
+    return await client.post(url, auth=aut, json={'name': project_name})
+
+
+async def create_app_user(client, base_url, aut, projectId,
+                          app_user_name='Surveyor'):
+    """Create a new app user in a project on an ODK Central server"""
+    url = f'{base_url}/v1/projects/{projectId}/app-users'
+    return await client.post(url, auth=aut,
+                             json={'displayName': app_user_name})
+
+
+async def update_role_app_user(client, base_url, aut, projectId, formId,
+                               actorId, roleId=2):
+    """Give specified app-user specified role for given project"""
+    url = f'{base_url}/v1/projects/{projectId}/forms/{formId}/assignments/{roleId}/{actorId}'
+    return await client.post(url, auth=aut)
+
+
+async def delete_project(client, base_url, aut, project_id):
+    """Permanently delete project from an ODK Central server. Probably don't."""
+    url = f'{base_url}/v1/projects/{project_id}'
+    return await client.delete(url, auth=aut)
+
+
+async def create_form(client, base_url, aut, projectId, name, data):
+    """Create a new form on an ODK Central server"""
+    headers = {
+        'Content-Type': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        'X-XlsForm-FormId-Fallback': name
+    }
+    url = f'{base_url}/v1/projects/{projectId}/forms?ignoreWarnings=true&publish=true'
+    return await client.post(url, auth=aut, content=data, headers=headers)
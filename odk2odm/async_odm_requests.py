@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+"""
+Asynchronous versions of the functions in odm_requests.py.
+
+Every function is a coroutine taking an httpx.AsyncClient (see
+async_odk_requests.client) as its first argument, followed by the same
+arguments as its namesake in odm_requests, and returns an httpx.Response.
+Requires the httpx library (pip install httpx).
+"""
+import json
+
+from odk2odm.odm_requests import token_prefix, ODM_TASK_DEFAULT_OPTIONS_LIST
+
+
+def _auth(token):
+    return {'Authorization': '{} {}'.format(token_prefix, token)}
+
+
+async def get_token_auth(client, base_url, username, password):
+    """
+    Retrieve a 24-hr valid access token for provided WebODM base_url
+    :param client: httpx.AsyncClient
+    :param base_url: str - base url of WebODM server
+    :param username: str - user name
+    :param password: str - password
+    :return: http response
+    """
+    url = f"{base_url}/api/token-auth/"
+    return await client.post(
+        url,
+        data={
+            "username": username,
+            "password": password
+        }
+    )
+
+
+async def get_options(client, base_url, token):
+    """Get list of processing options for NodeODM, see odm_requests.get_options"""
+    url = f"{base_url}/api/processingnodes/options/"
+    return await client.get(url, headers=_auth(token))
+
+
+async def get_projects(client, base_url, token):
+    """Get list of projects belonging to server / user"""
+    url = f"{base_url}/api/projects"
+    return await client.get(url, headers=_auth(token))
+
+
+async def get_project(client, base_url, token, project_id):
+    """Get details of specific project, including list of tasks"""
+    url = f"{base_url}/api/projects/{project_id}"
+    return await client.get(url, headers=_auth(token))
+
+
+async def post_project(client, base_url, token, data={}):
+    """Post request for new project, see odm_requests.post_project"""
+    url = f"{base_url}/api/projects/"
+    return await client.post(url, headers=_auth(token), data=data)
+
+
+async def get_task(client, base_url, token, project_id, task_id):
+    """Get details of a task belonging to a project"""
+    url = f"{base_url}/api/projects/{project_id}/tasks/{task_id}/"
+    return await client.get(url, headers=_auth(token))
+
+
+async def get_thumbnail(client, base_url, token, project_id, task_id, filename):
+    url = f"{base_url}/api/projects/{project_id}/tasks/{task_id}/images/thumbnail/{filename}"
+    return await client.get(url, headers=_auth(token))
+
+
+async def get_image(client, base_url, token, project_id, task_id, filename):
+    url = f"{base_url}/api/projects/{project_id}/tasks/{task_id}/images/download/{filename}"
+    return await client.get(url, headers=_auth(token))
+
+
+async def patch_task(client, base_url, token, project_id, task_id, data={},
+                     files={}):
+    """Patch existing task settings in a project, see odm_requests.patch_task"""
+    url = f"{base_url}/api/projects/{project_id}/tasks/{task_id}/"
+    data = dict(data)
+    if "options" in data:
+        # serialize options before passing
+        data["options"] = json.dumps(data["options"])
+    return await client.patch(url, headers=_auth(token), data=data,
+                              files=files or None)
+
+
+async def post_task(client, base_url, token, project_id, data={}, files=[]):
+    """Post a new task in a project, see odm_requests.post_task"""
+    url = f"{base_url}/api/projects/{project_id}/tasks/"
+    data = dict(data)
+    # set a good set of default options in case user does not provide these
+    data["options"] = json.dumps(data.get("options",
+                                          ODM_TASK_DEFAULT_OPTIONS_LIST))
+    return await client.post(url, headers=_auth(token), data=data,
+                             files=files or None)
+
+
+async def post_upload(client, base_url, token, project_id, task_id,
+                      fields={}):
+    """
+    Post a new upload of a photo (.JPG) in an existing task with
+    "partial": True in a project
+    :param fields: dict - {"images": (<name of image file.JPG>, <bytes or
+        file object of image>, 'image/jpg')}, as for odm_requests.post_upload
+    :return: http response
+    """
+    url = f"{base_url}/api/projects/{project_id}/tasks/{task_id}/upload/"
+    return await client.post(url, headers=_auth(token), files=fields)
+
+
+async def get_asset(client, base_url, token, project_id, task_id, asset):
+    url = f"{base_url}/api/projects/{project_id}/tasks/{task_id}/download/{asset}"
+    return await client.get(url, headers=_auth(token))
+
+
+async def post_commit(client, base_url, token, project_id, task_id):
+    """Post a commit for an existing task with "partial": True"""
+    url = f"{base_url}/api/projects/{project_id}/tasks/{task_id}/commit/"
+    return await client.post(url, headers=_auth(token))
+
+
+async def post_restart(client, base_url, token, project_id, task_id):
+    """Post a restart for an existing task"""
+    url = f"{base_url}/api/projects/{project_id}/tasks/{task_id}/restart/"
+    return await client.post(url, headers=_auth(token))
+
+
+async def post_cancel(client, base_url, token, project_id, task_id):
+    """Post a cancel for an existing running task"""
+    url = f"{base_url}/api/projects/{project_id}/tasks/{task_id}/cancel/"
+    return await client.post(url, headers=_auth(token))
+
+
+async def delete_task(client, base_url, token, project_id, task_id):
+    """Delete an existing task in existing project"""
+    url = f"{base_url}/api/projects/{project_id}/tasks/{task_id}/remove/"
+    return await client.post(url, headers=_auth(token))
+
+
+async def delete_project(client, base_url, token, project_id):
+    """Delete an existing project"""
+    url = f"{base_url}/api/projects/{project_id}"
+    return await client.delete(url, headers=_auth(token))
@@ -1,45 +1,309 @@
 #!/usr/bin/python3
 import os
-import odk_requests
+import queue
 import argparse
 import threading
+import time
+from urllib.parse import urlparse
 
+import requests
 
-def threaded_download():
-    """Grab lots of photos using threaded concurrent download"""
-    # FIXME: NOT DONE
-    
-    threads = []
+from odk2odm import download
+from odk2odm import odk_requests
+from odk2odm import session as http_session
+from odk2odm import sync_state
+from odk2odm.dedup import DedupIndex, is_placed, submission_path
+from odk2odm.dedup import supports_hard_links
+from odk2odm.manifest import DownloadManifest, MANIFEST_NAME
+from odk2odm.throughput import Throughput
 
-    for chunk in chunks:
-        thread = threading.Thread(target=managechunk,
-                                  args=(chunk, outdirpath, timeout))
-        threads.append(thread)
-        thread.start()
+# Never keep more than this many requests in flight to a single server,
+# however many download threads are asked for.
+MAX_PER_HOST = 16
+# Failed or broken-off downloads are tried this many more times
+DOWNLOAD_RETRIES = 3
 
-    for thread in threads:
-        thread.join()
+_host_limits = {}
+_host_limits_lock = threading.Lock()
 
 
-def all_attachments_from_form(url, aut, project, form, outdir):
-    """Downloads all available attachments from a given form"""
-    submissions = odk_requests.submissions(url, aut, project, form)
-
-    for submission in submissions.json():
-        sub_id = submission['instanceId']
-        print(sub_id)
-        attachments = odk_requests.attachment_list(url, aut, project, form, sub_id)
-        for attachment in attachments.json():
-            fn = attachment['name']
+def host_limit(url, limit=MAX_PER_HOST):
+    """Return the semaphore shared by all downloads from the host of url"""
+    host = urlparse(url).netloc
+    with _host_limits_lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.BoundedSemaphore(limit)
+        return _host_limits[host]
+
+
+def list_submissions(url, aut, project, form, since=None, session=None):
+    """
+    Return a dict of the instanceIds of the submissions to a form to their
+    submission dates, and the latest of those dates. If since is given,
+    only submissions received after that timestamp are fetched, using an
+    OData $filter.
+    """
+    if since is None:
+        response = odk_requests.submissions(url, aut, project, form,
+                                            session=session)
+        response.raise_for_status()
+        dates = {s['instanceId']: s['createdAt'] for s in response.json()}
+        return dates, max(dates.values(), default=None)
+    params = {'$filter': sync_state.submitted_after(since)}
+    dates = {}
+    latest = since
+    for row in odk_requests.iter_odata_submissions(url, aut, project, form,
+                                                   params=params,
+                                                   session=session):
+        dates[row['__id']] = row['__system']['submissionDate']
+        latest = sync_state.latest_submission_date([row], latest)
+    return dates, latest
+
+
+def queue_attachments(url, aut, project, form, sub_ids, work, nworkers,
+                      session=None, manifest=None, all_names=False,
+                      incomplete=None, unlisted=None):
+    """
+    Put an (instanceId, filename) tuple on the work queue for every
+    attachment of the given submissions to a form, followed by one None per
+    worker to tell the workers there is nothing more to come.
+    With a DownloadManifest, unfinished attachments recorded in it are
+    queued first, and submissions whose attachments are all recorded
+    already are not asked for their attachment list again.
+    With all_names=True attachments of different submissions that share a
+    filename are all queued; otherwise only the first one is.
+    The instanceIds of submissions with attachments that aren't on the
+    server yet are added to the incomplete set, and those whose attachments
+    couldn't be listed to the unlisted set, if these are given.
+    """
+    done = set()
+    try:
+        seen = set()
+        listed = set()
+        if manifest is not None:
+            seen = manifest.names(project, form)
+            listed = manifest.listed(project, form)
+            for item in manifest.pending(project, form):
+                work.put(item)
+        for sub_id in sub_ids:
+            done.add(sub_id)
+            if sub_id in listed:
+                continue
+            print(sub_id)
+            try:
+                response = odk_requests.attachment_list(url, aut, project,
+                                                        form, sub_id,
+                                                        session=session)
+                response.raise_for_status()
+                attachments = response.json()
+            except (requests.RequestException, ValueError) as e:
+                print(f'Failed to list the attachments of {sub_id}: {e}')
+                if unlisted is not None:
+                    unlisted.add(sub_id)
+                continue
+            names = []
+            complete = True
+            for attachment in attachments:
+                fn = attachment['name']
+                # Attachments not (yet) uploaded by ODK Collect can't be
+                # fetched, and without all_names all files end up in one
+                # flat directory.
+                if not attachment.get('exists', True):
+                    complete = False
+                    continue
+                if fn in seen and not all_names:
+                    continue
+                seen.add(fn)
+                names.append(fn)
+            if not complete and incomplete is not None:
+                incomplete.add(sub_id)
+            if manifest is not None:
+                manifest.add_submission(project, form, sub_id, names,
+                                        listed=complete)
+            for fn in names:
+                work.put((sub_id, fn))
+    except BaseException:
+        # Submissions not got to yet must be listed next time too
+        if unlisted is not None:
+            unlisted.update(sub_id for sub_id in sub_ids
+                            if sub_id not in done)
+        raise
+    finally:
+        for _ in range(nworkers):
+            work.put(None)
+
+
+def download_worker(url, aut, project, form, outdir, work, stats,
+                    session=None, manifest=None, dedup=None,
+                    retries=DOWNLOAD_RETRIES):
+    """
+    Download attachments taken from the work queue until it yields None.
+    A failed or broken-off download is tried again up to retries times,
+    with exponential back-off.
+    Without a manifest, files already on disk are skipped; with one, the
+    expected size and ETag of every file are recorded and .part files of
+    interrupted downloads are resumed, also between retries. With a
+    DedupIndex, files are downloaded per submission and then deduplicated
+    (see dedup.py).
+    """
+    limit = host_limit(url)
+    while True:
+        item = work.get()
+        if item is None:
+            return
+        sub_id, fn = item
+        if dedup is None:
             outfilepath = os.path.join(outdir, fn)
-            if os.path.isfile(outfilepath):
-                print(f'Apparently {fn} has already been downloaded')
-            else:
-                print(f'Requesting {fn} from ODK server')
-                attresp = odk_requests.attachment(url, aut, project, form,
-                                       sub_id, fn)
-                with open(outfilepath, 'wb') as outfile:
-                    outfile.write(attresp.content)
+        else:
+            outfilepath = submission_path(outdir, sub_id, fn)
+            os.makedirs(os.path.dirname(outfilepath), exist_ok=True)
+        if manifest is None and os.path.isfile(outfilepath):
+            if dedup is not None and not is_placed(outfilepath):
+                # Downloaded, but interrupted before it was deduplicated
+                dedup.place(outfilepath)
+            print(f'Apparently {fn} has already been downloaded')
+            continue
+        print(f'Requesting {fn} from ODK server')
+
+        def fetch(headers):
+            return odk_requests.attachment(url, aut, project, form, sub_id,
+                                           fn, session=session, stream=True,
+                                           headers=headers)
+
+        nbytes = 0
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(http_session.backoff(attempt))
+            try:
+                # The connection stays busy until the body is fully streamed
+                with limit:
+                    if manifest is None:
+                        attresp = fetch({})
+                        if attresp.status_code != 200:
+                            attresp.close()
+                            raise IOError(f'HTTP {attresp.status_code}')
+                        nbytes = download.stream_to_file(attresp, outfilepath)
+                    else:
+                        nbytes += resume_attachment(manifest, project, form,
+                                                    sub_id, fn, outfilepath,
+                                                    fetch)
+                break
+            except (requests.RequestException, OSError) as e:
+                error = e
+        else:
+            print(f'Failed to download {fn}: {error}')
+            stats.fail()
+            continue
+        try:
+            if dedup is not None:
+                dedup.place(outfilepath)
+            # Only complete once deduplicated, so a restart finishes the job
+            if manifest is not None:
+                manifest.set_complete(project, form, sub_id, fn,
+                                      os.path.getsize(outfilepath))
+            stats.add(nbytes)
+        except OSError as e:
+            print(f'Failed to store {fn}: {e}')
+            stats.fail()
+
+
+def resume_attachment(manifest, project, form, sub_id, fn, outfilepath,
+                      fetch):
+    """Download or resume one attachment, recording its size and ETag"""
+    record = manifest.attachment(project, form, sub_id, fn) or {}
+
+    def remember(size, etag):
+        manifest.set_expected(project, form, sub_id, fn, size, etag)
+
+    return download.resume_to_file(fetch, outfilepath,
+                                   etag=record.get('etag'),
+                                   on_response=remember)
+
+
+def threaded_download(url, aut, project, form, outdir, threads=10,
+                      resume=False, incremental=False, dedup=False):
+    """
+    Grab lots of photos using threaded concurrent download. One thread lists
+    the submissions and their attachments and feeds a bounded work queue,
+    from which the download threads take files to fetch over a shared pool
+    of keep-alive connections. Files are streamed to disk in chunks, so
+    memory use doesn't depend on the size of the media.
+    With resume=True progress is kept in a manifest in outdir (see
+    manifest.py), so that a restart resumes interrupted files and only
+    lists submissions it hasn't seen before.
+    With incremental=True only submissions received since the last run
+    without failures are fetched (see sync_state.py).
+    With dedup=True identical photos are stored only once, and distinct
+    photos sharing a filename are all kept (see dedup.py).
+    Returns a Throughput with the totals.
+    """
+    threads = max(int(threads), 1)
+    # A session of our own, with a connection for every download thread
+    session = http_session.make_session(pool_size=threads)
+    work = queue.Queue(maxsize=threads * 4)
+    stats = Throughput()
+    manifest = None
+    if resume:
+        manifest = DownloadManifest(os.path.join(outdir, MANIFEST_NAME))
+    state = None
+    since = None
+    if incremental:
+        state = sync_state.SyncState(os.path.join(outdir, sync_state.SYNC_NAME))
+        since = state.get('attachments', project, form)
+    dates, _ = list_submissions(url, aut, project, form, since=since,
+                                session=session)
+    incomplete = set()
+    unlisted = set()
+    index = DedupIndex(outdir) if dedup else None
+    kwargs = {'session': session, 'manifest': manifest}
+
+    producer = threading.Thread(target=queue_attachments,
+                                args=(url, aut, project, form, dates, work,
+                                      threads),
+                                kwargs=dict(kwargs, all_names=dedup,
+                                            incomplete=incomplete,
+                                            unlisted=unlisted))
+    producer.start()
+    workers = []
+    for _ in range(threads):
+        worker = threading.Thread(target=download_worker,
+                                  args=(url, aut, project, form, outdir,
+                                        work, stats),
+                                  kwargs=dict(kwargs, dedup=index))
+        workers.append(worker)
+        worker.start()
+
+    producer.join()
+    for worker in workers:
+        worker.join()
+    session.close()
+    if manifest is not None:
+        manifest.close()
+    if index is not None:
+        print(f'{index.duplicates} duplicate files were linked, not stored')
+        index.close()
+    if incomplete:
+        print(f'{len(incomplete)} submissions have attachments that are not '
+              f'on the server yet')
+    if unlisted:
+        print(f'The attachments of {len(unlisted)} submissions could not be '
+              f'listed')
+    # Files that failed must be tried again next time, and submissions
+    # with missing attachments or without a listing listed again
+    if state is not None and not stats.failed:
+        state.set('attachments', project, form,
+                  sync_state.high_water_mark(dates, incomplete | unlisted,
+                                             since))
+    print(stats.summary())
+    return stats
+
+
+def all_attachments_from_form(url, aut, project, form, outdir, threads=1,
+                              resume=False, incremental=False, dedup=False):
+    """Downloads all available attachments from a given form"""
+    return threaded_download(url, aut, project, form, outdir, threads=threads,
+                             resume=resume, incremental=incremental,
+                             dedup=dedup)
 
 
 def specified_attachments_from_form(url, aut, project, form, outdir, infile):
@@ -69,13 +333,27 @@ if __name__ == '__main__':
                    help='Submission instance ID')
     p.add_argument('-od', '--output_directory',
                    help='Directory to write output files.')
-    p.add_argument('-t', '--threads',
+    p.add_argument('-t', '--threads', type=int,
                    help='Maximum number of download threads', default=10)
+    p.add_argument('-r', '--resume', action='store_true',
+                   help='Keep a download manifest in the output directory '\
+                   'and resume interrupted downloads from it.')
+    p.add_argument('-n', '--incremental', action='store_true',
+                   help='Only fetch submissions received since the last '\
+                   'run with this output directory.')
+    p.add_argument('-d', '--dedup', action='store_true',
+                   help='Store identical photos only once, and keep '\
+                   'different photos that share a filename.')
     p.add_argument('-i', '--input_file',
                    help='Text file listing desired attachments. '\
                    'Should contain only filenames separated by line breaks.')
 
     args = p.parse_args()
+    if args.dedup and not supports_hard_links(args.output_directory):
+        p.error(f'{args.output_directory} does not support hard links, '
+                f'which -d needs')
 
     all_attachments_from_form(args.base_url, (args.user, args.password),
-                              args.project, args.form, args.output_directory)
+                              args.project, args.form, args.output_directory,
+                              threads=args.threads, resume=args.resume,
+                              incremental=args.incremental, dedup=args.dedup)
@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+"""
+Upload many images to a partial WebODM task, several images per request.
+
+With one request per photo, the fixed cost of every request on WebODM
+(authentication, the Django request cycle) dominates for large tasks.
+Here images are packed into batches sent as a single multipart request with
+odm_requests.post_upload. The batch size adapts: it grows while batches go
+through quickly, shrinks towards the target request duration when they get
+slow, and is halved when a batch fails. Only a failed batch is sent again,
+after an exponential back-off and up to a number of retries, after which
+its images are reported as failed. A batch rejected because the token
+expired is sent again straight away with a new one.
+When everything arrived the task is committed with post_commit.
+"""
+import argparse
+import collections
+import os
+import time
+
+import requests
+
+from odk2odm import odm_requests
+from odk2odm.dedup import walk_files
+from odk2odm import session as http_session
+from odk2odm.odm_client import TokenAuth, refresh_if_rejected
+from odk2odm.throughput import Throughput
+from odk2odm.transfer import create_partial_task
+
+UPLOAD_RETRIES = 3
+
+
+class BatchSizer(object):
+    """Chooses the number of images per request from how earlier ones went"""
+    def __init__(self, initial=8, minimum=1, maximum=64, target_seconds=30.0):
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+
+    def _clamp(self, size):
+        self.size = max(self.minimum, min(self.maximum, int(size)))
+
+    def success(self, images, seconds):
+        """A batch of images went through in seconds"""
+        if seconds <= self.target_seconds / 2:
+            # Plenty of headroom: grow by half
+            self._clamp(max(self.size + 1, self.size * 1.5))
+        elif seconds > self.target_seconds:
+            # Too slow: aim for the target duration at the observed rate
+            self._clamp(images * self.target_seconds / seconds)
+
+    def failure(self):
+        """A batch failed; try smaller ones"""
+        self._clamp(self.size // 2)
+
+
+def image_size(image):
+    """Size in bytes of an image given as for odm_requests.image_part"""
+    if isinstance(image, tuple):
+        data = image[1]
+        return len(data) if isinstance(data, bytes) else 0
+    return os.path.getsize(image)
+
+
+def find_images(inputdir):
+    """The JPEG files in a directory and its subdirectories, sorted"""
+    return sorted(f for f in walk_files(inputdir)
+                  if os.path.splitext(f)[1].lower() in ('.jpg', '.jpeg'))
+
+
+def upload_images(odm_url, token, odm_project, images, task_id=None,
+                  task_name='odk2odm', commit=True, retries=UPLOAD_RETRIES,
+                  sizer=None):
+    """
+    Upload images (file paths, or (filename, bytes[, mimetype]) tuples, which
+    can both be sent again if a batch has to be retried) to a partial WebODM
+    task in adaptively sized batches. A new partial task named task_name is
+    created unless task_id is given. The task is committed if all images
+    arrived, unless commit=False.
+    Returns the task id, a Throughput and the list of images that failed.
+    """
+    if task_id is None:
+        task_id = create_partial_task(odm_url, token, odm_project, task_name)
+    sizer = sizer or BatchSizer()
+    # Images are tracked by their position in the input, so they can be
+    # counted however the batches are regrouped
+    pending = collections.deque(enumerate(images))
+    attempts = collections.Counter()
+    failed = []
+    stats = Throughput('images')
+    # Failed batches in a row, for the back-off
+    failures = 0
+    reauthorized = False
+
+    while pending:
+        batch = [pending.popleft()
+                 for _ in range(min(sizer.size, len(pending)))]
+        start = time.monotonic()
+        try:
+            res = odm_requests.post_upload(odm_url, token, odm_project,
+                                           task_id,
+                                           images=[im for _, im in batch])
+            error = None if res.status_code == 200 else f'HTTP {res.status_code}'
+            if error and not reauthorized and refresh_if_rejected(token, res):
+                # Not a failure of the batch: send it again with the new
+                # token, unless that is rejected too
+                reauthorized = True
+                pending.extendleft(reversed(batch))
+                continue
+        except requests.RequestException as e:
+            error = e
+        reauthorized = False
+        if error is None:
+            failures = 0
+            sizer.success(len(batch), time.monotonic() - start)
+            stats.add(sum(image_size(image) for _, image in batch),
+                      files=len(batch))
+            continue
+
+        sizer.failure()
+        print(f'Batch of {len(batch)} images failed ({error}), '
+              f'next batch size {sizer.size}')
+        retry = []
+        for index, image in batch:
+            attempts[index] += 1
+            if attempts[index] > retries:
+                failed.append(image)
+                stats.fail()
+            else:
+                retry.append((index, image))
+        # Send these again first, regrouped at the new batch size, once the
+        # server had some time to recover
+        pending.extendleft(reversed(retry))
+        failures += 1
+        if retry:
+            time.sleep(http_session.backoff(failures))
+
+    print(stats.summary())
+    if commit:
+        if failed:
+            print(f'Not committing task {task_id}: {len(failed)} images failed')
+        else:
+            odm_requests.post_commit(odm_url, token, odm_project,
+                                     task_id).raise_for_status()
+    return task_id, stats, failed
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(usage="usage: batch_upload [options] directory")
+    p.add_argument('inputdir', help='Directory with the images to upload')
+    p.add_argument('-ourl', '--odm_url',
+                   help='WebODM server URL')
+    p.add_argument('-ou', '--odm_user',
+                   help='WebODM username')
+    p.add_argument('-opw', '--odm_password',
+                   help='WebODM password')
+    p.add_argument('-op', '--odm_project', type=int,
+                   help='WebODM project id to create the task in')
+    p.add_argument('-task', '--task_id',
+                   help='Existing partial WebODM task to add the images to')
+    p.add_argument('-n', '--name', default='odk2odm',
+                   help='Name of the new task')
+    p.add_argument('-b', '--batch_size', type=int, default=8,
+                   help='Initial number of images per request')
+    p.add_argument('--no_commit', action='store_true',
+                   help='Leave the task open for more uploads')
+    args = p.parse_args()
+
+    # Refreshed before it expires, however long the upload takes
+    token = TokenAuth(args.odm_url, args.odm_user, args.odm_password)
+    upload_images(args.odm_url, token, args.odm_project,
+                  find_images(args.inputdir),
+                  task_id=args.task_id, task_name=args.name,
+                  commit=not args.no_commit,
+                  sizer=BatchSizer(initial=args.batch_size))
@@ -2,63 +2,73 @@
 
 import os
 from odk2odm import odk_requests
+from odk2odm import sync_state
+from odk2odm import geopoint
 import argparse
 import csv
-import json
+import itertools
 
 
 def csv_from_odata(url, aut, project,
-                   form, outdir, gc):
-    """Write a CSV to a specified directory using odata for a specified form"""
-    response = (odk_requests.
-                odata_submissions(url, aut, project, form))
-    submissions = response.json()['value']
+                   form, outdir, gc, incremental=False):
+    """
+    Write a CSV to a specified directory using odata for a specified form.
+    With incremental=True, only submissions received since the previous
+    incremental run are fetched, and appended to the existing CSV.
+    """
+    outfilename = os.path.join(outdir, f'{form}.csv')
+    params = None
+    state = None
+    since = None
+    if incremental:
+        state = sync_state.SyncState(os.path.join(outdir,
+                                                  sync_state.SYNC_NAME))
+        since = state.get('csv', project, form)
+        if since and os.path.exists(outfilename):
+            params = {'$filter': sync_state.submitted_after(since)}
+    # Rows are written as the pages arrive, so memory use doesn't grow
+    # with the number of submissions
+    submissions = (odk_requests.
+                   iter_odata_submissions(url, aut, project, form,
+                                          params=params))
+    first = next(submissions, None)
+    if first is None:
+        return
     # Making the unsafe assumption that all rows have the same headers
     # and simply grabbing the headers from the first row
     geocol = int(gc)
-    headers = [x for x in submissions[0]]
+    headers = [x for x in first]
     newheaders = (headers[: geocol] +
                   ['lat', 'lon', 'elevation', 'accuracy'] +
                   headers[geocol :])
-    outfilename = os.path.join(outdir, f'{form}.csv')
-    with open(outfilename, 'w') as outfile:
+    with open(outfilename, 'a' if params else 'w') as outfile:
         w = csv.writer(outfile, delimiter = ';')
-        w.writerow(newheaders)
-        for submission in submissions:
+        if not params:
+            w.writerow(newheaders)
+        latest = since
+        for submission in itertools.chain([first], submissions):
+            latest = sync_state.latest_submission_date([submission], latest)
             row = []
             for header in headers:
                 row.append(submission[header])
             gc_contents = row[geocol - 1]
             geolist = jsonpoint_to_list(gc_contents)
             w.writerow(row[: geocol] + geolist + row[geocol :])
+    if state is not None:
+        state.set('csv', project, form, latest)
 
 
 def jsonpoint_to_list(po):
     """ODK Central returnt point in what is almost a JSON string, 
     except that it is single-quoted instead of double-quoted, 
-    so Python's JSON module freaks out. This ingests that string and
-    returns a tuple of (lat, lon, elevation, accuracy)"""
-    try:
-        doublequotedpointstring = po.replace("'", '"')
-        jsonpoint = json.loads(doublequotedpointstring)
-        lat = jsonpoint['coordinates'][1]
-        lon = jsonpoint['coordinates'][0]
-        ele = jsonpoint['coordinates'][2]
-        acc = jsonpoint['properties']['accuracy']
-        return [lat, lon, ele, acc]
-    except Exception as e:
-        #print(e)
-        #print(po)
-        try:
-            lat = po['coordinates'][1]
-            lon = po['coordinates'][0]
-            ele = po['coordinates'][2]
-            acc = po['properties']['accuracy']
-            return [lat, lon, ele, acc]
-            return ['', '', '', '']
-        except Exception as f:
-            #print(f)
-            return ['', '', '', '']
+    so Python's JSON module freaks out. This ingests that string (or the
+    point as a dict, or a "lat lon elevation accuracy" string) and
+    returns a list of [lat, lon, elevation, accuracy], with empty strings
+    for anything missing"""
+    point = geopoint.parse_geopoint(po)
+    if point is None:
+        return ['', '', '', '']
+    return ['' if x is None else x for x in point]
 
 
 if __name__ == '__main__':
@@ -77,9 +87,13 @@ if __name__ == '__main__':
                    help = 'Directory to write output files')
     p.add_argument('-gc', '--geopoint_column',
                    help = 'Column containing the geopoint, 1-based')
+    p.add_argument('-n', '--incremental', action = 'store_true',
+                   help = 'Only fetch submissions received since the last '
+                   'incremental run, and append them to the CSV')
 
     args = p.parse_args()
 
     csv_from_odata(args.base_url, (args.user, args.password), args.project,
-                   args.form, args.output_directory, args.geopoint_column)
+                   args.form, args.output_directory, args.geopoint_column,
+                   incremental = args.incremental)
 
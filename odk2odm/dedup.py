@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+"""
+Content-hash deduplication of downloaded attachments.
+
+When surveyors resubmit a form, the same photo turns up in several
+submissions, and distinct photos from different submissions can share a
+filename. With deduplication every attachment is downloaded to its own
+submission directory (by_submission/<instanceId>/<filename>), hashed, and
+then either hard-linked into the top of the output directory under a free
+name if its content is new, or replaced by a hard link to the copy already
+there if it isn't. Each distinct image is thus stored once, and the top
+level of the output directory holds every distinct image exactly once, so
+ODM isn't fed duplicates (which inflate matching time with
+matcher-neighbors). Tools that walk a directory recursively skip
+by_submission (see walk_files).
+
+The index mapping content hash to filename is a SQLite database in the
+output directory. Deduplication needs a filesystem with hard links, so it
+can't be used on e.g. FAT/exFAT drives or many SMB shares.
+"""
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+
+from odk2odm.download import CHUNK_SIZE
+
+INDEX_NAME = '.odk2odm_dedup.sqlite'
+SUBMISSIONS_DIR = 'by_submission'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    name TEXT NOT NULL
+);
+"""
+
+
+def file_hash(path, chunk_size=CHUNK_SIZE):
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as infile:
+        for chunk in iter(lambda: infile.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def submission_path(outdir, instance_id, filename):
+    """Where an attachment of a submission is downloaded to"""
+    # instanceIds look like uuid:..., and colons aren't allowed everywhere
+    return os.path.join(outdir, SUBMISSIONS_DIR,
+                        instance_id.replace(':', '_'), filename)
+
+
+def name_variants(filename):
+    """filename, then stem_1.ext, stem_2.ext... for photos sharing a name"""
+    stem, ext = os.path.splitext(filename)
+    yield stem + ext
+    n = 1
+    while True:
+        yield f'{stem}_{n}{ext}'
+        n += 1
+
+
+def supports_hard_links(directory):
+    """True if files in directory can be hard-linked"""
+    with tempfile.TemporaryDirectory(dir=directory) as tmpdir:
+        path = os.path.join(tmpdir, 'file')
+        open(path, 'wb').close()
+        try:
+            os.link(path, path + '.link')
+        except OSError:
+            return False
+        return True
+
+
+def walk_files(directory):
+    """
+    Yield the paths of all files in a directory and its subdirectories,
+    except the per-submission copies of a deduplicated download, which
+    would otherwise turn up twice.
+    """
+    for path, dirs, files in os.walk(directory):
+        dirs[:] = [d for d in dirs if d != SUBMISSIONS_DIR]
+        for f in files:
+            yield os.path.join(path, f)
+
+
+def is_placed(path):
+    """True if a downloaded file has already been linked into place"""
+    return os.stat(path).st_nlink > 1
+
+
+class DedupIndex(object):
+    """Index of the distinct files in an output directory by content hash"""
+    def __init__(self, outdir):
+        if not supports_hard_links(outdir):
+            raise OSError(f'{outdir} is on a filesystem without hard links, '
+                          f'which deduplication needs')
+        self.outdir = outdir
+        self.duplicates = 0
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(outdir, INDEX_NAME),
+                                  check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+    def _claim_name(self, path):
+        """Hard-link path into outdir under its own name, or a free variant"""
+        for name in name_variants(os.path.basename(path)):
+            try:
+                os.link(path, os.path.join(self.outdir, name))
+                return name
+            except FileExistsError:
+                # A different photo with the same filename
+                continue
+
+    def place(self, path):
+        """
+        Link a downloaded file into the output directory if its content is
+        new, or replace it with a hard link to the identical file already
+        there. Returns the path of the distinct copy.
+        """
+        digest = file_hash(path)
+        with self._lock:
+            row = self.db.execute('SELECT name FROM blobs WHERE hash=?',
+                                  (digest,)).fetchone()
+            if row and os.path.exists(os.path.join(self.outdir, row[0])):
+                canonical = os.path.join(self.outdir, row[0])
+                tmppath = path + '.link'
+                os.link(canonical, tmppath)
+                os.replace(tmppath, path)
+                self.duplicates += 1
+                return canonical
+            name = self._claim_name(path)
+            with self.db:
+                self.db.execute('INSERT OR REPLACE INTO blobs (hash, name) '
+                                'VALUES (?, ?)', (digest, name))
+            return os.path.join(self.outdir, name)
+
+
+class SeenContent(object):
+    """Thread-safe record of content hashes, for deduplicating in memory"""
+    def __init__(self):
+        self.hashes = set()
+        self.duplicates = 0
+        self._lock = threading.Lock()
+
+    def add(self, data):
+        """Record bytes; return False if identical bytes were seen before"""
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if digest in self.hashes:
+                self.duplicates += 1
+                return False
+            self.hashes.add(digest)
+            return True
+
+
+class UniqueNames(object):
+    """Thread-safe record of the filenames handed out, for uploads"""
+    def __init__(self):
+        self.names = set()
+        self._lock = threading.Lock()
+
+    def claim(self, filename):
+        """filename, or the first variant of it not handed out before"""
+        with self._lock:
+            for name in name_variants(filename):
+                if name not in self.names:
+                    self.names.add(name)
+                    return name
@@ -0,0 +1,289 @@
+#!/usr/bin/python3
+"""
+Helpers to write HTTP responses to disk without holding them in memory.
+
+Responses must be requested with stream=True; the body is then written in
+fixed-size chunks to a .part file next to the destination, which is only
+renamed to the final name once the whole body has arrived. Peak memory per
+download is therefore one chunk, whatever the size of the file. A .part file
+left behind by an interrupted download can be completed with resume_to_file.
+
+Large files can also be fetched as several byte ranges at once with
+download_segments, which helps when a single connection can't fill the
+available bandwidth.
+"""
+import glob
+import hashlib
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+# 1 MiB chunks: large enough to keep syscall overhead negligible, small
+# enough that dozens of concurrent downloads stay cheap.
+CHUNK_SIZE = 1024 * 1024
+
+
+def part_path(outfilepath):
+    """Path of the temporary file an unfinished download is written to"""
+    return outfilepath + '.part'
+
+
+def expected_length(response):
+    """Content-Length of a response as an int, or None if it can't be known"""
+    length = response.headers.get('Content-Length')
+    # A compressed body is decoded by requests, so its size on disk won't
+    # match the Content-Length sent over the wire.
+    if length is None or response.headers.get('Content-Encoding'):
+        return None
+    return int(length)
+
+
+def stream_to_file(response, outfilepath, chunk_size=CHUNK_SIZE):
+    """
+    Write a streamed response to outfilepath in chunks of chunk_size bytes,
+    atomically renaming the temporary file into place when complete.
+    Raises IOError if fewer bytes arrive than announced. Returns the number
+    of bytes written.
+    """
+    partpath = part_path(outfilepath)
+    nbytes = 0
+    try:
+        with open(partpath, 'wb') as outfile:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                outfile.write(chunk)
+                nbytes += len(chunk)
+        length = expected_length(response)
+        if length is not None and nbytes != length:
+            raise IOError(f'{outfilepath} truncated: got {nbytes} '
+                          f'of {length} bytes')
+        os.replace(partpath, outfilepath)
+    except BaseException:
+        if os.path.exists(partpath):
+            os.remove(partpath)
+        raise
+    finally:
+        response.close()
+    return nbytes
+
+
+def content_range(response):
+    """
+    Parse a Content-Range header like 'bytes 100-199/2000' (or 'bytes */2000'
+    on a 416 reply) into a tuple of (first byte, total size); either may be
+    None if absent.
+    """
+    crange = response.headers.get('Content-Range', '')
+    span, _, total = crange.partition(' ')[2].partition('/')
+    first = span.partition('-')[0]
+    return (int(first) if first.isdigit() else None,
+            int(total) if total.isdigit() else None)
+
+
+def resume_to_file(fetch, outfilepath, etag=None, on_response=None,
+                   chunk_size=CHUNK_SIZE):
+    """
+    Like stream_to_file, but pick up where an earlier attempt stopped.
+    fetch is called with a dict of extra request headers and must return
+    a streamed response. If a .part file is present only the missing bytes
+    are requested with a Range header; If-Range with the etag of the first
+    attempt makes the server send the whole file again if it has changed.
+    on_response(size, etag) is called with the total size and ETag as soon
+    as they are known, before the body is read, so they can be persisted.
+    The .part file is kept when the transfer breaks off.
+    Returns the number of bytes received by this call.
+    """
+    partpath = part_path(outfilepath)
+    offset = os.path.getsize(partpath) if os.path.exists(partpath) else 0
+    headers = {}
+    if offset:
+        headers['Range'] = f'bytes={offset}-'
+        if etag:
+            headers['If-Range'] = etag
+    response = fetch(headers)
+    try:
+        if response.status_code == 416:
+            # Nothing left to send: either the .part file is already whole,
+            # or it is longer than the file on the server and useless.
+            total = content_range(response)[1]
+            if total != offset:
+                os.remove(partpath)
+                raise IOError(f'{partpath} does not match the server copy')
+            os.replace(partpath, outfilepath)
+            return 0
+        if response.status_code == 206:
+            first, total = content_range(response)
+            if first != offset:
+                os.remove(partpath)
+                raise IOError(f'Server resumed {outfilepath} at byte '
+                              f'{first} instead of {offset}')
+            mode = 'ab'
+        elif response.status_code == 200:
+            offset = 0
+            total = expected_length(response)
+            mode = 'wb'
+        else:
+            raise IOError(f'HTTP {response.status_code}')
+        if on_response:
+            on_response(total, response.headers.get('ETag'))
+        received = 0
+        with open(partpath, mode) as outfile:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                outfile.write(chunk)
+                received += len(chunk)
+        if total is not None and offset + received != total:
+            raise IOError(f'{outfilepath} truncated: got {offset + received} '
+                          f'of {total} bytes')
+        os.replace(partpath, outfilepath)
+    finally:
+        response.close()
+    return received
+
+
+def etag_path(outfilepath):
+    """Path of the file holding the ETag of an unfinished download"""
+    return part_path(outfilepath) + '.etag'
+
+
+def resume_tagged(fetch, outfilepath, etag, chunk_size=CHUNK_SIZE):
+    """
+    resume_to_file for downloads without a manifest to keep the ETag in:
+    the ETag a .part file was started with is kept in a file next to it,
+    and a .part file of a different or unknown ETag is started afresh
+    instead of being continued with bytes of the current version.
+    etag is the current ETag of the file on the server.
+    Returns the number of bytes received by this call.
+    """
+    partpath = part_path(outfilepath)
+    tagpath = etag_path(outfilepath)
+    saved = None
+    if os.path.exists(tagpath):
+        with open(tagpath) as tagfile:
+            saved = tagfile.read() or None
+    if os.path.exists(partpath) and (etag is None or saved != etag):
+        os.remove(partpath)
+
+    def remember(size, etag):
+        with open(tagpath, 'w') as tagfile:
+            tagfile.write(etag or '')
+
+    received = resume_to_file(fetch, outfilepath, etag=etag,
+                              on_response=remember, chunk_size=chunk_size)
+    if os.path.exists(tagpath):
+        os.remove(tagpath)
+    return received
+
+
+# Ranges smaller than this aren't worth a connection of their own
+MIN_SEGMENT = 8 * 1024 * 1024
+
+
+def probe(fetch):
+    """
+    Ask for the first byte of a file to learn its size, its ETag and
+    whether the server honours Range requests. Returns a tuple of
+    (total size or None, ETag or None, True if ranges are supported).
+    """
+    response = fetch({'Range': 'bytes=0-0'})
+    try:
+        if response.status_code == 206:
+            total = content_range(response)[1]
+            return total, response.headers.get('ETag'), total is not None
+        if response.status_code == 200:
+            return (expected_length(response), response.headers.get('ETag'),
+                    False)
+        raise IOError(f'HTTP {response.status_code}')
+    finally:
+        response.close()
+
+
+def segment_ranges(total, segments, min_segment=MIN_SEGMENT):
+    """Split total bytes into at most segments (first, last) byte ranges"""
+    n = max(1, min(segments, total // min_segment))
+    size = -(-total // n)
+    return [(first, min(first + size, total) - 1)
+            for first in range(0, total, size)]
+
+
+def segment_path(outfilepath, etag, first, last):
+    """Path of the .part file for one byte range of a download"""
+    tag = hashlib.sha1((etag or '').encode()).hexdigest()[:8]
+    return f'{part_path(outfilepath)}.{tag}.{first}-{last}'
+
+
+def fetch_segment(fetch, path, first, last, etag=None,
+                  chunk_size=CHUNK_SIZE):
+    """
+    Download the bytes first..last (inclusive) of a file to path,
+    continuing after whatever path already holds. Returns the number of
+    bytes received by this call.
+    """
+    have = os.path.getsize(path) if os.path.exists(path) else 0
+    length = last - first + 1
+    if have == length:
+        return 0
+    if have > length:
+        os.remove(path)
+        have = 0
+    headers = {'Range': f'bytes={first + have}-{last}'}
+    if etag:
+        headers['If-Range'] = etag
+    response = fetch(headers)
+    try:
+        if response.status_code != 206:
+            # A 200 to an If-Range request means the file has changed
+            raise IOError(f'HTTP {response.status_code} for bytes '
+                          f'{first + have}-{last}')
+        if content_range(response)[0] != first + have:
+            raise IOError(f'Server sent the wrong range for bytes '
+                          f'{first + have}-{last}')
+        received = 0
+        with open(path, 'ab') as outfile:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                outfile.write(chunk)
+                received += len(chunk)
+    finally:
+        response.close()
+    if have + received != length:
+        raise IOError(f'{path} truncated: got {have + received} of '
+                      f'{length} bytes')
+    return received
+
+
+def download_segments(fetch, outfilepath, total, etag=None, segments=4,
+                      min_segment=MIN_SEGMENT, chunk_size=CHUNK_SIZE):
+    """
+    Download a file of total bytes, from a server that supports Range
+    requests, as up to segments byte ranges fetched in parallel, each into
+    its own .part file. fetch is called with a dict of request headers and
+    must return a streamed response, and may be called from several
+    threads at once. Segments that were (partly) downloaded by an earlier
+    call for the same ETag are continued. Once all have arrived they are
+    joined, the size is checked, and the file is renamed into place.
+    Returns the number of bytes received by this call.
+    """
+    ranges = segment_ranges(total, segments, min_segment)
+    paths = [segment_path(outfilepath, etag, first, last)
+             for first, last in ranges]
+    # Segments of an earlier version of the file, or split differently
+    for stale in glob.glob(glob.escape(part_path(outfilepath)) + '.*'):
+        if stale not in paths:
+            os.remove(stale)
+    with ThreadPoolExecutor(len(ranges)) as pool:
+        futures = [pool.submit(fetch_segment, fetch, path, first, last,
+                               etag, chunk_size)
+                   for path, (first, last) in zip(paths, ranges)]
+        # Raises the first error, after the other segments have finished
+        # (and kept what they received)
+        received = sum(future.result() for future in futures)
+    partpath = part_path(outfilepath)
+    with open(partpath, 'wb') as outfile:
+        for path in paths:
+            with open(path, 'rb') as segment:
+                shutil.copyfileobj(segment, outfile, chunk_size)
+    if os.path.getsize(partpath) != total:
+        os.remove(partpath)
+        raise IOError(f'{outfilepath}: joined segments are not {total} bytes')
+    os.replace(partpath, outfilepath)
+    for path in paths:
+        os.remove(path)
+    return received
@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+"""
+On-disk cache of the GPS locations read from image EXIF data.
+
+Locations are stored in a SQLite database keyed by file path, size and
+modification time, so a re-run over a folder that has grown only has to
+parse the new or changed images. Images without a usable location are
+cached too (with empty coordinates), so they aren't parsed again either.
+"""
+import sqlite3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS locations (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    lat REAL,
+    lon REAL,
+    alt REAL
+);
+"""
+
+
+def file_key(stat):
+    """The (size, mtime) part of the cache key from an os.stat result"""
+    return stat.st_size, stat.st_mtime_ns
+
+
+class LocationCache(object):
+    """SQLite cache of (lat, lon, alt) per image file"""
+    def __init__(self, path, invalidate=False):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        if invalidate:
+            self.db.execute('DROP TABLE IF EXISTS locations')
+        self.db.executescript(SCHEMA)
+        self.pending = []
+
+    def load(self):
+        """
+        Return a dict of path -> ((size, mtime), crds) for all cached files,
+        where crds is a (lat, lon, alt) tuple or None, read in one query.
+        """
+        entries = {}
+        for path, size, mtime, lat, lon, alt in self.db.execute(
+                'SELECT path, size, mtime, lat, lon, alt FROM locations'):
+            crds = None if lat is None else (lat, lon, alt)
+            entries[path] = ((size, mtime), crds)
+        return entries
+
+    def add(self, path, key, crds, batch=1000):
+        """Store the location (or None) of a file, written in batches"""
+        self.pending.append((path,) + tuple(key) + tuple(crds or (None,) * 3))
+        if len(self.pending) >= batch:
+            self.flush()
+
+    def flush(self):
+        with self.db:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO locations '
+                '(path, size, mtime, lat, lon, alt) VALUES (?, ?, ?, ?, ?, ?)',
+                self.pending)
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.db.close()
@@ -19,18 +19,21 @@ Might be sensible to rewrite using PIL (or pillow) library to make it a more
 common dependency. Not urgent.
 """
 import os
-import sys
 import csv
+import argparse
+import multiprocessing
 import exifread
 
+from odk2odm.dedup import walk_files
+from odk2odm.exif_cache import LocationCache, file_key
+from odk2odm.throughput import Throughput
+
+CACHE_SUFFIX = '.exifcache.sqlite'
+
 
 def scandir(dir):
     """Walk recursively through a directory and return a list of all files in it"""
-    filelist = []
-    for path, dirs, files in os.walk(dir):
-        for f in files:
-            filelist.append(os.path.join(path, f))
-    return filelist
+    return list(walk_files(dir))
 
 
 def exif_GPS_to_decimal_degrees(intag):
@@ -49,18 +52,142 @@ def exif_GPS_alt_to_decimal_m(intag):
     return alt.decimal()
 
 
-def extract_location(infile):
-    """Return the GPS lat and long of a photo from EXIF in decimal degrees"""
+# JPEG markers and TIFF tags needed to find the GPS IFD
+JPEG_SOI = b'\xff\xd8'
+JPEG_APP1 = 0xE1
+JPEG_SOS = 0xDA
+TIFF_GPS_IFD = 0x8825
+GPS_TAGS = {1: 'latref', 2: 'lat', 3: 'lonref', 4: 'lon', 6: 'alt'}
+# Byte sizes of the TIFF field types that can occur in the GPS tags
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 10: 8}
+
+
+def read_exif_segment(f):
+    """
+    Return the TIFF data of the EXIF (APP1) segment of an open JPEG file,
+    or None if there is none. Only the segment headers before it and the
+    segment itself are read, never the image data, so this costs a few KB
+    of I/O whatever the size of the image. Raises ValueError if the file
+    isn't a JPEG or its segments can't be followed.
+    """
+    if f.read(2) != JPEG_SOI:
+        raise ValueError('not a JPEG file')
+    while True:
+        header = f.read(4)
+        if len(header) < 4 or header[0] != 0xFF:
+            raise ValueError('broken JPEG segment header')
+        marker = header[1]
+        length = int.from_bytes(header[2:4], 'big')
+        if marker == JPEG_SOS:
+            return None
+        if marker == JPEG_APP1:
+            segment = f.read(length - 2)
+            if len(segment) < length - 2:
+                raise ValueError('truncated APP1 segment')
+            if segment[:6] == b'Exif\x00\x00':
+                return segment[6:]
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+def parse_gps_ifd(tiff):
+    """
+    Return a dict of the raw GPS tag values in TIFF data (see GPS_TAGS),
+    or None if there is no GPS IFD. Raises ValueError if the TIFF data
+    can't be read.
+    """
+    order = {b'II': 'little', b'MM': 'big'}.get(tiff[:2])
+    if order is None:
+        raise ValueError('unknown TIFF byte order')
+
+    def uint(offset, size):
+        if offset + size > len(tiff):
+            raise ValueError('TIFF offset out of range')
+        return int.from_bytes(tiff[offset:offset + size], order)
+
+    def entries(ifd):
+        for i in range(uint(ifd, 2)):
+            entry = ifd + 2 + 12 * i
+            tag, kind, count = uint(entry, 2), uint(entry + 2, 2), uint(entry + 4, 4)
+            size = TIFF_TYPE_SIZES.get(kind, 1) * count
+            # Values of up to 4 bytes are stored in the entry itself
+            offset = entry + 8 if size <= 4 else uint(entry + 8, 4)
+            yield tag, kind, count, offset
+
+    gps_ifd = None
+    for tag, kind, count, offset in entries(uint(4, 4)):
+        if tag == TIFF_GPS_IFD:
+            gps_ifd = uint(offset, 4)
+    if gps_ifd is None:
+        return None
+    values = {}
+    for tag, kind, count, offset in entries(gps_ifd):
+        if tag not in GPS_TAGS:
+            continue
+        if kind == 2:
+            if offset + count > len(tiff):
+                raise ValueError('TIFF offset out of range')
+            value = tiff[offset:offset + count].rstrip(b'\x00').decode('ascii')
+        elif kind == 5:
+            value = [(uint(offset + 8 * i, 4), uint(offset + 8 * i + 4, 4))
+                     for i in range(count)]
+        else:
+            value = uint(offset, TIFF_TYPE_SIZES.get(kind, 1))
+        values[GPS_TAGS[tag]] = value
+    return values
+
+
+def read_gps_header(infile):
+    """
+    Return the GPS (lat, lon, alt) of a JPEG in decimal degrees and meters
+    by reading only its EXIF header, or None if it has no usable GPS tags.
+    A fast alternative to parsing all tags with exifread. Raises ValueError
+    if the JPEG or TIFF structure of the header can't be read.
+    """
+    with open(infile, 'rb') as f:
+        tiff = read_exif_segment(f)
+    if not tiff:
+        return None
+    gps = parse_gps_ifd(tiff)
+    if gps is None:
+        return None
+    try:
+        lat = sum(n / d / 60 ** i for i, (n, d) in enumerate(gps['lat']))
+        lon = sum(n / d / 60 ** i for i, (n, d) in enumerate(gps['lon']))
+        alt = gps['alt'][0][0] / gps['alt'][0][1]
+    except (KeyError, IndexError, ZeroDivisionError, TypeError, ValueError):
+        return None
+    if gps.get('latref') == 'S':
+        lat = -lat
+    if gps.get('lonref') == 'W':
+        lon = -lon
+    return(lat, lon, alt)
+
+
+def extract_location(infile, header_only=True):
+    """
+    Return the GPS lat and long of a photo from EXIF in decimal degrees,
+    or None if it has none.
+    By default only the EXIF header is read (see read_gps_header), and
+    exifread is only used for files whose header that fast path can't read.
+    """
+    if header_only:
+        try:
+            return read_gps_header(infile)
+        except ValueError:
+            pass
     with open(infile, 'rb') as f:
         try:
-            tags = exifread.process_file(f)
+            # details=False skips the MakerNote, which we don't need
+            tags = exifread.process_file(f, details=False)
             lattag = tags.get('GPS GPSLatitude')
             latref = tags.get('GPS GPSLatitudeRef')
             lontag = tags.get('GPS GPSLongitude')
             lonref = tags.get('GPS GPSLongitudeRef')
             alttag = tags.get('GPS GPSAltitude')
             altref = tags.get('GPS GPSAltitudeRef')
-            
+            if lattag is None or lontag is None:
+                return None
     
             lat = exif_GPS_to_decimal_degrees(lattag)
             lon = exif_GPS_to_decimal_degrees(lontag)
@@ -75,24 +202,86 @@ def extract_location(infile):
             print('The photo {} failed for some reason'.format(infile))
 
 
-def create_geotag_list(indir):
-    """Create a CSV file with a list of photos and their lat & long"""
+def is_jpeg(path):
+    return os.path.splitext(path)[1] in ('.JPG', '.jpg')
+
+
+def create_geotag_list(indir, processes=1, chunksize=64, cache=True,
+                       invalidate_cache=False):
+    """
+    Create a CSV file with a list of photos and their lat & long.
+    With processes > 1 (or None for one per CPU core) the EXIF data are
+    read by a pool of processes. Rows are written in directory order as
+    the results come back, and the number of images per second is printed.
+    Unless cache=False, locations are cached next to the CSV file (see
+    exif_cache.py), so only new or changed images are read on later runs;
+    invalidate_cache=True throws the cached locations away first.
+    """
     outfile = indir + '.csv'
-    image_files = scandir(indir)
-    writer = csv.writer(open(outfile, 'w'), delimiter = ',')
-    writer.writerow(['file', 'path', 'directory', 'lat', 'lon', 'alt'])
-    
-    for image_file in image_files:
-        (image_path, image_ext) = os.path.splitext(image_file)
-        image_filename = os.path.basename(image_file)
-        image_dirname = os.path.dirname(image_file)
-        if(image_ext == '.JPG' or image_ext == '.jpg'):
-            crds = extract_location(image_file)
-            if(crds):
-                writer.writerow([image_filename, image_file, image_dirname,
-                                 crds[0], crds[1], crds[2]]) 
+    image_files = [f for f in scandir(indir) if is_jpeg(f)]
+    stats = Throughput('images')
+    keys = {}
+    cached = {}
+    location_cache = None
+    if cache:
+        location_cache = LocationCache(indir + CACHE_SUFFIX,
+                                       invalidate=invalidate_cache)
+        cached = location_cache.load()
+        keys = {f: file_key(os.stat(f)) for f in image_files}
+    # Only images that aren't cached with the same size and mtime are read
+    todo = [f for f in image_files
+            if f not in cached or cached[f][0] != keys[f]]
+    with open(outfile, 'w') as csvfile:
+        writer = csv.writer(csvfile, delimiter = ',')
+        writer.writerow(['file', 'path', 'directory', 'lat', 'lon', 'alt'])
+        if processes == 1:
+            results = map(extract_location, todo)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(processes)
+            # imap returns the results in the order of todo
+            results = pool.imap(extract_location, todo, chunksize)
+        try:
+            for image_file in image_files:
+                if image_file in cached and cached[image_file][0] == keys[image_file]:
+                    crds = cached[image_file][1]
+                else:
+                    crds = next(results)
+                    if location_cache is not None:
+                        location_cache.add(image_file, keys[image_file], crds)
+                image_filename = os.path.basename(image_file)
+                image_dirname = os.path.dirname(image_file)
+                if(crds):
+                    writer.writerow([image_filename, image_file,
+                                     image_dirname, crds[0], crds[1],
+                                     crds[2]])
+                    stats.add()
+                else:
+                    stats.fail()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            if location_cache is not None:
+                location_cache.close()
+    print(stats.summary())
+    print(f'{len(image_files) - len(todo)} locations came from the cache')
 
 
 if __name__ == "__main__":
-    """Expects a directory as the sole argument"""
-    create_geotag_list(sys.argv[1])
+    """Expects a directory as the first argument"""
+    p = argparse.ArgumentParser(description='Write the GPS locations of all '
+                                'JPG images in a directory to a CSV file')
+    p.add_argument('inputdir', help='Directory with images')
+    p.add_argument('-p', '--processes', type=int, default=None,
+                   help='Number of processes to read images with '
+                   '(default: one per CPU core)')
+    p.add_argument('--no_cache', action='store_true',
+                   help='Read every image instead of using cached locations')
+    p.add_argument('--invalidate_cache', action='store_true',
+                   help='Throw away cached locations and read every image')
+    args = p.parse_args()
+
+    create_geotag_list(args.inputdir, processes=args.processes,
+                       cache=not args.no_cache,
+                       invalidate_cache=args.invalidate_cache)
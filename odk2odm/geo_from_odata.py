@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+"""
+Produces a geo.txt file for OpenDroneMap straight from the OData feed of an
+ODK Central form, without writing a CSV and counting columns for
+make_geo_txt.
+
+The geopoint and photo fields are given by name. Fields inside groups are
+given as paths, like survey/location or photos/photo_north, because that
+is how they are nested in the OData rows. Submissions are fetched in pages
+and geo.txt is written as they arrive.
+"""
+import argparse
+import csv
+import os
+
+from odk2odm import odk_requests
+from odk2odm.geopoint import parse_geopoint
+
+
+def field_path(name):
+    """Split a field path like group/field into its parts"""
+    return tuple(part for part in name.strip().split('/') if part)
+
+
+def field_value(submission, path):
+    """The value of a field in a submission, or None if it isn't there"""
+    value = submission
+    for part in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def geo_txt_from_odata(url, aut, project, form, outdir, geopoint, photos,
+                       proj='EPSG:4326', batch=10000, session=None):
+    """
+    Write geo.txt to outdir with a line per photo, located at the geopoint
+    of its submission. geopoint is the path of the geopoint field and
+    photos a list of the paths of the photo fields. Returns the number of
+    photos written.
+    """
+    geopath = field_path(geopoint)
+    photopaths = [field_path(p) for p in photos]
+    outfile = os.path.join(outdir, 'geo.txt')
+    submissions = odk_requests.iter_odata_submissions(url, aut, project, form,
+                                                      session=session)
+    written = 0
+    unlocated = 0
+    with open(outfile, 'w', newline='', buffering=1 << 20) as geofile:
+        w = csv.writer(geofile, delimiter=' ', lineterminator='\n')
+        w.writerow([proj])
+        lines = []
+        for submission in submissions:
+            names = [field_value(submission, p) for p in photopaths]
+            names = [n for n in names if n]
+            if not names:
+                continue
+            point = parse_geopoint(field_value(submission, geopath))
+            if point is None:
+                unlocated += len(names)
+                continue
+            lat, lon, ele, acc = point
+            # geo.txt columns: name, x, y, z, omega, phi, kappa and the
+            # optional horizontal and vertical accuracy
+            location = [lon, lat, 0 if ele is None else ele, 0, 0, 0]
+            if acc is not None:
+                location += [acc, acc]
+            lines.extend([name] + location for name in names)
+            if len(lines) >= batch:
+                w.writerows(lines)
+                written += len(lines)
+                lines = []
+        w.writerows(lines)
+        written += len(lines)
+    print(f'{written} photos written to {outfile}')
+    if unlocated:
+        print(f'{unlocated} photos left out, their submissions have no '
+              f'location')
+    return written
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Write a geo.txt for ODM from '
+                                'the submissions to an ODK Central form')
+    p.add_argument('-url', '--base_url',
+                   help = 'Server URL')
+    p.add_argument('-u', '--user',
+                   help = 'ODK Central username (usually email)')
+    p.add_argument('-pw', '--password',
+                   help = 'ODK Central password')
+    p.add_argument('-p', '--project',
+                   help = 'the project in question')
+    p.add_argument('-f', '--form',
+                   help = 'Unique name of the relevant form')
+    p.add_argument('-od', '--output_directory',
+                   help = 'Directory to write geo.txt to, usually where the '
+                   'attachments are')
+    p.add_argument('-g', '--geopoint', required = True,
+                   help = 'Name of the geopoint field, as a path like '
+                   'group/field if it is in a group')
+    p.add_argument('-ph', '--photos', required = True,
+                   help = 'Comma-separated names of the photo fields, as '
+                   'paths like group/field if they are in a group')
+    p.add_argument('-proj', '--projection', default = 'EPSG:4326',
+                   help = 'Coordinate Reference System')
+
+    args = p.parse_args()
+
+    geo_txt_from_odata(args.base_url, (args.user, args.password),
+                       args.project, args.form, args.output_directory,
+                       args.geopoint, args.photos.split(','),
+                       proj = args.projection)
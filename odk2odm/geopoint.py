@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+"""
+Decoding of ODK geopoints, in each of the forms they turn up in:
+
+- a GeoJSON dict, as in the OData rows of ODK Central:
+  {'type': 'Point', 'coordinates': [lon, lat, alt],
+   'properties': {'accuracy': acc}}
+- the same dict written out by Python (single-quoted, so not JSON), as
+  found in CSVs made from the OData rows
+- the JavaRosa string "lat lon alt acc", as in ODK Central's own CSV
+  exports, where altitude and accuracy may be left out
+
+Strings are matched with regular expressions rather than json.loads, and
+anything that isn't a geopoint gives None rather than an exception.
+"""
+import math
+import re
+from array import array
+
+_NUMBER = r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?'
+_JAVAROSA = re.compile(rf'\s*({_NUMBER})\s+({_NUMBER})'
+                       rf'(?:\s+({_NUMBER}))?(?:\s+({_NUMBER}))?\s*$')
+# A missing elevation is written out as None by Python and null in JSON
+_COORDINATES = re.compile(rf'coordinates[\'"]\s*:\s*\[\s*({_NUMBER})\s*,'
+                          rf'\s*({_NUMBER})\s*'
+                          rf'(?:,\s*(?:({_NUMBER})|None|null)\s*)?\]')
+_ACCURACY = re.compile(rf'accuracy[\'"]\s*:\s*({_NUMBER})')
+
+
+def _float(s):
+    return None if s is None else float(s)
+
+
+def parse_geopoint(value):
+    """
+    Return (lat, lon, elevation, accuracy) as floats from a geopoint in any
+    of the forms above, with None for a missing elevation or accuracy, or
+    None if the value is empty or isn't a geopoint.
+    """
+    if isinstance(value, dict):
+        coordinates = value.get('coordinates') or ()
+        if len(coordinates) < 2 or None in coordinates[:2]:
+            return None
+        properties = value.get('properties') or {}
+        return (_float(coordinates[1]), _float(coordinates[0]),
+                _float(coordinates[2]) if len(coordinates) > 2 else None,
+                _float(properties.get('accuracy')))
+    if not isinstance(value, str) or not value:
+        return None
+    if '{' in value:
+        match = _COORDINATES.search(value)
+        if not match:
+            return None
+        lon, lat, ele = match.groups()
+        accuracy = _ACCURACY.search(value)
+        return (float(lat), float(lon), _float(ele),
+                _float(accuracy and accuracy.group(1)))
+    match = _JAVAROSA.match(value)
+    if not match:
+        return None
+    lat, lon, ele, acc = match.groups()
+    return float(lat), float(lon), _float(ele), _float(acc)
+
+
+def geopoint_arrays(values):
+    """
+    Decode a column of geopoints into four arrays of doubles (lat, lon,
+    elevation, accuracy), with NaN wherever a value is missing.
+    """
+    columns = tuple(array('d') for _ in range(4))
+    missing = (math.nan,) * 4
+    for value in values:
+        point = parse_geopoint(value) or missing
+        for column, x in zip(columns, point):
+            column.append(math.nan if x is None else x)
+    return columns
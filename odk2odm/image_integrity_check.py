@@ -1,47 +1,124 @@
 #!/usr/bin/python3
 import os
-import sys
+import argparse
+import multiprocessing
 from pathlib import Path
 from PIL import Image
 
+from odk2odm.dedup import walk_files
+from odk2odm.throughput import Throughput
+
+# How thoroughly to check, from cheapest to most expensive:
+# header - the file can be opened as an image (only the header is read)
+# eoi    - the header is fine and a JPEG ends in an end-of-image marker,
+#          which catches the truncated files left by interrupted downloads
+# verify - the header is fine, PIL's verify() passes and a JPEG has its
+#          end-of-image marker
+# decode - all pixel data can be decoded, and a JPEG has its end-of-image
+#          marker
+LEVELS = ('header', 'eoi', 'verify', 'decode')
+JPEG_EOI = b'\xff\xd9'
+
+
+def iter_files(indir):
+    """Yield the paths of all files in a directory and its subdirectories"""
+    return walk_files(indir)
+
+
+def has_jpeg_eoi(f):
+    """True if a JPEG file ends with the end-of-image marker"""
+    with open(f, 'rb') as infile:
+        infile.seek(0, os.SEEK_END)
+        infile.seek(max(infile.tell() - 1024, 0))
+        # Some cameras pad the file with zeros after the marker
+        return infile.read().rstrip(b'\x00').endswith(JPEG_EOI)
+
+
+def check_image(f, level='header'):
+    """
+    Check an image file at the given level (see LEVELS). Returns a tuple of
+    the path and None if the image is fine, or the error message if not.
+    """
+    try:
+        with Image.open(f) as image:
+            is_jpeg = image.format == 'JPEG'
+            if level != 'header' and is_jpeg and not has_jpeg_eoi(f):
+                return f, 'JPEG end of image marker missing, truncated file?'
+            if level == 'verify':
+                image.verify()
+            elif level == 'decode':
+                image.load()
+        return f, None
+    except Exception as e:
+        return f, str(e) or repr(e)
 
-def checkimages(indir):
-    """returns a list of image files that can be successfully opened by PIL"""
-    filelist = []
-    for path, dirs, files in os.walk(indir):
-        for f in files:
-            filelist.append(os.path.join(path, f))
 
+def iter_checked(indir, level='header', processes=None, chunksize=16):
+    """
+    Yield (path, error) for every file in indir as soon as it is checked,
+    in no particular order, using a pool of processes (None for one per
+    CPU core, 1 to check in this process).
+    """
+    if processes == 1:
+        for f in iter_files(indir):
+            yield check_image(f, level)
+        return
+    with multiprocessing.Pool(processes) as pool:
+        tasks = ((f, level) for f in iter_files(indir))
+        yield from pool.imap_unordered(_check_image_args, tasks, chunksize)
+
+
+def _check_image_args(args):
+    return check_image(*args)
+
+
+def checkimages(indir, level='header', processes=1):
+    """returns a list of image files that can be successfully opened by PIL"""
     goodfiles = []
     badfiles = []
-    for f in filelist:
-        try:
-            image = Image.open(f)
+    for f, error in iter_checked(indir, level, processes):
+        if error is None:
             goodfiles.append(f)
-        except Exception as e:
-            print(e)
+        else:
+            print(error)
             badfiles.append(f)
     return goodfiles, badfiles
 
 
-def write_file_lists(indir):
+def write_file_lists(indir, level='header', processes=None):
     """Write two text files with the good and bad image files in the parent
-    directory of the input directory"""
+    directory of the input directory. Files are written to the lists as
+    soon as they have been checked."""
     path = Path(indir)
     parent = path.parent
     goodfilepath = Path.joinpath(parent, 'goodfiles.txt')
     badfilepath = Path.joinpath(parent, 'badfiles.txt')
-    (goodfiles, badfiles) = checkimages(indir)
-    with open(goodfilepath, 'w') as gf:
-        for f in goodfiles:
-            gf.write(f'{f}\n')
-    with open(badfilepath, 'w') as bf:
-        for f in badfiles:
-            bf.write(f'{f}\n')
-    
+    stats = Throughput('images')
+    with open(goodfilepath, 'w') as gf, open(badfilepath, 'w') as bf:
+        for f, error in iter_checked(indir, level, processes):
+            if error is None:
+                gf.write(f'{f}\n')
+                stats.add(os.path.getsize(f))
+            else:
+                print(f'{f}: {error}')
+                bf.write(f'{f}\n')
+                stats.fail()
+    print(stats.summary())
+
 
 if __name__ == "__main__":
-    """Checks a directory full of images. 1 argument, a directory. 
+    """Checks a directory full of images. 1 argument, a directory.
     Outputs two text files in the parent directory of the input directory."""
-    
-    write_file_lists(sys.argv[1])
+    p = argparse.ArgumentParser(description='Check a directory of images '
+                                'and list the good and bad ones in '
+                                'goodfiles.txt and badfiles.txt in its '
+                                'parent directory')
+    p.add_argument('inputdir', help='Directory with images')
+    p.add_argument('-l', '--level', choices=LEVELS, default='header',
+                   help='How thoroughly to check the images')
+    p.add_argument('-p', '--processes', type=int, default=None,
+                   help='Number of processes (default: one per CPU core)')
+    args = p.parse_args()
+
+    write_file_lists(args.inputdir, level=args.level,
+                     processes=args.processes)
@@ -30,45 +30,57 @@ comma, which is the default delimiter in files exported from ODK Central.
 """
 import os
 import csv
+import operator
 import re
 import argparse
 import string
 
 
 def make_geo_txt(infile, colrange, lonc, latc,
-                 elec, accc, proj, dlm):
+                 elec, accc, proj, dlm, batch=10000):
     """
     make a list of photo locations so that ODM
     can process them efficiently.
+
+    The input is read a row at a time and geo.txt is written in batches of
+    lines, so memory use stays constant however large the CSV is.
     """
-    latcol = col2num(latc)
-    loncol = col2num(lonc)
-    elecol = col2num(elec)
-    acccol = col2num(accc)
-    sites = list(csv.reader(open(infile), delimiter=dlm))[1:]
-    cols = parse_range(colrange)
+    # Zero-based indices, worked out once rather than for every photo
+    cols = [c - 1 for c in parse_range(colrange)]
+    loncol, latcol, elecol, acccol = (int(col2num(c)) - 1
+                                      for c in (lonc, latc, elec, accc))
+    location = operator.itemgetter(loncol, latcol, elecol)
+    needed = max(cols + [loncol, latcol, elecol, acccol]) + 1
     outfile = os.path.join(os.path.dirname(infile), 'geo.txt')
     print(outfile)
-    with (open(outfile, 'w')) as csvfile:
-        w = csv.writer(csvfile, delimiter=' ')
+    photos = 0
+    short_rows = 0
+    with open(infile, newline='') as incsv, \
+            open(outfile, 'w', newline='', buffering=1 << 20) as csvfile:
+        sites = csv.reader(incsv, delimiter=dlm)
+        next(sites, None)
+        w = csv.writer(csvfile, delimiter=' ', lineterminator='\n')
         w.writerow([proj])
+        lines = []
         for site in sites:
-            print(site[1])
+            if len(site) < needed:
+                short_rows += 1
+                continue
+            lon, lat, ele = location(site)
+            acc = site[acccol]
             for col in cols:
-                try:
-                    if site[col - 1]:
-                        w.writerow([site[col - 1],
-                                    site[int(loncol) - 1],
-                                    site[int(latcol) - 1],
-                                    site[int(elecol) - 1],
-                                    '0', '0', '0',
-                                    site[int(acccol) - 1],
-                                    site[int(acccol) - 1],
-                                    ])
-                except Exception as e:
-                    print(site)
-                    print(col)
-                    print(e)
+                if site[col]:
+                    lines.append((site[col], lon, lat, ele,
+                                  '0', '0', '0', acc, acc))
+            if len(lines) >= batch:
+                w.writerows(lines)
+                photos += len(lines)
+                lines = []
+        w.writerows(lines)
+        photos += len(lines)
+    print(f'{photos} photos written to {outfile}')
+    if short_rows:
+        print(f'{short_rows} rows skipped, with fewer than {needed} columns')
 
 
 def col2num(col):
@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+"""
+Persistent record of the attachments of ODK Central forms and how far their
+download got, so an interrupted download can be resumed without asking the
+server again about submissions it has already listed.
+
+The manifest is a SQLite database (usually in the output directory). It
+holds one row per submission, flagged once its attachment list has been
+stored, and one row per attachment with its expected size and ETag as
+reported by the server, and whether the file is complete on disk.
+"""
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    project TEXT NOT NULL,
+    form TEXT NOT NULL,
+    instance_id TEXT NOT NULL,
+    listed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (project, form, instance_id)
+);
+CREATE TABLE IF NOT EXISTS attachments (
+    project TEXT NOT NULL,
+    form TEXT NOT NULL,
+    instance_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    etag TEXT,
+    complete INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (project, form, instance_id, name)
+);
+CREATE INDEX IF NOT EXISTS attachments_pending
+    ON attachments (project, form, complete);
+"""
+
+MANIFEST_NAME = '.odk2odm_manifest.sqlite'
+
+
+class DownloadManifest(object):
+    """SQLite-backed download manifest, safe to share between threads"""
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+    def _execute(self, sql, args=()):
+        with self._lock, self.db:
+            return self.db.execute(sql, args).fetchall()
+
+    def listed(self, project, form):
+        """Set of instanceIds of submissions whose attachments are recorded"""
+        rows = self._execute(
+            'SELECT instance_id FROM submissions '
+            'WHERE project=? AND form=? AND listed=1',
+            (str(project), form))
+        return {row['instance_id'] for row in rows}
+
+    def add_submission(self, project, form, instance_id, names, listed=True):
+        """
+        Record the attachment names of a submission. With listed=False the
+        attachment list will be fetched again next time, e.g. because not
+        all attachments have been uploaded to the server yet.
+        """
+        project = str(project)
+        with self._lock, self.db:
+            self.db.executemany(
+                'INSERT OR IGNORE INTO attachments '
+                '(project, form, instance_id, name) VALUES (?, ?, ?, ?)',
+                [(project, form, instance_id, name) for name in names])
+            self.db.execute(
+                'INSERT OR REPLACE INTO submissions '
+                '(project, form, instance_id, listed) VALUES (?, ?, ?, ?)',
+                (project, form, instance_id, int(listed)))
+
+    def attachment(self, project, form, instance_id, name):
+        """Return the row of an attachment as a dict, or None if unknown"""
+        rows = self._execute(
+            'SELECT * FROM attachments '
+            'WHERE project=? AND form=? AND instance_id=? AND name=?',
+            (str(project), form, instance_id, name))
+        return dict(rows[0]) if rows else None
+
+    def names(self, project, form):
+        """Set of all attachment filenames recorded for a form"""
+        rows = self._execute(
+            'SELECT name FROM attachments WHERE project=? AND form=?',
+            (str(project), form))
+        return {row['name'] for row in rows}
+
+    def pending(self, project, form):
+        """List of (instance_id, name) of attachments not yet complete"""
+        rows = self._execute(
+            'SELECT instance_id, name FROM attachments '
+            'WHERE project=? AND form=? AND complete=0',
+            (str(project), form))
+        return [(row['instance_id'], row['name']) for row in rows]
+
+    def set_expected(self, project, form, instance_id, name, size, etag):
+        """Store the size and ETag the server announced for an attachment"""
+        self._execute(
+            'UPDATE attachments SET size=?, etag=? '
+            'WHERE project=? AND form=? AND instance_id=? AND name=?',
+            (size, etag, str(project), form, instance_id, name))
+
+    def set_complete(self, project, form, instance_id, name, size):
+        self._execute(
+            'UPDATE attachments SET complete=1, size=? '
+            'WHERE project=? AND form=? AND instance_id=? AND name=?',
+            (size, str(project), form, instance_id, name))
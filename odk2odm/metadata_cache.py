@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+"""
+A time-limited cache of ODK Central metadata (project, form and app-user
+lists) shared by odk_requests and OdkCentral.
+
+Provisioning a project (looking up ids by name, giving every app user
+access to every form, making QR codes) needs the same few lists over and
+over. With the cache each list is fetched once and reused until it is
+TTL seconds old, or until a call that changes it (creating a project,
+form or app user) invalidates it.
+
+Entries are keyed by tuples that start with the server URL and user, so
+that invalidating a prefix, e.g. (url, user, projectId), drops everything
+cached for that project. To change the TTL or switch caching off (ttl=0):
+
+from odk2odm import metadata_cache
+metadata_cache.set_cache(metadata_cache.MetadataCache(ttl=60))
+"""
+import threading
+import time
+
+TTL = 300
+
+_cache = None
+_lock = threading.Lock()
+
+
+class MetadataCache(object):
+    """Thread-safe dict of values that expire ttl seconds after fetching"""
+    def __init__(self, ttl=TTL):
+        self.ttl = ttl
+        self.entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, fetch):
+        """
+        The cached value for key if it is fresh, otherwise the result of
+        calling fetch(), which is cached. If fetch raises, nothing is cached.
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > now:
+                return entry[1]
+        value = fetch()
+        if self.ttl > 0:
+            with self._lock:
+                self.entries[key] = (now + self.ttl, value)
+        return value
+
+    def invalidate(self, *prefix):
+        """Drop the entries whose keys start with prefix (all if empty)"""
+        n = len(prefix)
+        with self._lock:
+            for key in [k for k in self.entries if k[:n] == prefix]:
+                del self.entries[key]
+
+
+def get_cache():
+    """The shared cache, created with the default TTL on first use"""
+    global _cache
+    with _lock:
+        if _cache is None:
+            _cache = MetadataCache()
+        return _cache
+
+
+def set_cache(cache):
+    """Replace the shared cache, e.g. with one with a different TTL"""
+    global _cache
+    with _lock:
+        _cache = cache
@@ -42,67 +42,115 @@ To see the name of the first project:
 
 r.json()[0]['name']
 
+All requests go through one shared requests.Session (see session.py), so
+that consecutive calls reuse kept-alive connections.
+
+project_list, form_list and app_user_list return the parsed lists instead
+of responses, and keep them in the metadata cache (see metadata_cache.py)
+for a few minutes, so that name lookups and provisioning loops don't fetch
+the same list again and again. The functions creating or deleting
+projects, forms and app users invalidate the lists they change.
+
 """
 
 import sys, os
-import requests
 import json
-import zlib
 #import qrcode
-import codecs
 import urllib
 
+from odk2odm.metadata_cache import get_cache
+from odk2odm.session import get_session
+
 general = {
     "form_update_mode": "match_exactly",
     "autosend": "wifi_and_cellular",
 }
 
 
+def _cache_key(base_url, aut, *path):
+    """Metadata cache key for a list on a server, as seen by a user"""
+    user = aut[0] if isinstance(aut, (tuple, list)) else \
+        getattr(aut, 'username', None)
+    return (base_url, user) + tuple(str(p) for p in path)
+
+
+def _get_json(url, aut):
+    response = get_session().get(url, auth=aut)
+    response.raise_for_status()
+    return response.json()
+
+
+def project_list(base_url, aut):
+    """The projects on the server as a list of dicts, cached"""
+    url = f'{base_url}/v1/projects'
+    return get_cache().get(_cache_key(base_url, aut, 'projects'),
+                           lambda: _get_json(url, aut))
+
+
+def form_list(base_url, aut, projectId):
+    """The forms in a project as a list of dicts, cached"""
+    url = f'{base_url}/v1/projects/{projectId}/forms'
+    return get_cache().get(_cache_key(base_url, aut, projectId, 'forms'),
+                           lambda: _get_json(url, aut))
+
+
+def app_user_list(base_url, aut, projectId):
+    """The app users of a project as a list of dicts, cached"""
+    url = f'{base_url}/v1/projects/{projectId}/app-users'
+    return get_cache().get(_cache_key(base_url, aut, projectId, 'app-users'),
+                           lambda: _get_json(url, aut))
+
+
 def projects(base_url, aut):
     """Fetch a list of projects on an ODK Central server."""
     url = f'{base_url}/v1/projects'
-    return requests.get(url, auth=aut)
+    return get_session().get(url, auth=aut)
 
 
 def project(base_url, aut, projectId):
     """Fetch details of a specific project on an ODK Central server"""
     url = f'{base_url}/v1/projects/{projectId}'
-    return requests.get(url, auth=aut)
+    return get_session().get(url, auth=aut)
     
 
 def project_id(base_url, aut, projectName):
     """Fetch the id of a project based on the name on an ODK Central server."""
-    url = f'{base_url}/v1/projects'
-    projects = requests.get(url, auth=aut).json()
+    projects = project_list(base_url, aut)
     projectId = [p for p in projects if p['name']== projectName][0]['id']
     return projectId
 
 def forms(base_url, aut, projectId):
     """Fetch a list of forms in a project."""
     url = f'{base_url}/v1/projects/{projectId}/forms'
-    return requests.get(url, auth=aut)
+    return get_session().get(url, auth=aut)
 
 
 def form(base_url, aut, projectId, formId):
     """Fetch a list of forms in a project."""
     url = f'{base_url}/v1/projects/{projectId}/forms/{formId}'
-    return requests.get(url, auth=aut)
+    return get_session().get(url, auth=aut)
 
 
-def submissions(base_url, aut, projectId, formId):
+def submissions(base_url, aut, projectId, formId, session=None):
     """Fetch a list of submission instances for a given form."""
     url = f'{base_url}/v1/projects/{projectId}/forms/{formId}/submissions'
-    return requests.get(url, auth=aut)
+    http = session or get_session()
+    return http.get(url, auth=aut)
 
 def users(base_url, aut):
     """Fetch a list of users."""
     url = f'{base_url}/v1/users'
-    return requests.get(url, auth=aut)
+    return get_session().get(url, auth=aut)
 
 def app_users(base_url, aut, projectId):
     """Fetch a list of app-users."""
     url = f'{base_url}/v1/projects/{projectId}/app-users'
-    return requests.get(url, auth=aut)
+    return get_session().get(url, auth=aut)
+
+def form_assignments(base_url, aut, projectId, formId, roleId=2):
+    """Fetch a list of the actors with a specified role on a form."""
+    url = f'{base_url}/v1/projects/{projectId}/forms/{formId}/assignments/{roleId}'
+    return get_session().get(url, auth=aut)
 
 
 # Should work with ?media=false appended but doesn't.
@@ -110,38 +158,86 @@ def app_users(base_url, aut, projectId):
 def csv_submissions(base_url, aut, projectId, formId):
     """Fetch a CSV file of the submissions to a survey form."""
     url = f'{base_url}/v1/projects/{projectId}/forms/{formId}/submissions.csv.zip'
-    return requests.get(url, auth=aut)
+    return get_session().get(url, auth=aut)
 
 
-def odata_submissions(base_url, aut, projectId, formId):
+def odata_submissions(base_url, aut, projectId, formId, params=None,
+                      session=None):
     """
     Fetch the submissions using the odata api. 
     use submissions.json()['value'] to get a list of dicts, wherein 
     each dict is a single submission with the form question names as keys.
+    OData query options can be passed as params, e.g.
+    {'$filter': '__system/submissionDate gt 2022-06-01T00:00:00.000Z'}
     """    
     url = f'{base_url}/v1/projects/{projectId}/forms/{formId}.svc/Submissions'
-    submissions = requests.get(url, auth=aut)
+    http = session or get_session()
+    submissions = http.get(url, auth=aut, params=params)
     return submissions
 
 
-def attachment_list(base_url, aut, projectId, formId, instanceId):
+def iter_odata_submissions(base_url, aut, projectId, formId, params=None,
+                           page_size=1000, session=None):
+    """
+    Generator of the submissions of a form from the odata api, yielding one
+    dict per submission like odata_submissions(...).json()['value'] does,
+    but fetching them in pages of page_size rows with $top/$skip. If the
+    server includes an @odata.nextLink in a page, that is followed instead.
+    Only one page is ever held in memory.
+    """
+    url = f'{base_url}/v1/projects/{projectId}/forms/{formId}.svc/Submissions'
+    http = session or get_session()
+    query = dict(params or {}, **{'$top': page_size})
+    skip = 0
+    while url:
+        response = http.get(url, auth=aut, params=query)
+        response.raise_for_status()
+        page = response.json()
+        rows = page['value']
+        yield from rows
+        if '@odata.nextLink' in page:
+            # The link carries all query options, including $top and $skip
+            url = page['@odata.nextLink']
+            query = None
+        elif query is None or len(rows) < page_size:
+            # Either the last of the nextLink pages, or a short page
+            url = None
+        else:
+            skip += len(rows)
+            query['$skip'] = skip
+
+
+def attachment_list(base_url, aut, projectId, formId, instanceId,
+                    session=None):
     """Fetch an individual media file attachment."""
     url = f'{base_url}/v1/projects/{projectId}/forms/{formId}/submissions/'\
         f'{instanceId}/attachments'
-    return requests.get(url, auth=aut)
+    http = session or get_session()
+    return http.get(url, auth=aut)
 
 
-def attachment(base_url, aut, projectId, formId, instanceId, filename):
-    """Fetch a specific attachment by filename from a submission to a form."""
+def attachment(base_url, aut, projectId, formId, instanceId, filename,
+               session=None, stream=False, headers=None):
+    """
+    Fetch a specific attachment by filename from a submission to a form.
+    Requests go through the shared session of session.py unless another
+    requests.Session is passed as session.
+    With stream=True the body isn't downloaded until it is read, e.g. with
+    download.stream_to_file, so large media never sit in memory whole.
+    Extra headers, such as a Range to resume a download, can be passed in.
+    """
     url = f'{base_url}/v1/projects/{projectId}/forms/{formId}/submissions/'\
         f'{instanceId}/attachments/{filename}'
-    return requests.get(url, auth=aut)
+    http = session or get_session()
+    return http.get(url, auth=aut, stream=stream, headers=headers)
 
 # POST 
 def create_project(base_url, aut, project_name):
     """Create a new project on an ODK Central server"""
     url = f'{base_url}/v1/projects'
-    return requests.post(url, auth=aut, json={'name': project_name})
+    response = get_session().post(url, auth=aut, json={'name': project_name})
+    get_cache().invalidate(*_cache_key(base_url, aut, 'projects'))
+    return response
 
 def create_app_user(base_url, aut, projectId, app_user_name='Surveyor'):
     """
@@ -150,38 +246,39 @@ def create_app_user(base_url, aut, projectId, app_user_name='Surveyor'):
     Atm. you can create multiple app users with the same name, should this be possible, or give an error? 
     """
     url = f'{base_url}/v1/projects/{projectId}/app-users'
-    return requests.post(url, auth=aut, json={'displayName': app_user_name})
+    response = get_session().post(url, auth=aut,
+                                  json={'displayName': app_user_name})
+    get_cache().invalidate(*_cache_key(base_url, aut, projectId, 'app-users'))
+    return response
 
 
 def update_role_app_user(base_url, aut, projectId, formId, actorId, roleId=2):
     """Give specified app-user specified role for given project"""
     url = f'{base_url}/v1/projects/{projectId}/forms/{formId}/assignments/{roleId}/{actorId}'
-    return requests.post(url, auth=aut)
+    return get_session().post(url, auth=aut)
     
 
 def give_access_app_users(base_url, aut, projectId, roleId=2):
-    """Give all the app-users in the project access to all the forms in that project"""
-    url = f'{base_url}/v1/projects/{projectId}/forms'
-    forms = requests.get(url, auth=aut).json()
-
-    for form in forms:
-        formId = form['xmlFormId']
-        url = f'{base_url}/v1/projects/{projectId}/app-users'
-        app_users = requests.get(url, auth=aut).json()
-        for user in app_users:
-            kwargs = {
-                "formId": formId,
-                "actorId": user['id'],
-            }
-            update_role_app_user(base_url, aut, projectId, roleId=roleId, **kwargs)
-            #url = f'{base_url}/v1/projects/{projectId}/forms/{formId}/assignments/{roleId}/{actorId}' 
-            #requests.post(url, auth = aut)
+    """
+    Give all the app-users in the project access to all the forms in that
+    project. The assignments are made concurrently, skipping existing
+    ones; see provisioning.assign_roles for the per-pair results.
+    """
+    # provisioning builds on this module, so import it when needed
+    from odk2odm.provisioning import assign_roles, FAILED
+    results = assign_roles(base_url, aut, projectId, roleId=roleId)
+    failed = [r for r in results.values() if r.startswith(FAILED)]
+    if failed:
+        return f"{len(failed)} of {len(results)} role assignments failed", 500
     return "Role successfully changed", 200
 
 def delete_project(base_url, aut, project_id):
     """Permanently delete project from an ODK Central server. Probably don't."""
     url = f'{base_url}/v1/projects/{project_id}'
-    return requests.delete(url, auth=aut)
+    response = get_session().delete(url, auth=aut)
+    get_cache().invalidate(*_cache_key(base_url, aut, 'projects'))
+    get_cache().invalidate(*_cache_key(base_url, aut, project_id))
+    return response
 
 
 def create_form(base_url, aut, projectId, name, data):
@@ -196,45 +293,30 @@ def create_form(base_url, aut, projectId, name, data):
     }
     url = f'{base_url}/v1/projects/{projectId}/forms?ignoreWarnings=true&publish=true'
     # From the requests, gives the same error
-    return requests.post(url, auth=aut, data=data, headers=headers)
+    response = get_session().post(url, auth=aut, data=data, headers=headers)
+    get_cache().invalidate(*_cache_key(base_url, aut, projectId, 'forms'))
+    return response
 
-def get_qr_code(base_url, aut, projectId, token, admin={}, general=general):
-    url = f'{base_url}/v1/key/{token}/projects/{projectId}'
-    qr_data = {
-        "general": general,
-        "admin": admin,
-    }
-    qr_data['general']['server_url'] = url
-    qr_data_bytes = json.dumps(qr_data).encode('utf-8') 
-    qr_data_comp = zlib.compress(qr_data_bytes)
-    qr_data_comp_utf = codecs.encode(qr_data_comp, 'base64_codec') 
-    qr_data_comp_str = qr_data_comp_utf.decode('utf-8').replace('\n', '')
-    img = qrcode.make(qr_data_comp_str)
-    img.save("check_this.png")
-    return img, 200
+def get_qr_code(base_url, aut, projectId, token, admin=None, general=None):
+    """
+    The configuration QR code of the app user with the given token, as PNG
+    image bytes. See provisioning.qr_codes for all app users of a project.
+    """
+    from odk2odm.provisioning import qr_png, qr_settings
+    settings = qr_settings(base_url, projectId, token, admin=admin,
+                           general=general)
+    return qr_png(settings), 200
 
 def generate_qr_data_dict(base_url, aut, projectId, admin={}, general=general):
-    url = f'{base_url}/v1/projects/{projectId}/app-users'
-    app_users = requests.get(url, auth=aut).json()
-    qr_data_dict = {}
-    false = False
-    true = True
-    for app_user in app_users:
-        token = app_user['token']
-        app_user_id = app_user['id']
-        url = f'{base_url}/v1/key/{token}/projects/{projectId}'
-        qr_data = {
-            "general": general,
-            "admin": admin,
-        }
-        qr_data['general']['server_url'] = url
-        qr_data_bytes = json.dumps(qr_data).encode('utf-8') 
-        qr_data_comp = zlib.compress(qr_data_bytes)
-        qr_data_comp_utf = codecs.encode(qr_data_comp, 'base64_codec') 
-        qr_data_comp_str = qr_data_comp_utf.decode('utf-8').replace('\n', '')
-        img = qrcode.make(qr_data_comp_str)
-        img.save('MyQRCode1.png') 
-        qr_data_dict[app_user_id] = qr_data_comp_str
+    """
+    Make the QR code settings strings of all app users in a project,
+    returned as a JSON string of app user id to settings string. To render
+    the QR code images too, use provisioning.qr_codes.
+    """
+    from odk2odm.provisioning import qr_codes
+    codes = qr_codes(base_url, aut, projectId, admin=admin, general=general,
+                     render=False)
+    qr_data_dict = {code.app_user_id: code.settings for code in codes}
 
     return (json.dumps(qr_data_dict), 200)
 
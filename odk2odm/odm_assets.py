@@ -0,0 +1,72 @@
+#!/usr/bin/python3
+"""
+Download the outputs of a WebODM task (all.zip, orthophoto.tif, point
+clouds...) to disk.
+
+Assets are often several GB, so they are streamed to a .part file instead
+of being read into memory. If the server supports Range requests, large
+assets are split into segments downloaded in parallel, which is faster
+when one connection can't fill the bandwidth (long distances, per-
+connection throttling). An interrupted download continues where it
+stopped when run again, and the size of the result is checked.
+"""
+import argparse
+import os
+
+from odk2odm import download
+from odk2odm import odm_requests
+from odk2odm.odm_client import TokenAuth
+from odk2odm.throughput import Throughput
+
+SEGMENTS = 4
+
+
+def download_asset(base_url, token, project_id, task_id, asset, outfilepath,
+                   segments=SEGMENTS, min_segment=download.MIN_SEGMENT):
+    """
+    Download an asset of a task to outfilepath, in up to segments parallel
+    byte ranges. Returns the number of bytes received by this call.
+    """
+    def fetch(headers):
+        return odm_requests.get_asset(base_url, token, project_id, task_id,
+                                      asset, stream=True, headers=headers)
+
+    total, etag, ranges = download.probe(fetch)
+    if ranges and segments > 1 and total >= 2 * min_segment:
+        return download.download_segments(fetch, outfilepath, total, etag,
+                                          segments=segments,
+                                          min_segment=min_segment)
+    # One stream, still resumable if the server supports ranges and the
+    # asset hasn't changed since the .part file was started
+    return download.resume_tagged(fetch, outfilepath, etag)
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Download an output of a '
+                                'WebODM task')
+    p.add_argument('asset', help='Name of the asset, e.g. all.zip or '
+                   'orthophoto.tif')
+    p.add_argument('-ourl', '--odm_url',
+                   help='WebODM server URL')
+    p.add_argument('-ou', '--odm_user',
+                   help='WebODM username')
+    p.add_argument('-opw', '--odm_password',
+                   help='WebODM password')
+    p.add_argument('-op', '--odm_project', type=int,
+                   help='WebODM project id')
+    p.add_argument('-task', '--task_id',
+                   help='WebODM task id')
+    p.add_argument('-od', '--output_directory', default='.',
+                   help='Directory to write the asset to')
+    p.add_argument('-s', '--segments', type=int, default=SEGMENTS,
+                   help='Number of parallel range requests for large assets')
+
+    args = p.parse_args()
+
+    token = TokenAuth(args.odm_url, args.odm_user, args.odm_password)
+    outfilepath = os.path.join(args.output_directory, args.asset)
+    stats = Throughput('assets')
+    stats.add(download_asset(args.odm_url, token, args.odm_project,
+                             args.task_id, args.asset, outfilepath,
+                             segments=args.segments))
+    print(stats.summary())
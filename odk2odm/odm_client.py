@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+"""
+Keeping a WebODM access token valid for as long as it is needed.
+
+The JWT from get_token_auth expires after 24 hours, so a long upload that
+fetched it once fails with 401s part way. TokenAuth fetches the token, reads
+its expiry time from the token itself, and fetches a new one shortly before
+that, or straight away if the server rejects it anyway.
+
+TokenAuth can be used in two ways:
+
+- in place of the token string for any odm_requests function (and for
+  batch_upload, transfer and task_watcher), because it formats as a
+  currently valid token:
+
+  token = TokenAuth(base_url, username, password)
+  odm_requests.get_tasks(base_url, token, project_id)
+
+- as the auth of a requests session, which then sets the Authorization
+  header on every request and, on a 401 or 403, refreshes the token and
+  sends the request once more. OdmClient holds such a session:
+
+  client = OdmClient(base_url, username, password)
+  client.get(f'/api/projects/{project_id}/tasks/')
+"""
+import base64
+import json
+import threading
+import time
+
+from requests.auth import AuthBase
+
+from odk2odm import odm_requests
+from odk2odm.session import make_session
+
+# What WebODM tokens are valid for, if the expiry can't be read from one
+TOKEN_LIFETIME = 24 * 3600
+# Fetch a new token this many seconds before the current one expires
+REFRESH_MARGIN = 3600
+
+
+def jwt_expiry(token):
+    """The expiry time (seconds since the epoch) in a JWT, or None"""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))['exp'])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenAuth(AuthBase):
+    """A WebODM JWT, fetched when needed and refreshed before it expires"""
+    def __init__(self, base_url, username, password,
+                 margin=REFRESH_MARGIN):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.margin = margin
+        self._token = None
+        self.expires = 0
+        self.refresh_at = 0
+        self.refreshes = 0
+        self._lock = threading.Lock()
+
+    def _fetch(self):
+        res = odm_requests.get_token_auth(self.base_url, self.username,
+                                          self.password)
+        res.raise_for_status()
+        self._token = res.json()['token']
+        now = time.time()
+        self.expires = jwt_expiry(self._token) or now + TOKEN_LIFETIME
+        # Tokens that live shorter than twice the margin are refreshed
+        # halfway through their life instead
+        self.refresh_at = self.expires - min(self.margin,
+                                             (self.expires - now) / 2)
+        self.refreshes += 1
+
+    def token(self):
+        """A token that is valid for at least another margin seconds"""
+        with self._lock:
+            if self._token is None or time.time() > self.refresh_at:
+                self._fetch()
+            return self._token
+
+    def refresh(self, rejected=None):
+        """
+        Fetch a new token. If the token the server rejected is given, only
+        fetch one if no other thread has done so since.
+        """
+        with self._lock:
+            if rejected is None or rejected == self._token:
+                self._fetch()
+            return self._token
+
+    def header(self, token=None):
+        return '{} {}'.format(odm_requests.token_prefix, token or self.token())
+
+    def __str__(self):
+        return self.token()
+
+    def __format__(self, spec):
+        return format(self.token(), spec)
+
+    def __call__(self, r):
+        token = self.token()
+        r.headers['Authorization'] = self.header(token)
+        r.register_hook('response', self._retry_rejected)
+        r.odm_token = token
+        return r
+
+    def _retry_rejected(self, r, **kwargs):
+        """Response hook: on a 401 or 403, refresh and send once more"""
+        if r.status_code not in (401, 403):
+            return r
+        body = r.request.body
+        if body is not None and not isinstance(body, (bytes, str)):
+            # A streamed body has been consumed and can't be sent again
+            return r
+        token = self.refresh(rejected=getattr(r.request, 'odm_token', None))
+        r.content
+        r.close()
+        prep = r.request.copy()
+        prep.headers['Authorization'] = self.header(token)
+        retried = r.connection.send(prep, **kwargs)
+        retried.history.append(r)
+        retried.request = prep
+        return retried
+
+
+def refresh_if_rejected(token, res):
+    """
+    For callers passing a TokenAuth as token to odm_requests functions:
+    if the response is a 401 or 403, refresh the token so that a retry
+    gets a new one, and return True. Does nothing for plain token strings.
+    """
+    if isinstance(token, TokenAuth) and res.status_code in (401, 403):
+        rejected = res.request.headers.get('Authorization', '').split(' ')[-1]
+        token.refresh(rejected=rejected)
+        return True
+    return False
+
+
+class OdmClient(object):
+    """
+    A pooled session for one WebODM server, with the token of a user set
+    on every request by TokenAuth. Paths are relative to base_url.
+    """
+    def __init__(self, base_url, username, password, session=None,
+                 margin=REFRESH_MARGIN):
+        self.base_url = base_url
+        self.auth = TokenAuth(base_url, username, password, margin=margin)
+        self.session = session or make_session()
+        self.session.auth = self.auth
+
+    def request(self, method, path, **kwargs):
+        return self.session.request(method, f'{self.base_url}{path}',
+                                    **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request('PATCH', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
@@ -1,8 +1,11 @@
 import json
 
-import requests
-from requests_toolbelt.multipart.encoder import MultipartEncoder
+from requests_toolbelt.multipart.encoder import MultipartEncoder, MultipartEncoderMonitor
+import mimetypes
 import os
+import time
+
+from odk2odm.session import get_session
 
 # This allows setting a custom token prefix, eg: "Bearer"
 token_prefix = os.getenv('ODM_TOKEN_PREFIX', 'JWT')
@@ -31,7 +34,7 @@ def get_token_auth(base_url, username, password):
     :return: http response
     """
     url = f"{base_url}/api/token-auth/"
-    res = requests.post(
+    res = get_session().post(
         url,
         data={
             "username": username,
@@ -50,7 +53,7 @@ def get_options(base_url, token):
 
     """
     url = f"{base_url}/api/processingnodes/options/"
-    res = requests.get(
+    res = get_session().get(
         url,
         headers={'Authorization': '{} {}'.format(token_prefix, token)},
     )
@@ -65,7 +68,7 @@ def get_projects(base_url, token):
 
     """
     url = f"{base_url}/api/projects"
-    res = requests.get(
+    res = get_session().get(
         url,
         headers={'Authorization': '{} {}'.format(token_prefix, token)},
     )
@@ -82,7 +85,7 @@ def get_project(base_url, token, project_id):
 
     """
     url = f"{base_url}/api/projects/{project_id}"
-    res = requests.get(
+    res = get_session().get(
         url,
         headers={'Authorization': '{} {}'.format(token_prefix, token)},
     )
@@ -99,7 +102,7 @@ def post_project(base_url, token, data={}):
 
     """
     url = f"{base_url}/api/projects/"
-    res = requests.post(
+    res = get_session().post(
         url,
         headers={'Authorization': '{} {}'.format(token_prefix, token)},
         data=data
@@ -117,7 +120,23 @@ def get_task(base_url, token, project_id, task_id):
 
     """
     url = f"{base_url}/api/projects/{project_id}/tasks/{task_id}/"
-    res = requests.get(
+    res = get_session().get(
+        url,
+        headers={'Authorization': '{} {}'.format(token_prefix, token)},
+    )
+    return res
+
+def get_tasks(base_url, token, project_id):
+    """
+    Get details of all tasks belonging to a project, including their status and progress, in one request (See https://docs.webodm.org/#task)
+    :param base_url: str - base url of WebODM server
+    :param token: str - 24-hr token (see token_auth)
+    :param project_id: int - id of project
+    :return: http response
+
+    """
+    url = f"{base_url}/api/projects/{project_id}/tasks/"
+    res = get_session().get(
         url,
         headers={'Authorization': '{} {}'.format(token_prefix, token)},
     )
@@ -125,7 +144,7 @@ def get_task(base_url, token, project_id, task_id):
 
 def get_thumbnail(base_url, token, project_id, task_id, filename):
     url = f"{base_url}/api/projects/{project_id}/tasks/{task_id}/images/thumbnail/{filename}"
-    res = requests.get(
+    res = get_session().get(
         url,
         headers={'Authorization': '{} {}'.format(token_prefix, token)},
     )
@@ -133,7 +152,7 @@ def get_thumbnail(base_url, token, project_id, task_id, filename):
 
 def get_image(base_url, token, project_id, task_id, filename):
     url = f"{base_url}/api/projects/{project_id}/tasks/{task_id}/images/download/{filename}"
-    res = requests.get(
+    res = get_session().get(
         url,
         headers={'Authorization': '{} {}'.format(token_prefix, token)},
     )
@@ -141,7 +160,7 @@ def get_image(base_url, token, project_id, task_id, filename):
 
 def get_options(base_url, token):
     url = f"{base_url}/api/processingnodes/options/"
-    res = requests.get(
+    res = get_session().get(
         url,
         headers={'Authorization': '{} {}'.format(token_prefix, token)},
     )
@@ -161,7 +180,7 @@ def patch_task(base_url, token, project_id, task_id, data={}, files={}):
     if "options" in data:
         # serialize options before passing
         data["options"] = json.dumps(data["options"])
-    res = requests.patch(
+    res = get_session().patch(
         url,
         headers={'Authorization': '{} {}'.format(token_prefix, token)},
         data=data,
@@ -188,7 +207,7 @@ def post_task(base_url, token, project_id, data={}, files=[]):
         data["options"] = ODM_TASK_DEFAULT_OPTIONS_LIST
     # serialize options before passing
     data["options"] = json.dumps(data["options"])
-    res = requests.post(
+    res = get_session().post(
         url,
         headers=headers,
         data=data,
@@ -196,37 +215,94 @@ def post_task(base_url, token, project_id, data={}, files=[]):
     )
     return res
 
-def post_upload(base_url, token, project_id, task_id, fields={}):
+def image_part(image):
+    """
+    Turn an image into a (filename, file object or bytes, mimetype) tuple for
+    MultipartEncoder. image can be a path, an open binary file, or a tuple of
+    (filename, file object or bytes[, mimetype]). Files given by path are
+    opened here but only read while the request body is being sent.
+    """
+    if isinstance(image, tuple):
+        name, data = image[:2]
+        mimetype = image[2] if len(image) > 2 else None
+    elif isinstance(image, (str, os.PathLike)):
+        name, data, mimetype = os.path.basename(image), open(image, 'rb'), None
+    else:
+        name, data, mimetype = os.path.basename(image.name), image, None
+    return name, data, mimetype or mimetypes.guess_type(name)[0] or 'image/jpeg'
+
+
+def post_upload(base_url, token, project_id, task_id, fields={}, images=None,
+                progress=None):
     """
     Post a new upload of a photo (.JPG) in an existing task with "partial": True in a project. Undocumented in https://docs.webodm.org/
+    The request body is streamed, so images given as paths or file objects are read from disk in small blocks while sending instead of being loaded into memory first.
     :param base_url: str - base url of WebODM server
     :param token: str - 24-hr token (see token_auth)
     :param project_id: int - id of project
     :param task_id: str (uuid) - the uuid belonging to the task to retrieve
     :param fields: dict - must contain the following recipe: {"images": <name of image file.JPG>, <bytestream of image>, 'image/jpg')}
+    :param images: list, or any iterable such as a generator, of images to send in this one request, each a file path, an open binary file, or a (filename, file or bytes, mimetype) tuple (see image_part). Can be used instead of, or in addition to, fields
+    :param progress: callable - called as progress(bytes_sent, total_bytes, bytes_per_second) while the body is sent
     :return: http response
 
     """
     url = f"{base_url}/api/projects/{project_id}/tasks/{task_id}/upload/"
-    m = MultipartEncoder(
-        fields=fields
+    parts = list(fields.items())
+    opened = []
+    # Files opened so far are closed even if a later image can't be opened
+    try:
+        for image in images or []:
+            part = image_part(image)
+            if isinstance(image, (str, os.PathLike)):
+                opened.append(part[1])
+            parts.append(("images", part))
+        m = MultipartEncoder(
+            fields=parts
+            )
+        data = m
+        if progress is not None:
+            start = time.monotonic()
+
+            def callback(monitor):
+                elapsed = max(time.monotonic() - start, 1e-9)
+                progress(monitor.bytes_read, m.len,
+                         monitor.bytes_read / elapsed)
+
+            data = MultipartEncoderMonitor(m, callback)
+        headers = {
+            'Authorization': '{} {}'.format(token_prefix, token),
+            'Content-type': m.content_type,
+        }
+        res = get_session().post(
+            url,
+            data=data,
+            headers=headers,
         )
-    headers = {
-        'Authorization': '{} {}'.format(token_prefix, token),
-        'Content-type': m.content_type,
-    }
-    res = requests.post(
-        url,
-        data=m,
-        headers=headers,
-    )
+    finally:
+        for f in opened:
+            f.close()
     return res
 
-def get_asset(base_url, token, project_id, task_id, asset):
+def get_asset(base_url, token, project_id, task_id, asset, stream=False,
+              headers=None):
+    """
+    Get an output of a task, like all.zip or orthophoto.tif (See https://docs.webodm.org/#download-assets)
+    :param base_url: str - base url of WebODM server
+    :param token: str - 24-hr token (see token_auth)
+    :param project_id: int - id of project
+    :param task_id: str (uuid) - the uuid belonging to the task
+    :param asset: str - name of the asset
+    :param stream: bool - if True, the body is only read when iterated over (see download.py); assets can be several GB
+    :param headers: dict - extra request headers, e.g. Range
+    :return: http response
+    """
     url = f"{base_url}/api/projects/{project_id}/tasks/{task_id}/download/{asset}"
-    res = requests.get(
+    res = get_session().get(
         url,
-        headers={'Authorization': '{} {}'.format(token_prefix, token)},
+        headers=dict(headers or {},
+                     Authorization='{} {}'.format(token_prefix, token)),
+        stream=stream,
     )
     return res
 
@@ -243,7 +319,7 @@ def post_commit(base_url, token, project_id, task_id):
     """
     url = f"{base_url}/api/projects/{project_id}/tasks/{task_id}/commit/"
     headers = {'Authorization': '{} {}'.format(token_prefix, token)}
-    res = requests.post(
+    res = get_session().post(
         url,
         headers=headers,
     )
@@ -262,7 +338,7 @@ def post_restart(base_url, token, project_id, task_id):
     """
     url = f"{base_url}/api/projects/{project_id}/tasks/{task_id}/restart/"
     headers = {'Authorization': '{} {}'.format(token_prefix, token)}
-    res = requests.post(
+    res = get_session().post(
         url,
         headers=headers,
     )
@@ -281,7 +357,7 @@ def post_cancel(base_url, token, project_id, task_id):
     """
     url = f"{base_url}/api/projects/{project_id}/tasks/{task_id}/cancel/"
     headers = {'Authorization': '{} {}'.format(token_prefix, token)}
-    res = requests.post(
+    res = get_session().post(
         url,
         headers=headers,
     )
@@ -300,7 +376,7 @@ POST /api/projects/{project_id}/tasks/{task_id}/remove/
     """
     url = f"{base_url}/api/projects/{project_id}/tasks/{task_id}/remove/"
     headers = {'Authorization': '{} {}'.format(token_prefix, token)}
-    res = requests.post(
+    res = get_session().post(
         url,
         headers=headers,
     )
@@ -317,7 +393,7 @@ def delete_project(base_url, token, project_id):
     """
     url = f"{base_url}/api/projects/{project_id}"
     headers = {'Authorization': '{} {}'.format(token_prefix, token)}
-    res = requests.delete(
+    res = get_session().delete(
         url,
         headers=headers,
     )
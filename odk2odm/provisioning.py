@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+"""
+Setting up an ODK Central project for a field campaign in bulk, combining
+the single requests of odk_requests.
+
+A campaign with 40 forms and 200 surveyors needs 8000 role assignments.
+assign_roles lists the forms and app users once, checks the existing
+assignments once per form, and POSTs only the missing ones, many at a
+time over the shared session.
+
+qr_codes makes the ODK Collect configuration QR codes for all app users of
+a project, rendering the images in a pool of processes.
+"""
+import base64
+import collections
+import io
+import json
+import multiprocessing
+import os
+import re
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+
+from odk2odm import odk_requests
+
+ASSIGN_WORKERS = 16
+
+# Per-pair results of assign_roles
+EXISTING = 'existing'
+ASSIGNED = 'assigned'
+FAILED = 'failed'
+
+
+def assigned_actors(base_url, aut, projectId, formId, roleId):
+    """The ids of the actors with a role on a form (empty if unknown)"""
+    try:
+        response = odk_requests.form_assignments(base_url, aut, projectId,
+                                                 formId, roleId)
+    except requests.RequestException:
+        return set()
+    if not response.ok:
+        return set()
+    return {actor['id'] for actor in response.json()}
+
+
+def assign_role(base_url, aut, projectId, formId, actorId, roleId):
+    """Assign one role, returning ASSIGNED or FAILED with the reason"""
+    try:
+        response = odk_requests.update_role_app_user(
+            base_url, aut, projectId, formId, actorId, roleId=roleId)
+    except requests.RequestException as e:
+        return f'{FAILED}: {e}'
+    if not response.ok:
+        return f'{FAILED}: HTTP {response.status_code}'
+    return ASSIGNED
+
+
+def assign_roles(base_url, aut, projectId, roleId=2, formIds=None,
+                 actorIds=None, workers=ASSIGN_WORKERS):
+    """
+    Give app users a role on forms of a project: by default every app user
+    of the project on every form. At most workers requests are in flight
+    at a time.
+
+    Returns a dict of (formId, actorId) -> EXISTING if the assignment was
+    already there, ASSIGNED if it was made, or a string starting with
+    FAILED and giving the reason.
+    """
+    if formIds is None:
+        formIds = [form['xmlFormId'] for form in
+                   odk_requests.form_list(base_url, aut, projectId)]
+    if actorIds is None:
+        actorIds = [user['id'] for user in
+                    odk_requests.app_user_list(base_url, aut, projectId)]
+    results = {}
+    with ThreadPoolExecutor(workers) as pool:
+        existing = pool.map(lambda formId: assigned_actors(
+            base_url, aut, projectId, formId, roleId), formIds)
+        pending = {}
+        for formId, assigned in zip(formIds, existing):
+            for actorId in actorIds:
+                if actorId in assigned:
+                    results[(formId, actorId)] = EXISTING
+                else:
+                    future = pool.submit(assign_role, base_url, aut,
+                                         projectId, formId, actorId, roleId)
+                    pending[future] = (formId, actorId)
+        for future in as_completed(pending):
+            results[pending[future]] = future.result()
+    return results
+
+
+# A configuration QR code for an app user. png holds the image as PNG bytes
+# and path the file it was written to, each None if not asked for.
+QrCode = collections.namedtuple('QrCode',
+                                'app_user_id name settings png path')
+
+
+def qr_settings(base_url, projectId, token, admin=None, general=None):
+    """
+    The settings string ODK Collect reads from a configuration QR code for
+    an app user: zlib-compressed, base64-encoded JSON. general defaults to
+    odk_requests.general, which is left unchanged.
+    """
+    url = f'{base_url}/v1/key/{token}/projects/{projectId}'
+    settings = {
+        'general': dict(odk_requests.general if general is None else general,
+                        server_url=url),
+        'admin': admin or {},
+    }
+    compressed = zlib.compress(json.dumps(settings).encode('utf-8'))
+    return base64.b64encode(compressed).decode('ascii')
+
+
+def qr_png(settings):
+    """PNG image bytes of the QR code of a settings string"""
+    # Only needed when rendering, so the settings strings can be made
+    # without qrcode installed
+    import qrcode
+    buffer = io.BytesIO()
+    qrcode.make(settings).save(buffer)
+    return buffer.getvalue()
+
+
+def qr_filename(app_user):
+    """File name for the QR code of an app user, from its name and id"""
+    name = re.sub(r'[^\w.-]+', '_', app_user.get('displayName') or 'app_user')
+    return f'{name}_{app_user["id"]}.png'
+
+
+def qr_codes(base_url, aut, projectId, admin=None, general=None,
+             render=True, outdir=None, processes=None, app_users=None):
+    """
+    Make the configuration QR codes of the app users of a project (or of
+    the given list of app user dicts), returning a list of QrCode.
+
+    With render=False only the settings strings are made. Otherwise the
+    images are rendered in a pool of processes (None for one per CPU core,
+    1 to render in this process) and returned as PNG bytes, or, if outdir
+    is given, written there as one file per app user.
+    """
+    if app_users is None:
+        app_users = odk_requests.app_user_list(base_url, aut, projectId)
+    settings = [qr_settings(base_url, projectId, user['token'], admin,
+                            general) for user in app_users]
+    if not render:
+        images = [None] * len(settings)
+    elif processes == 1 or len(settings) < 2:
+        images = [qr_png(s) for s in settings]
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            images = pool.map(qr_png, settings, chunksize=8)
+    codes = []
+    for user, setting, png in zip(app_users, settings, images):
+        path = None
+        if outdir and png is not None:
+            path = os.path.join(outdir, qr_filename(user))
+            with open(path, 'wb') as outfile:
+                outfile.write(png)
+            png = None
+        codes.append(QrCode(user['id'], user.get('displayName'), setting,
+                            png, path))
+    return codes
@@ -0,0 +1,73 @@
+#!/usr/bin/python3
+"""
+The HTTP session shared by all functions in odk_requests and odm_requests.
+
+Calling requests.get directly opens a new connection (and does a new TLS
+handshake) for every request. Routing all requests through one Session lets
+them reuse kept-alive connections from its pool instead, and lets transient
+failures (connection resets, 502/503/504) be retried with back-off.
+
+The session is created on first use. To tune it, install your own:
+
+from odk2odm import session
+session.set_session(session.make_session(pool_size=64, retries=5))
+"""
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+POOL_SIZE = 32
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+BACKOFF_MAX = 60
+RETRY_STATUSES = (502, 503, 504)
+# POST isn't idempotent (uploads, commits, role assignments...), so it is
+# never retried automatically.
+RETRY_METHODS = frozenset(['HEAD', 'GET', 'PUT', 'DELETE', 'OPTIONS'])
+
+_session = None
+_lock = threading.Lock()
+
+
+def make_session(pool_size=POOL_SIZE, retries=RETRIES,
+                 backoff_factor=BACKOFF_FACTOR):
+    """
+    A requests Session keeping up to pool_size connections per host alive,
+    retrying idempotent requests up to retries times with exponential
+    back-off.
+    """
+    retry = Retry(total=retries, backoff_factor=backoff_factor,
+                  status_forcelist=RETRY_STATUSES,
+                  allowed_methods=RETRY_METHODS, raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def backoff(attempt, factor=BACKOFF_FACTOR, maximum=BACKOFF_MAX):
+    """
+    Seconds to wait before retry number attempt (1 for the first), growing
+    exponentially like the retries of the session, but at most maximum.
+    """
+    return min(factor * 2 ** (attempt - 1), maximum)
+
+
+def get_session():
+    """The shared session, created with default settings on first use"""
+    global _session
+    with _lock:
+        if _session is None:
+            _session = make_session()
+        return _session
+
+
+def set_session(session):
+    """Replace the shared session, e.g. with a differently tuned one"""
+    global _session
+    with _lock:
+        _session = session
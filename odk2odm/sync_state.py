@@ -0,0 +1,68 @@
+#!/usr/bin/python3
+"""
+High-water marks for incremental syncing of ODK Central forms.
+
+For every project/form, the latest submission date that has been fully
+processed is kept in a small JSON file, separately for every consumer
+(e.g. 'attachments' or 'csv'), so that the next run only has to ask the
+server for submissions that came in after it.
+"""
+import json
+import os
+
+SYNC_NAME = '.odk2odm_sync.json'
+
+
+def submitted_after(timestamp):
+    """OData $filter for submissions received after an ISO 8601 timestamp"""
+    return f'__system/submissionDate gt {timestamp}'
+
+
+def latest_submission_date(rows, latest=None):
+    """Latest __system/submissionDate among OData submission rows"""
+    for row in rows:
+        date = row.get('__system', {}).get('submissionDate')
+        # ISO 8601 timestamps in the same timezone sort as strings
+        if date and (latest is None or date > latest):
+            latest = date
+    return latest
+
+
+def high_water_mark(dates, incomplete=(), since=None):
+    """
+    The latest of the submission dates (a dict of instanceId to date) that
+    is earlier than the date of every incomplete submission, so that those
+    are fetched again on the next run. since if there is no such date.
+    """
+    blocked = min((dates[sub_id] for sub_id in incomplete), default=None)
+    mark = since
+    for date in dates.values():
+        if blocked is not None and date >= blocked:
+            continue
+        if mark is None or date > mark:
+            mark = date
+    return mark
+
+
+class SyncState(object):
+    """High-water marks per consumer and project/form, stored as JSON"""
+    def __init__(self, path):
+        self.path = path
+        self.marks = {}
+        if os.path.exists(path):
+            with open(path) as infile:
+                self.marks = json.load(infile)
+
+    def get(self, consumer, project, form):
+        """The last synced submission date, or None to sync everything"""
+        return self.marks.get(consumer, {}).get(f'{project}/{form}')
+
+    def set(self, consumer, project, form, timestamp):
+        """Store a new high-water mark and write it to disk atomically"""
+        if timestamp is None:
+            return
+        self.marks.setdefault(consumer, {})[f'{project}/{form}'] = timestamp
+        tmppath = self.path + '.tmp'
+        with open(tmppath, 'w') as outfile:
+            json.dump(self.marks, outfile, indent=2)
+        os.replace(tmppath, self.path)
@@ -0,0 +1,207 @@
+#!/usr/bin/python3
+"""
+Watch the processing of WebODM tasks without hammering the server.
+
+Polling get_task in a loop costs one request per task per interval. A
+TaskWatcher instead fetches all tasks of a project with one get_tasks
+request per poll, and adapts the interval: it polls again soon after a
+status changed, backs off while none does (a queued task can wait for
+hours, a running one take hours), but doesn't wait longer than the time
+left for the running task closest to finishing, estimated from how fast
+its progress advances. Callbacks are called when the
+status or progress of a task changes.
+"""
+import argparse
+import time
+
+import requests
+
+from odk2odm import odm_requests
+from odk2odm.odm_client import TokenAuth
+
+# WebODM task status codes
+QUEUED = 10
+RUNNING = 20
+FAILED = 30
+COMPLETED = 40
+CANCELED = 50
+STATUS_NAMES = {None: 'new', QUEUED: 'queued', RUNNING: 'running',
+                FAILED: 'failed', COMPLETED: 'completed',
+                CANCELED: 'canceled'}
+FINISHED = frozenset([FAILED, COMPLETED, CANCELED])
+
+MIN_INTERVAL = 5.0
+MAX_INTERVAL = 300.0
+BACKOFF = 1.5
+
+
+class TaskWatcher(object):
+    """
+    Poll the tasks of a WebODM project. task_ids limits the watch to some
+    tasks (by default all tasks in the project). on_change(task, previous)
+    is called with the task dict and its previous status (None when first
+    seen) when a status changes, and on_progress(task) when the progress
+    of a running task changes.
+    """
+    def __init__(self, base_url, token, project_id, task_ids=None,
+                 on_change=None, on_progress=None,
+                 min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL):
+        self.base_url = base_url
+        self.token = token
+        self.project_id = project_id
+        self.task_ids = None if task_ids is None else set(task_ids)
+        self.on_change = on_change
+        self.on_progress = on_progress
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.tasks = {}
+        self.requests = 0
+        # task id -> the last two (time, progress) samples at which the
+        # progress was seen to change, to estimate how fast it advances
+        self._progress = {}
+
+    def poll(self):
+        """
+        Fetch all tasks of the project in one request, call the callbacks
+        for the changes and return True if the status of any task changed.
+        Raises ValueError if some of the watched tasks aren't in the project,
+        as they would never finish.
+        """
+        self.requests += 1
+        res = odm_requests.get_tasks(self.base_url, self.token,
+                                     self.project_id)
+        res.raise_for_status()
+        now = time.monotonic()
+        tasks = res.json()
+        if self.task_ids is not None:
+            missing = self.task_ids - {task['id'] for task in tasks}
+            if missing:
+                raise ValueError(f'Tasks not found in project '
+                                 f'{self.project_id}: '
+                                 f'{", ".join(sorted(map(str, missing)))}')
+        changed = False
+        for task in tasks:
+            task_id = task['id']
+            if self.task_ids is not None and task_id not in self.task_ids:
+                continue
+            old = self.tasks.get(task_id)
+            self.tasks[task_id] = task
+            previous = old['status'] if old else None
+            if old is None or task['status'] != previous:
+                changed = True
+                if self.on_change:
+                    self.on_change(task, previous)
+            progress = task.get('running_progress') or 0
+            samples = self._progress.setdefault(task_id, [])
+            if not samples or progress != samples[-1][1]:
+                samples.append((now, progress))
+                del samples[:-2]
+                if old is not None and self.on_progress:
+                    self.on_progress(task)
+        return changed
+
+    def finished(self):
+        """True when all watched tasks have failed, completed or been canceled"""
+        return bool(self.tasks) and all(task['status'] in FINISHED
+                                        for task in self.tasks.values())
+
+    def time_left(self):
+        """
+        Estimated seconds until the first running task finishes, from the
+        rate its progress advanced at between its last two changes, or None
+        """
+        estimates = []
+        for task_id, task in self.tasks.items():
+            samples = self._progress.get(task_id, ())
+            if task['status'] != RUNNING or len(samples) < 2:
+                continue
+            (t0, p0), (t1, p1) = samples
+            if p1 > p0 and t1 > t0:
+                rate = (p1 - p0) / (t1 - t0)
+                estimates.append((1 - p1) / rate - (time.monotonic() - t1))
+        return min(estimates) if estimates else None
+
+    def next_interval(self, changed):
+        """Seconds to wait before the next poll"""
+        if changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * BACKOFF, self.max_interval)
+        left = self.time_left()
+        if left is not None:
+            return max(self.min_interval, min(self.interval, left))
+        return self.interval
+
+    def watch(self, timeout=None):
+        """
+        Poll until all watched tasks are finished, or timeout seconds have
+        passed. Connection errors and server errors are waited out with the
+        same back-off. Returns the dict of task id -> task. Raises
+        ValueError if some of the watched tasks aren't in the project.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                changed = self.poll()
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code < 500:
+                    raise
+                print(f'Polling tasks failed: {e}')
+                changed = False
+            except requests.ConnectionError as e:
+                print(f'Polling tasks failed: {e}')
+                changed = False
+            if self.finished():
+                return self.tasks
+            wait = self.next_interval(changed)
+            if deadline is not None:
+                if time.monotonic() + wait > deadline:
+                    return self.tasks
+            time.sleep(wait)
+
+
+def print_change(task, previous):
+    print(f"Task {task['id']} ({task.get('name')}): "
+          f"{STATUS_NAMES.get(previous, previous)} -> "
+          f"{STATUS_NAMES.get(task['status'], task['status'])}")
+
+
+def print_progress(task):
+    print(f"Task {task['id']} ({task.get('name')}): "
+          f"{100 * (task.get('running_progress') or 0):.0f}%")
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(description='Watch the tasks of a WebODM '
+                                'project until they are all finished')
+    p.add_argument('-ourl', '--odm_url',
+                   help='WebODM server URL')
+    p.add_argument('-ou', '--odm_user',
+                   help='WebODM username')
+    p.add_argument('-opw', '--odm_password',
+                   help='WebODM password')
+    p.add_argument('-op', '--odm_project', type=int,
+                   help='WebODM project id')
+    p.add_argument('-task', '--task_id', action='append',
+                   help='Task to watch (repeat for several; default all)')
+    p.add_argument('--max_interval', type=float, default=MAX_INTERVAL,
+                   help='Longest wait between polls in seconds')
+    p.add_argument('--timeout', type=float, default=None,
+                   help='Stop watching after this many seconds '
+                   '(default: until all tasks are finished)')
+
+    args = p.parse_args()
+
+    # Refreshed before it expires, however long the tasks take
+    token = TokenAuth(args.odm_url, args.odm_user, args.odm_password)
+    watcher = TaskWatcher(args.odm_url, token, args.odm_project,
+                          task_ids=args.task_id, on_change=print_change,
+                          on_progress=print_progress,
+                          max_interval=args.max_interval)
+    watcher.watch(timeout=args.timeout)
+    if watcher.finished():
+        print(f'All tasks finished after {watcher.requests} requests')
+    else:
+        print(f'Stopped after {args.timeout} seconds and '
+              f'{watcher.requests} requests with tasks still running')
@@ -0,0 +1,47 @@
+#!/usr/bin/python3
+"""
+Small thread-safe counter for reporting the throughput (files/s, MB/s) of
+bulk transfers and batch jobs.
+"""
+import threading
+import time
+
+
+class Throughput(object):
+    """Count files and bytes processed since creation, from any thread"""
+    def __init__(self, label='files'):
+        self.label = label
+        self.files = 0
+        self.nbytes = 0
+        self.failed = 0
+        self.start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, nbytes=0, files=1):
+        """Record successfully processed files and their size in bytes"""
+        with self._lock:
+            self.files += files
+            self.nbytes += nbytes
+
+    def fail(self, files=1):
+        """Record files that could not be processed"""
+        with self._lock:
+            self.failed += files
+
+    def elapsed(self):
+        return max(time.monotonic() - self.start, 1e-9)
+
+    def rates(self):
+        """Return a tuple of (files per second, MB per second)"""
+        elapsed = self.elapsed()
+        return self.files / elapsed, self.nbytes / 1e6 / elapsed
+
+    def summary(self):
+        files_s, mb_s = self.rates()
+        if not self.nbytes:
+            # Nothing was counted in bytes, e.g. when only reading metadata
+            return (f'{self.files} {self.label} in {self.elapsed():.1f} s: '
+                    f'{files_s:.1f} {self.label}/s, {self.failed} failed')
+        return (f'{self.files} {self.label} ({self.nbytes / 1e6:.1f} MB) '
+                f'in {self.elapsed():.1f} s: {files_s:.1f} {self.label}/s, '
+                f'{mb_s:.2f} MB/s, {self.failed} failed')
@@ -0,0 +1,259 @@
+#!/usr/bin/python3
+"""
+Move the photos of an ODK Central form straight into a WebODM task,
+without writing them to local disk.
+
+Download threads stream attachments from ODK Central into a bounded
+in-memory queue, from which upload threads push them into a partial WebODM
+task. When the queue is full the downloaders wait for the uploaders (and
+vice versa), so memory stays bounded by roughly
+(queue size + download threads + upload threads) x image size while the
+overall throughput approaches the slower of the two sides. When all images
+are uploaded, the task is committed so WebODM starts processing.
+"""
+import argparse
+import mimetypes
+import queue
+import threading
+import time
+
+import requests
+
+from odk2odm import attachments
+from odk2odm import odk_requests
+from odk2odm import odm_requests
+from odk2odm import session as http_session
+from odk2odm.dedup import SeenContent, UniqueNames
+from odk2odm.odm_client import TokenAuth, refresh_if_rejected
+from odk2odm.throughput import Throughput
+
+DOWNLOAD_RETRIES = 3
+UPLOAD_RETRIES = 3
+# Most images sent in one upload request
+UPLOAD_BATCH = 8
+
+
+def create_partial_task(odm_url, token, odm_project, name, options=None):
+    """Create a WebODM task that accepts uploads until committed; return its id"""
+    data = {'name': name, 'partial': True}
+    if options is not None:
+        data['options'] = options
+    res = odm_requests.post_task(odm_url, token, odm_project, data=data)
+    res.raise_for_status()
+    return res.json()['id']
+
+
+def download_to_queue(url, aut, project, form, work, images, stats,
+                      session=None, seen=None, names=None,
+                      retries=DOWNLOAD_RETRIES):
+    """
+    Fetch attachments from the work queue and put (name, bytes) on images.
+    A failed or broken-off download is tried again up to retries times,
+    with exponential back-off. With a dedup.SeenContent, images identical
+    to one fetched before are dropped instead. With a dedup.UniqueNames,
+    images whose filename was used before get a name of their own
+    (stem_1.ext...), so that they don't replace each other in the task.
+    """
+    limit = attachments.host_limit(url)
+    while True:
+        item = work.get()
+        if item is None:
+            return
+        sub_id, fn = item
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(http_session.backoff(attempt))
+            try:
+                with limit:
+                    attresp = odk_requests.attachment(url, aut, project,
+                                                      form, sub_id, fn,
+                                                      session=session)
+                attresp.raise_for_status()
+                break
+            except requests.RequestException as e:
+                error = e
+        else:
+            print(f'Failed to download {fn}: {error}')
+            stats.fail()
+            continue
+        stats.add(len(attresp.content))
+        if seen is not None and not seen.add(attresp.content):
+            continue
+        if names is not None:
+            fn = names.claim(fn)
+        # Blocks while the uploaders are behind: this is the backpressure
+        images.put((fn, attresp.content))
+
+
+def upload_from_queue(odm_url, token, odm_project, task_id, images, stats,
+                      retries=UPLOAD_RETRIES, batch_size=UPLOAD_BATCH):
+    """
+    Upload (name, bytes) images taken from the queue until it yields None.
+    The images waiting in the queue, up to batch_size, are sent together
+    in one request (see batch_upload.py), so that a queue the downloaders
+    keep full doesn't cost a request per image. A failed batch is tried
+    up to retries more times with exponential back-off.
+    """
+    limit = attachments.host_limit(odm_url)
+    done = False
+    while not done:
+        item = images.get()
+        if item is None:
+            return
+        batch = [item]
+        while len(batch) < batch_size:
+            try:
+                item = images.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Upload what we have, then stop
+                done = True
+                break
+            batch.append(item)
+        parts = [(fn, data, mimetypes.guess_type(fn)[0] or 'image/jpeg')
+                 for fn, data in batch]
+        for attempt in range(retries + 1):
+            if attempt:
+                time.sleep(http_session.backoff(attempt))
+            try:
+                with limit:
+                    res = odm_requests.post_upload(odm_url, token,
+                                                   odm_project, task_id,
+                                                   images=parts)
+                if res.status_code == 200:
+                    stats.add(sum(len(data) for _, data in batch),
+                              files=len(batch))
+                    break
+                error = f'HTTP {res.status_code}'
+                refresh_if_rejected(token, res)
+            except Exception as e:
+                # Not only network errors (a token that can't be fetched,
+                # say): an uploader that died would leave the downloaders
+                # blocked on a full queue
+                error = e
+        else:
+            print(f'Failed to upload {", ".join(fn for fn, _ in batch)}: '
+                  f'{error}')
+            stats.fail(len(batch))
+
+
+def transfer_form_to_task(url, aut, project, form, odm_url, token,
+                          odm_project, task_id=None, task_name=None,
+                          download_threads=8, upload_threads=4,
+                          queue_size=16, commit=True, dedup=True):
+    """
+    Copy all attachments of an ODK Central form into a WebODM task. A new
+    partial task (named task_name, by default the form name) is created
+    unless the id of an existing partial task is given. The task is
+    committed when every image arrived and the attachments of every
+    submission could be listed, unless commit=False.
+    Identical photos from resubmitted forms are uploaded only once, unless
+    dedup=False. Different photos sharing a filename are all uploaded, the
+    later ones renamed to stem_1.ext, stem_2.ext...
+    Returns the task id and the download and upload Throughput.
+    """
+    if task_id is None:
+        task_id = create_partial_task(odm_url, token, odm_project,
+                                      task_name or form)
+    session = http_session.make_session(pool_size=download_threads)
+    work = queue.Queue(maxsize=download_threads * 4)
+    images = queue.Queue(maxsize=queue_size)
+    downloaded = Throughput('images')
+    uploaded = Throughput('images')
+    seen = SeenContent() if dedup else None
+    names = UniqueNames()
+    unlisted = set()
+
+    dates, _ = attachments.list_submissions(url, aut, project, form,
+                                            session=session)
+    producer = threading.Thread(target=attachments.queue_attachments,
+                                args=(url, aut, project, form, dates, work,
+                                      download_threads),
+                                kwargs={'session': session,
+                                        'all_names': True,
+                                        'unlisted': unlisted})
+    downloaders = [threading.Thread(target=download_to_queue,
+                                    args=(url, aut, project, form, work,
+                                          images, downloaded),
+                                    kwargs={'session': session, 'seen': seen,
+                                            'names': names})
+                   for _ in range(download_threads)]
+    uploaders = [threading.Thread(target=upload_from_queue,
+                                  args=(odm_url, token, odm_project, task_id,
+                                        images, uploaded))
+                 for _ in range(upload_threads)]
+    for thread in [producer] + downloaders + uploaders:
+        thread.start()
+
+    producer.join()
+    for thread in downloaders:
+        thread.join()
+    for _ in uploaders:
+        images.put(None)
+    for thread in uploaders:
+        thread.join()
+    session.close()
+    print(f'Downloaded {downloaded.summary()}')
+    print(f'Uploaded {uploaded.summary()}')
+    if seen is not None:
+        print(f'{seen.duplicates} duplicate images were not uploaded')
+    if unlisted:
+        print(f'Skipped submissions whose attachments could not be listed: '
+              f'{", ".join(sorted(unlisted))}')
+
+    if commit:
+        if downloaded.failed or uploaded.failed or unlisted:
+            print(f'Not committing task {task_id}: some images are missing')
+        else:
+            odm_requests.post_commit(odm_url, token, odm_project,
+                                     task_id).raise_for_status()
+    return task_id, downloaded, uploaded
+
+
+if __name__ == '__main__':
+    p = argparse.ArgumentParser(usage="usage: transfer [options]")
+    p.add_argument('-url', '--base_url',
+                   help='ODK Central server URL')
+    p.add_argument('-u', '--user',
+                   help='ODK Central username (usually email).')
+    p.add_argument('-pw', '--password',
+                   help='ODK Central password.')
+    p.add_argument('-p', '--project',
+                   help='the ODK Central project in question')
+    p.add_argument('-f', '--form',
+                   help='Unique name of the relevant form.')
+    p.add_argument('-ourl', '--odm_url',
+                   help='WebODM server URL')
+    p.add_argument('-ou', '--odm_user',
+                   help='WebODM username')
+    p.add_argument('-opw', '--odm_password',
+                   help='WebODM password')
+    p.add_argument('-op', '--odm_project', type=int,
+                   help='WebODM project id to create the task in')
+    p.add_argument('-task', '--task_id',
+                   help='Existing partial WebODM task to add the images to')
+    p.add_argument('-dt', '--download_threads', type=int, default=8,
+                   help='Number of download threads')
+    p.add_argument('-ut', '--upload_threads', type=int, default=4,
+                   help='Number of upload threads')
+    p.add_argument('-q', '--queue_size', type=int, default=16,
+                   help='Maximum number of images held in memory between '
+                   'download and upload')
+    p.add_argument('--no_commit', action='store_true',
+                   help='Leave the task open for more uploads')
+    p.add_argument('--no_dedup', action='store_true',
+                   help='Upload identical photos as often as they occur')
+
+    args = p.parse_args()
+
+    # Refreshed before it expires, however long the transfer takes
+    token = TokenAuth(args.odm_url, args.odm_user, args.odm_password)
+    transfer_form_to_task(args.base_url, (args.user, args.password),
+                          args.project, args.form, args.odm_url, token,
+                          args.odm_project, task_id=args.task_id,
+                          download_threads=args.download_threads,
+                          upload_threads=args.upload_threads,
+                          queue_size=args.queue_size,
+                          commit=not args.no_commit,
+                          dedup=not args.no_dedup)
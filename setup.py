@@ -32,7 +32,7 @@ setup(
     ],
     extras_require={
         "dev": ["pytest", "pytest-cov"],
-        "optional": [],
+        "optional": ["httpx"],
     },
     scripts=[],
     entry_points="""
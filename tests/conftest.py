@@ -0,0 +1,19 @@
+import pytest
+
+from odk2odm import session as http_session
+from tests.stub_servers import StubConfig, StubServer
+
+
+@pytest.fixture
+def stub():
+    """A stub server with six submissions of two small photos each"""
+    config = StubConfig(submissions=6, attachment_size=4096,
+                        asset_size=64 * 1024)
+    with StubServer(config) as server:
+        yield server
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    """Retry straight away, to keep tests with injected failures fast"""
+    monkeypatch.setattr(http_session, 'backoff', lambda attempt: 0)
@@ -0,0 +1,486 @@
+#!/usr/bin/python3
+"""
+Local stand-ins for an ODK Central and a WebODM server, for the tests and
+the benchmarks.
+
+One HTTP server answers the endpoints odk_requests and odm_requests use:
+
+ODK Central (under /v1): projects, forms, app users and role assignments
+(which can be created, and projects deleted), submissions, the OData feed (with $top, $skip and a submissionDate $filter),
+attachment lists and attachments (with Range and ETag support).
+
+WebODM (under /api): token-auth (a JWT with an exp claim), the task list,
+creating partial tasks, uploading images, committing, and task assets
+(with Range support).
+
+Attachment contents are generated, so they need no storage. They are
+distinct unless the config asks for resubmitted photos (the same name and
+content in a later submission) or shared names (the same name with
+different content in every submission). Attachments of the submissions
+listed as missing aren't uploaded yet, as if ODK Collect hadn't sent
+them. WebODM tokens are only accepted until they expire, and the names of
+uploaded images are kept per task. The network can be made worse on purpose, per
+request: a fixed latency, a bandwidth limit per connection (so parallel
+connections help, as they do on many real links), and, for the bulk
+transfers (attachments, uploads and assets), a share of 503 replies and
+a share of downloads that break off half way.
+
+with StubServer(StubConfig(submissions=100, latency=0.05)) as server:
+    odk_requests.projects(server.url, ('user', 'password'))
+"""
+import base64
+import collections
+import dataclasses
+import datetime
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+CHUNK = 64 * 1024
+
+
+@dataclasses.dataclass
+class StubConfig:
+    projects: int = 1
+    forms: int = 1
+    app_users: int = 5
+    submissions: int = 50
+    # attachments per submission, and the size of each in bytes
+    attachments: int = 2
+    attachment_size: int = 200 * 1024
+    # the last resubmitted submissions repeat the photos of the first ones
+    resubmitted: int = 0
+    # all submissions name their photos photo_0.jpg, photo_1.jpg...
+    shared_names: bool = False
+    # indices of the submissions whose attachments haven't arrived yet, and
+    # of those whose attachment list fails with a 500
+    missing: tuple = ()
+    unlistable: tuple = ()
+    asset_size: int = 16 * 1024 * 1024
+    # seconds added to every request
+    latency: float = 0.0
+    # bytes per second per connection, in either direction; 0 for no limit
+    bandwidth: float = 0
+    # shares of attachment, upload and asset requests answered with a 503,
+    # and of attachment and asset downloads broken off half way
+    failure_rate: float = 0.0
+    truncate_rate: float = 0.0
+    # the same, but for the first requests to every URL, so that tests
+    # can count on them
+    fail_first: int = 0
+    truncate_first: int = 0
+    # seconds a WebODM token is valid for
+    token_lifetime: float = 24 * 3600
+    seed: int = 0
+
+
+def content(name, size):
+    """size bytes that are the same for the same name, and differ otherwise"""
+    block = hashlib.sha256(name.encode()).digest() * (CHUNK // 32)
+    return (block * (size // len(block) + 1))[:size]
+
+
+def submission_date(i):
+    date = datetime.datetime(2022, 1, 1) + datetime.timedelta(seconds=i)
+    return date.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+class StubServer(ThreadingHTTPServer):
+    """The stub servers, serving from a thread until stopped"""
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, config=None, port=0):
+        super().__init__(('127.0.0.1', port), StubHandler)
+        self.config = config or StubConfig()
+        self.random = random.Random(self.config.seed)
+        self.lock = threading.Lock()
+        self.requests = collections.Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.uploaded = collections.Counter()
+        self.uploaded_names = collections.defaultdict(list)
+        self.tokens = set()
+        self.attempts = collections.Counter()
+        self.tasks = {}
+        self.assignments = collections.defaultdict(set)
+        self.url = f'http://127.0.0.1:{self.server_port}'
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever,
+                                       kwargs={'poll_interval': 0.05},
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def chance(self, rate):
+        if not rate:
+            return False
+        with self.lock:
+            return self.random.random() < rate
+
+    def attempt(self, path):
+        """Count a request to path; return how many there were so far"""
+        with self.lock:
+            self.attempts[path] += 1
+            return self.attempts[path]
+
+    def count(self, kind, sent=0, received=0):
+        with self.lock:
+            self.requests[kind] += 1
+            self.bytes_sent += sent
+            self.bytes_received += received
+
+    def photo_source(self, instance_id):
+        """The submission whose photos a submission carries"""
+        i = int(instance_id.rpartition('-')[2])
+        first_resubmitted = self.config.submissions - self.config.resubmitted
+        return i - first_resubmitted if i >= first_resubmitted else i
+
+    def attachment_names(self, instance_id):
+        if self.config.shared_names:
+            return [f'photo_{a}.jpg' for a in range(self.config.attachments)]
+        i = self.photo_source(instance_id)
+        return [f'img_{i:06d}_{a}.jpg' for a in range(self.config.attachments)]
+
+    def attachment_exists(self, instance_id):
+        return int(instance_id.rpartition('-')[2]) not in self.config.missing
+
+    def attachment_content(self, instance_id, name):
+        """Content and ETag of an attachment"""
+        key = f'{self.photo_source(instance_id)}/{name}'
+        return content(key, self.config.attachment_size), f'"{key}"'
+
+    def submission(self, i):
+        names = self.attachment_names(f'uuid:sub-{i}')
+        return {
+            '__id': f'uuid:sub-{i}',
+            'location': {'type': 'Point',
+                         'coordinates': [39.28 + i * 1e-5, -6.8, 12.0],
+                         'properties': {'accuracy': 4.5}},
+            'photos': {f'photo_{a}': name for a, name in enumerate(names)},
+            '__system': {'submissionDate': submission_date(i)},
+        }
+
+    def token(self):
+        payload = json.dumps({'exp': time.time() +
+                              self.config.token_lifetime}).encode()
+        token = 'stub.{}.{}'.format(
+            base64.urlsafe_b64encode(payload).decode().rstrip('='),
+            uuid.uuid4().hex)
+        with self.lock:
+            self.tokens.add(token)
+        return token
+
+    def token_valid(self, token):
+        """True for tokens issued by this server that haven't expired"""
+        with self.lock:
+            if token not in self.tokens:
+                return False
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload))['exp'] > \
+            time.time()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without this, Nagle's
+    # algorithm stalls every response on a kept-alive connection.
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    # Sending
+
+    def send_body(self, kind, body, status=200, ctype='application/json',
+                  headers=None, truncatable=False):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        config = self.server.config
+        if truncatable and len(body) > 1 and (
+                self.server.attempt(('truncate', self.path)) <=
+                config.truncate_first or
+                self.server.chance(config.truncate_rate)):
+            body = body[:len(body) // 2]
+            self.close_connection = True
+        self.throttled(self.wfile.write, body)
+        self.server.count(kind, sent=len(body), received=self.received)
+
+    def throttled(self, write, body):
+        bandwidth = self.server.config.bandwidth
+        for start in range(0, len(body), CHUNK):
+            chunk = body[start:start + CHUNK]
+            write(chunk)
+            if bandwidth:
+                time.sleep(len(chunk) / bandwidth)
+
+    def send_range(self, kind, data, etag, ctype):
+        """Send data, or the part of it asked for with a Range header"""
+        rng = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if not rng or (if_range and if_range != etag):
+            return self.send_body(kind, data, ctype=ctype,
+                                  headers={'ETag': etag,
+                                           'Accept-Ranges': 'bytes'},
+                                  truncatable=True)
+        first, _, last = rng.partition('=')[2].partition('-')
+        first = int(first)
+        last = min(int(last), len(data) - 1) if last else len(data) - 1
+        if first >= len(data):
+            return self.send_body(kind, b'', status=416, headers={
+                'Content-Range': f'bytes */{len(data)}'})
+        self.send_body(kind, data[first:last + 1], status=206, ctype=ctype,
+                       headers={'ETag': etag,
+                                'Content-Range':
+                                f'bytes {first}-{last}/{len(data)}'},
+                       truncatable=True)
+
+    # Routing
+
+    def dispatch(self, method):
+        split = urlsplit(self.path)
+        self.query = parse_qs(split.query)
+        config = self.server.config
+        if config.latency:
+            time.sleep(config.latency)
+        body = self.receive()
+        self.received = len(body)
+        path = unquote(split.path)
+        for pattern, handler in ROUTES[method]:
+            match = pattern.fullmatch(path)
+            if not match:
+                continue
+            if handler in FLAKY and (
+                    self.server.attempt(('fail', path)) <= config.fail_first or
+                    self.server.chance(config.failure_rate)):
+                return self.send_body('failure', {'message': 'injected'},
+                                      status=503)
+            return handler(self, body, *match.groups())
+        self.send_body('not found', {'message': 'not found'}, status=404)
+
+    def receive(self):
+        """Read the request body, as slowly as the bandwidth limit says"""
+        length = int(self.headers.get('Content-Length') or 0)
+        bandwidth = self.server.config.bandwidth
+        chunks = []
+        while length > 0:
+            chunk = self.rfile.read(min(CHUNK, length))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            length -= len(chunk)
+            if bandwidth:
+                time.sleep(len(chunk) / bandwidth)
+        return b''.join(chunks)
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    # ODK Central
+
+    def projects(self, body):
+        self.send_body('projects', [
+            {'id': p + 1, 'name': f'project {p + 1}'}
+            for p in range(self.server.config.projects)])
+
+    def project(self, body, project):
+        self.send_body('project', {'id': int(project),
+                                   'name': f'project {project}'})
+
+    def create_project(self, body):
+        with self.server.lock:
+            self.server.config.projects += 1
+            project = self.server.config.projects
+        self.send_body('create project', {'id': project,
+                                          'name': json.loads(body)['name']})
+
+    def delete_project(self, body, project):
+        with self.server.lock:
+            self.server.config.projects -= 1
+        self.send_body('delete project', {'success': True})
+
+    def forms(self, body, project):
+        self.send_body('forms', [{'xmlFormId': f'form_{f}',
+                                  'name': f'Form {f}'}
+                                 for f in range(self.server.config.forms)])
+
+    def create_form(self, body, project):
+        with self.server.lock:
+            form = self.server.config.forms
+            self.server.config.forms += 1
+        self.send_body('create form', {'xmlFormId': f'form_{form}'})
+
+    def app_users(self, body, project):
+        self.send_body('app-users', [
+            {'id': 100 + u, 'displayName': f'surveyor {u}',
+             'token': f'token{u}'}
+            for u in range(self.server.config.app_users)])
+
+    def create_app_user(self, body, project):
+        with self.server.lock:
+            user = self.server.config.app_users
+            self.server.config.app_users += 1
+        self.send_body('create app-user', {
+            'id': 100 + user, 'displayName': json.loads(body)['displayName'],
+            'token': f'token{user}'})
+
+    def assignments(self, body, project, form, role):
+        actors = self.server.assignments[(project, form, role)]
+        self.send_body('assignments', [{'id': a} for a in sorted(actors)])
+
+    def assign(self, body, project, form, role, actor):
+        with self.server.lock:
+            self.server.assignments[(project, form, role)].add(int(actor))
+        self.send_body('assign', {'success': True})
+
+    def submissions(self, body, project, form):
+        self.send_body('submissions', [
+            {'instanceId': f'uuid:sub-{i}', 'createdAt': submission_date(i)}
+            for i in range(self.server.config.submissions)])
+
+    def odata(self, body, project, form):
+        rows = range(self.server.config.submissions)
+        if '$filter' in self.query:
+            since = self.query['$filter'][0].rpartition(' gt ')[2]
+            rows = [i for i in rows if submission_date(i) > since]
+        skip = int(self.query.get('$skip', ['0'])[0])
+        top = int(self.query.get('$top', [str(len(rows))])[0])
+        self.send_body('odata', {'value': [self.server.submission(i)
+                                           for i in rows[skip:skip + top]]})
+
+    def attachment_list(self, body, project, form, instance):
+        if int(instance.rpartition('-')[2]) in self.server.config.unlistable:
+            return self.send_body('attachment list', {'message': 'error'},
+                                  status=500)
+        exists = self.server.attachment_exists(instance)
+        self.send_body('attachment list', [
+            {'name': name, 'exists': exists}
+            for name in self.server.attachment_names(instance)])
+
+    def attachment(self, body, project, form, instance, name):
+        if not self.server.attachment_exists(instance):
+            return self.send_body('attachment', {'message': 'not found'},
+                                  status=404)
+        data, etag = self.server.attachment_content(instance, name)
+        self.send_range('attachment', data, etag, 'image/jpeg')
+
+    # WebODM
+
+    def token_auth(self, body):
+        self.send_body('token-auth', {'token': self.server.token()})
+
+    def authorized(self):
+        scheme, _, token = self.headers.get('Authorization', '').partition(' ')
+        if scheme != 'JWT' or not self.server.token_valid(token):
+            self.send_body('unauthorized', {'detail': 'invalid token'},
+                           status=401)
+            return False
+        return True
+
+    def task_list(self, body, project):
+        if self.authorized():
+            self.send_body('tasks', list(self.server.tasks.values()))
+
+    def create_task(self, body, project):
+        if not self.authorized():
+            return
+        task_id = str(uuid.uuid4())
+        with self.server.lock:
+            self.server.tasks[task_id] = {'id': task_id, 'status': None,
+                                          'running_progress': 0,
+                                          'images_count': 0}
+        self.send_body('create task', {'id': task_id}, status=201)
+
+    def upload(self, body, project, task):
+        if not self.authorized():
+            return
+        names = [name.decode() for name in
+                 re.findall(rb'name="images"; filename="([^"]*)"', body)]
+        images = len(names)
+        with self.server.lock:
+            self.server.uploaded_names[task].extend(names)
+            self.server.uploaded[task] += images
+            self.server.tasks[task]['images_count'] += images
+        self.send_body('upload', {'success': True, 'uploaded': images})
+
+    def commit(self, body, project, task):
+        if not self.authorized():
+            return
+        with self.server.lock:
+            self.server.tasks[task]['status'] = 10
+        self.send_body('commit', {'id': task})
+
+    def asset(self, body, project, task, asset):
+        if self.authorized():
+            data = content(asset, self.server.config.asset_size)
+            self.send_range('asset', data, f'"{task}-{asset}"',
+                            'application/octet-stream')
+
+
+_FORM = r'/v1/projects/(\d+)/forms/([^/]+)'
+_TASK = r'/api/projects/(\d+)/tasks/([^/]+)'
+ROUTES = {
+    'GET': [(re.compile(pattern), handler) for pattern, handler in [
+        (r'/v1/projects', StubHandler.projects),
+        (r'/v1/projects/(\d+)', StubHandler.project),
+        (r'/v1/projects/(\d+)/forms', StubHandler.forms),
+        (r'/v1/projects/(\d+)/app-users', StubHandler.app_users),
+        (_FORM + r'/assignments/(\d+)', StubHandler.assignments),
+        (_FORM + r'/submissions', StubHandler.submissions),
+        (r'/v1/projects/(\d+)/forms/([^/]+)\.svc/Submissions',
+         StubHandler.odata),
+        (_FORM + r'/submissions/([^/]+)/attachments',
+         StubHandler.attachment_list),
+        (_FORM + r'/submissions/([^/]+)/attachments/([^/]+)',
+         StubHandler.attachment),
+        (r'/api/projects/(\d+)/tasks/', StubHandler.task_list),
+        (_TASK + r'/download/([^/]+)', StubHandler.asset),
+    ]],
+    'POST': [(re.compile(pattern), handler) for pattern, handler in [
+        (r'/v1/projects', StubHandler.create_project),
+        (r'/v1/projects/(\d+)/forms', StubHandler.create_form),
+        (r'/v1/projects/(\d+)/app-users', StubHandler.create_app_user),
+        (_FORM + r'/assignments/(\d+)/(\d+)', StubHandler.assign),
+        (r'/api/token-auth/', StubHandler.token_auth),
+        (r'/api/projects/(\d+)/tasks/', StubHandler.create_task),
+        (_TASK + r'/upload/', StubHandler.upload),
+        (_TASK + r'/commit/', StubHandler.commit),
+    ]],
+    'DELETE': [(re.compile(pattern), handler) for pattern, handler in [
+        (r'/v1/projects/(\d+)', StubHandler.delete_project),
+    ]],
+}
+# The bulk transfer requests, whose retries the failure injection exercises.
+# Listing and setup requests always succeed.
+FLAKY = {StubHandler.attachment, StubHandler.upload, StubHandler.asset}
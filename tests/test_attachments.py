@@ -0,0 +1,142 @@
+import os
+
+from odk2odm import attachments
+from odk2odm import batch_upload
+from odk2odm import extract_location_from_exif
+from odk2odm import image_integrity_check
+from odk2odm import sync_state
+from odk2odm.manifest import MANIFEST_NAME
+from tests.stub_servers import submission_date
+
+AUT = ('user', 'password')
+
+
+def download(stub, outdir, **kwargs):
+    return attachments.threaded_download(stub.url, AUT, 1, 'form_0',
+                                         str(outdir), threads=4, **kwargs)
+
+
+def photos(outdir):
+    return sorted(f for f in os.listdir(outdir) if f.endswith('.jpg'))
+
+
+def assert_contents(stub, outdir):
+    for f in photos(outdir):
+        # img_<submission>_<n>.jpg
+        instance = f'uuid:sub-{int(f.split("_")[1])}'
+        expected, _ = stub.attachment_content(instance, f)
+        with open(os.path.join(outdir, f), 'rb') as infile:
+            assert infile.read() == expected, f
+
+
+def test_download(stub, tmp_path):
+    stats = download(stub, tmp_path)
+    assert (stats.files, stats.failed) == (12, 0)
+    assert len(photos(tmp_path)) == 12
+    assert_contents(stub, tmp_path)
+
+
+def test_truncated_downloads_are_retried(stub, tmp_path, no_backoff):
+    stub.config.truncate_first = 1
+    stub.config.fail_first = 1
+    stats = download(stub, tmp_path)
+    assert (stats.files, stats.failed) == (12, 0)
+    assert_contents(stub, tmp_path)
+    assert not [f for f in os.listdir(tmp_path) if f.endswith('.part')]
+
+
+def test_resume_continues_part_files(stub, tmp_path, no_backoff):
+    # Larger than a chunk, so a download breaking off leaves something
+    stub.config.submissions = 1
+    stub.config.attachment_size = 3 * 1024 * 1024
+    # Every attempt breaks off half way, so only .part files are left
+    stub.config.truncate_first = 10
+    stats = download(stub, tmp_path, resume=True)
+    assert stats.failed == 2
+    assert os.path.exists(tmp_path / MANIFEST_NAME)
+    parts = [f for f in os.listdir(tmp_path) if f.endswith('.part')]
+    assert len(parts) == 2
+
+    stub.config.truncate_first = 0
+    stats = download(stub, tmp_path, resume=True)
+    assert (stats.files, stats.failed) == (2, 0)
+    # Only the bytes missing from the .part files were fetched again
+    assert stats.nbytes < 2 * stub.config.attachment_size
+    assert_contents(stub, tmp_path)
+
+
+def test_incremental_fetches_only_new_submissions(stub, tmp_path):
+    download(stub, tmp_path, incremental=True)
+    state = sync_state.SyncState(str(tmp_path / sync_state.SYNC_NAME))
+    assert state.get('attachments', 1, 'form_0') == submission_date(5)
+
+    stub.config.submissions = 8
+    stats = download(stub, tmp_path, incremental=True)
+    assert stats.files == 4
+    assert len(photos(tmp_path)) == 16
+
+
+def test_incremental_waits_for_missing_attachments(stub, tmp_path):
+    stub.config.missing = (3,)
+    stats = download(stub, tmp_path, incremental=True)
+    assert (stats.files, stats.failed) == (10, 0)
+    state = sync_state.SyncState(str(tmp_path / sync_state.SYNC_NAME))
+    # Below submission 3, so that it is listed again
+    assert state.get('attachments', 1, 'form_0') == submission_date(2)
+
+    stub.config.missing = ()
+    stats = download(stub, tmp_path, incremental=True)
+    assert stats.failed == 0
+    assert len(photos(tmp_path)) == 12
+    state = sync_state.SyncState(str(tmp_path / sync_state.SYNC_NAME))
+    assert state.get('attachments', 1, 'form_0') == submission_date(5)
+
+
+def test_incremental_lists_failed_listings_again(stub, tmp_path):
+    stub.config.unlistable = (2,)
+    stats = download(stub, tmp_path, incremental=True)
+    assert (stats.files, stats.failed) == (10, 0)
+    state = sync_state.SyncState(str(tmp_path / sync_state.SYNC_NAME))
+    assert state.get('attachments', 1, 'form_0') == submission_date(1)
+
+    stub.config.unlistable = ()
+    download(stub, tmp_path, incremental=True)
+    assert len(photos(tmp_path)) == 12
+    state = sync_state.SyncState(str(tmp_path / sync_state.SYNC_NAME))
+    assert state.get('attachments', 1, 'form_0') == submission_date(5)
+
+
+def test_dedup_stores_resubmitted_photos_once(stub, tmp_path):
+    # Submissions 4 and 5 repeat the photos of 0 and 1
+    stub.config.resubmitted = 2
+    stats = download(stub, tmp_path, dedup=True)
+    assert (stats.files, stats.failed) == (12, 0)
+    assert len(photos(tmp_path)) == 8
+    repeated = tmp_path / 'by_submission' / 'uuid_sub-4' / 'img_000000_0.jpg'
+    assert os.path.samefile(repeated, tmp_path / 'img_000000_0.jpg')
+
+
+def test_dedup_keeps_photos_sharing_a_filename(stub, tmp_path):
+    stub.config.shared_names = True
+    download(stub, tmp_path, dedup=True)
+    names = photos(tmp_path)
+    assert len(names) == 12
+    assert 'photo_0.jpg' in names and 'photo_0_5.jpg' in names
+    contents = set()
+    for name in names:
+        with open(tmp_path / name, 'rb') as infile:
+            contents.add(infile.read())
+    assert len(contents) == 12
+
+
+def test_walkers_skip_the_per_submission_copies(stub, tmp_path):
+    stub.config.resubmitted = 2
+    download(stub, tmp_path, dedup=True)
+    images = batch_upload.find_images(str(tmp_path))
+    assert [os.path.basename(f) for f in images] == photos(tmp_path)
+    assert len(images) == 8
+    for walker in (extract_location_from_exif.scandir,
+                   image_integrity_check.iter_files):
+        files = list(walker(str(tmp_path)))
+        assert not [f for f in files if 'by_submission' in f]
+        assert len([f for f in files if f.endswith('.jpg')]) == 8
@@ -0,0 +1,30 @@
+from odk2odm import batch_upload
+from odk2odm.odm_client import TokenAuth
+
+AUT = ('user', 'password')
+
+
+def test_batch_upload_retries_failed_batches(stub, no_backoff):
+    stub.config.fail_first = 2
+    token = TokenAuth(stub.url, *AUT)
+    images = [(f'{i}.jpg', bytes([i]) * 1000) for i in range(20)]
+    task_id, stats, failed = batch_upload.upload_images(stub.url, token, 1,
+                                                        images)
+    assert (stats.files, failed) == (20, [])
+    assert sorted(stub.uploaded_names[task_id]) == sorted(
+        name for name, _ in images)
+    assert stub.tasks[task_id]['status'] == 10
+
+
+def test_batch_upload_refreshes_a_rejected_token(stub):
+    token = TokenAuth(stub.url, *AUT)
+    task_id = batch_upload.create_partial_task(stub.url, token, 1, 'task')
+    stub.tokens.clear()
+    sizer = batch_upload.BatchSizer(initial=8)
+    images = [(f'{i}.jpg', b'x' * 1000) for i in range(8)]
+    _, stats, failed = batch_upload.upload_images(
+        stub.url, token, 1, images, task_id=task_id, sizer=sizer)
+    assert (stats.files, stats.failed, failed) == (8, 0, [])
+    # The rejected batch didn't count as a failure
+    assert sizer.size > 8
+    assert token.refreshes == 2
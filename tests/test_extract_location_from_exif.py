@@ -0,0 +1,110 @@
+import pytest
+from PIL import Image
+
+from odk2odm import extract_location_from_exif as exif
+
+LAT = ((6, 1), (48, 1), (3600, 100))
+LON = ((39, 1), (16, 1), (4800, 100))
+ALT = ((1234, 10),)
+
+
+def tiff(order, gps=True):
+    """TIFF data with an IFD0 pointing to a GPS IFD, in the given byte order"""
+    def uint(value, size):
+        return value.to_bytes(size, order)
+
+    def entry(tag, kind, count, value):
+        return uint(tag, 2) + uint(kind, 2) + uint(count, 4) + value
+
+    header = (b'II' if order == 'little' else b'MM') + uint(42, 2) + uint(8, 4)
+    if not gps:
+        return header + uint(1, 2) + entry(0x010F, 3, 1, uint(1, 4)) + uint(0, 4)
+    ifd0 = uint(1, 2) + entry(exif.TIFF_GPS_IFD, 4, 1, uint(26, 4)) + uint(0, 4)
+    # The rationals follow the five entries of the GPS IFD
+    data = 26 + 2 + 5 * 12 + 4
+    rationals = b''.join(uint(n, 4) + uint(d, 4) for n, d in LAT + LON + ALT)
+    gps_ifd = (uint(5, 2)
+               + entry(1, 2, 2, b'S\x00\x00\x00')
+               + entry(2, 5, 3, uint(data, 4))
+               + entry(3, 2, 2, b'E\x00\x00\x00')
+               + entry(4, 5, 3, uint(data + 24, 4))
+               + entry(6, 5, 1, uint(data + 48, 4))
+               + uint(0, 4))
+    return header + ifd0 + gps_ifd + rationals
+
+
+def jpeg(path, app1):
+    """Write a JPEG with the given APP1 payload ahead of a PIL-made image"""
+    Image.new('RGB', (8, 8)).save(path)
+    with open(path, 'rb') as f:
+        image = f.read()
+    segment = b'\xff\xe1' + (len(app1) + 2).to_bytes(2, 'big') + app1
+    with open(path, 'wb') as f:
+        f.write(image[:2] + segment + image[2:])
+    return str(path)
+
+
+@pytest.mark.parametrize('order', ['little', 'big'])
+def test_parse_gps_ifd(order):
+    assert exif.parse_gps_ifd(tiff(order)) == {
+        'latref': 'S', 'lat': list(LAT), 'lonref': 'E', 'lon': list(LON),
+        'alt': list(ALT)}
+
+
+def test_parse_gps_ifd_without_gps():
+    assert exif.parse_gps_ifd(tiff('little', gps=False)) is None
+
+
+@pytest.mark.parametrize('data', [b'XX\x00*', tiff('big')[:40]])
+def test_parse_gps_ifd_rejects_unreadable_data(data):
+    with pytest.raises(ValueError):
+        exif.parse_gps_ifd(data)
+
+
+def test_read_gps_header(tmp_path):
+    path = jpeg(tmp_path / 'a.jpg', b'Exif\x00\x00' + tiff('big'))
+    lat, lon, alt = exif.read_gps_header(path)
+    assert lat == pytest.approx(-(6 + 48 / 60 + 36 / 3600))
+    assert lon == pytest.approx(39 + 16 / 60 + 48 / 3600)
+    assert alt == pytest.approx(123.4)
+    assert exif.extract_location(path) == (lat, lon, alt)
+
+
+def test_read_gps_header_rejects_truncated_app1(tmp_path):
+    path = jpeg(tmp_path / 'a.jpg', b'Exif\x00\x00' + tiff('little'))
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data[:60])
+    with pytest.raises(ValueError):
+        exif.read_gps_header(path)
+
+
+def test_photos_without_gps_are_not_read_again(tmp_path, monkeypatch, capsys):
+    def process_file(*args, **kwargs):
+        raise AssertionError('exifread was used')
+
+    monkeypatch.setattr(exif.exifread, 'process_file', process_file)
+    plain = tmp_path / 'plain.jpg'
+    Image.new('RGB', (8, 8)).save(plain)
+    no_gps = jpeg(tmp_path / 'no_gps.jpg',
+                  b'Exif\x00\x00' + tiff('little', gps=False))
+    assert exif.extract_location(str(plain)) is None
+    assert exif.extract_location(no_gps) is None
+    assert capsys.readouterr().out == ''
+
+
+def test_unreadable_headers_fall_back_to_exifread(tmp_path, monkeypatch,
+                                                  capsys):
+    read = []
+    process_file = exif.exifread.process_file
+
+    def recording(f, **kwargs):
+        read.append(f.name)
+        return process_file(f, **kwargs)
+
+    monkeypatch.setattr(exif.exifread, 'process_file', recording)
+    path = jpeg(tmp_path / 'a.jpg', b'Exif\x00\x00MM\x00*\xff\xff\xff\xff')
+    assert exif.extract_location(path) is None
+    assert read == [path]
+    assert capsys.readouterr().out == ''
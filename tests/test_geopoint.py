@@ -0,0 +1,54 @@
+import math
+
+import pytest
+
+from odk2odm.geopoint import geopoint_arrays, parse_geopoint
+
+POINT = {'type': 'Point', 'coordinates': [39.28, -6.8, 12.5],
+         'properties': {'accuracy': 4.0}}
+
+
+@pytest.mark.parametrize('value, expected', [
+    # OData GeoJSON dicts
+    (POINT, (-6.8, 39.28, 12.5, 4.0)),
+    ({'type': 'Point', 'coordinates': [39, -6]}, (-6.0, 39.0, None, None)),
+    ({'type': 'Point', 'coordinates': [39.28, -6.8, None]},
+     (-6.8, 39.28, None, None)),
+    ({'type': 'Point', 'coordinates': [39.28]}, None),
+    ({'type': 'Point', 'coordinates': [None, None]}, None),
+    ({}, None),
+    # The same written out by Python, or as JSON
+    (str(POINT), (-6.8, 39.28, 12.5, 4.0)),
+    ("{'type': 'Point', 'coordinates': [39.28, -6.8, None]}",
+     (-6.8, 39.28, None, None)),
+    ('{"type": "Point", "coordinates": [39.28, -6.8, null],'
+     ' "properties": {"accuracy": 3}}', (-6.8, 39.28, None, 3.0)),
+    ("{'type': 'Point', 'coordinates': [39.28, -6.8]}",
+     (-6.8, 39.28, None, None)),
+    ("{'type': 'Point', 'coordinates': []}", None),
+    # JavaRosa strings
+    ('-6.8 39.28', (-6.8, 39.28, None, None)),
+    ('-6.8 39.28 12.5', (-6.8, 39.28, 12.5, None)),
+    (' -6.8 39.28 12.5 4 ', (-6.8, 39.28, 12.5, 4.0)),
+    ('-6.8e0 +39.28 .5 4.', (-6.8, 39.28, 0.5, 4.0)),
+    ('-6.8', None),
+    ('-6.8 39.28 12.5 4 1', None),
+    ('somewhere', None),
+    # Empty values
+    ('', None),
+    (None, None),
+    (math.nan, None),
+])
+def test_parse_geopoint(value, expected):
+    assert parse_geopoint(value) == expected
+
+
+def test_geopoint_arrays():
+    lat, lon, ele, acc = geopoint_arrays(
+        [POINT, '-6.9 39.3', None, "{'coordinates': [39.4, -7.0, None]}"])
+    assert list(lat[:2]) == [-6.8, -6.9] and lat[3] == -7.0
+    assert list(lon[:2]) == [39.28, 39.3] and lon[3] == 39.4
+    assert ele[0] == 12.5 and math.isnan(ele[1]) and math.isnan(ele[3])
+    assert acc[0] == 4.0 and math.isnan(acc[1])
+    assert all(math.isnan(column[2]) for column in (lat, lon, ele, acc))
+    assert all(column.typecode == 'd' for column in (lat, lon, ele, acc))
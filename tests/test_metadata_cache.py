@@ -0,0 +1,137 @@
+import pytest
+from requests.auth import HTTPBasicAuth
+
+from odk2odm import metadata_cache
+from odk2odm import odk_requests
+from odk2odm.metadata_cache import MetadataCache
+
+AUT = ('user', 'password')
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def cache():
+    """A fresh shared cache, so that no test sees another's entries"""
+    previous = metadata_cache.get_cache()
+    fresh = MetadataCache()
+    metadata_cache.set_cache(fresh)
+    yield fresh
+    metadata_cache.set_cache(previous)
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(metadata_cache, 'time', clock)
+    cache = MetadataCache(ttl=10)
+    fetches = []
+
+    def fetch():
+        fetches.append(clock.now)
+        return len(fetches)
+
+    assert cache.get('key', fetch) == 1
+    clock.now += 9.9
+    assert cache.get('key', fetch) == 1
+    clock.now += 0.1
+    assert cache.get('key', fetch) == 2
+    assert fetches == [1000.0, 1010.0]
+
+
+def test_nothing_is_cached_without_a_ttl():
+    cache = MetadataCache(ttl=0)
+    values = iter([1, 2])
+    assert cache.get('key', lambda: next(values)) == 1
+    assert cache.get('key', lambda: next(values)) == 2
+    assert cache.entries == {}
+
+
+def test_failed_fetches_are_not_cached():
+    cache = MetadataCache()
+
+    def fail():
+        raise ValueError('no')
+
+    with pytest.raises(ValueError):
+        cache.get('key', fail)
+    assert cache.get('key', lambda: 1) == 1
+
+
+def test_invalidate_drops_a_prefix():
+    cache = MetadataCache()
+    for key in [('url', 'user', 'projects'), ('url', 'user', '1', 'forms'),
+                ('url', 'user', '1', 'app-users'),
+                ('url', 'user', '12', 'forms'),
+                ('url', 'other', '1', 'forms')]:
+        cache.get(key, lambda: key)
+    cache.invalidate('url', 'user', '1')
+    assert sorted(cache.entries) == [('url', 'other', '1', 'forms'),
+                                     ('url', 'user', '12', 'forms'),
+                                     ('url', 'user', 'projects')]
+    cache.invalidate()
+    assert cache.entries == {}
+
+
+def test_lists_are_fetched_once(stub, cache):
+    for _ in range(3):
+        assert len(odk_requests.project_list(stub.url, AUT)) == 1
+        assert len(odk_requests.form_list(stub.url, AUT, 1)) == 1
+        assert len(odk_requests.app_user_list(stub.url, AUT, 1)) == 5
+    assert (stub.requests['projects'], stub.requests['forms'],
+            stub.requests['app-users']) == (1, 1, 1)
+
+
+def test_give_access_app_users_reuses_the_lists(stub, cache):
+    assert odk_requests.give_access_app_users(stub.url, AUT, 1)[1] == 200
+    assert stub.requests['assign'] == 5
+    assert odk_requests.give_access_app_users(stub.url, AUT, 1)[1] == 200
+    assert (stub.requests['forms'], stub.requests['app-users']) == (1, 1)
+    # The existing assignments are looked up again, but not repeated
+    assert (stub.requests['assignments'], stub.requests['assign']) == (2, 5)
+
+
+def lists(stub):
+    odk_requests.project_list(stub.url, AUT)
+    odk_requests.form_list(stub.url, AUT, 1)
+    odk_requests.app_user_list(stub.url, AUT, 1)
+    return (stub.requests['projects'], stub.requests['forms'],
+            stub.requests['app-users'])
+
+
+@pytest.mark.parametrize('change, refetched', [
+    (lambda url: odk_requests.create_project(url, AUT, 'new'), (2, 1, 1)),
+    (lambda url: odk_requests.create_form(url, AUT, 1, 'new', b'xlsx'),
+     (1, 2, 1)),
+    (lambda url: odk_requests.create_app_user(url, AUT, 1), (1, 1, 2)),
+    (lambda url: odk_requests.delete_project(url, AUT, 1), (2, 2, 2)),
+])
+def test_changes_invalidate_their_lists(stub, cache, change, refetched):
+    assert lists(stub) == (1, 1, 1)
+    assert change(stub.url).status_code == 200
+    assert lists(stub) == refetched
+
+
+def test_created_app_users_are_listed(stub, cache):
+    assert len(odk_requests.app_user_list(stub.url, AUT, 1)) == 5
+    odk_requests.create_app_user(stub.url, AUT, 1, 'new surveyor')
+    users = odk_requests.app_user_list(stub.url, AUT, 1)
+    assert [u['displayName'] for u in users][-1] == 'surveyor 5'
+    assert len(users) == 6
+
+
+def test_cache_keys_are_shared_with_odk_central():
+    key = odk_requests._cache_key('https://odk', AUT, 1, 'forms')
+    assert key == ('https://odk', 'user', '1', 'forms')
+    # OdkCentral authenticates with an HTTPBasicAuth
+    assert odk_requests._cache_key('https://odk', HTTPBasicAuth(*AUT), 1,
+                                   'forms') == key
+    OdkCentral = pytest.importorskip('odk2odm.OdkCentral').OdkCentral
+    central = OdkCentral('https://odk', *AUT)
+    central.url, central.user = 'https://odk', 'user'
+    assert central.cacheKey(1, 'forms') == key
@@ -0,0 +1,49 @@
+from odk2odm import download
+from odk2odm import odm_assets
+from odk2odm.odm_client import TokenAuth
+from tests.stub_servers import content
+
+AUT = ('user', 'password')
+
+
+def fetch_asset(stub, outfilepath, **kwargs):
+    token = TokenAuth(stub.url, *AUT)
+    return odm_assets.download_asset(stub.url, token, 1, 'task', 'all.zip',
+                                     str(outfilepath), **kwargs)
+
+
+def expected(stub):
+    return content('all.zip', stub.config.asset_size)
+
+
+def test_segmented_download(stub, tmp_path):
+    outfilepath = tmp_path / 'all.zip'
+    fetch_asset(stub, outfilepath, segments=4, min_segment=8 * 1024)
+    assert outfilepath.read_bytes() == expected(stub)
+    assert stub.requests['asset'] == 5
+    assert [f.name for f in tmp_path.iterdir()] == ['all.zip']
+
+
+def test_resume_with_the_same_etag(stub, tmp_path):
+    outfilepath = tmp_path / 'all.zip'
+    with open(download.part_path(str(outfilepath)), 'wb') as partfile:
+        partfile.write(expected(stub)[:1000])
+    with open(download.etag_path(str(outfilepath)), 'w') as tagfile:
+        tagfile.write('"task-all.zip"')
+    received = fetch_asset(stub, outfilepath, segments=1)
+    assert received == stub.config.asset_size - 1000
+    assert outfilepath.read_bytes() == expected(stub)
+    assert [f.name for f in tmp_path.iterdir()] == ['all.zip']
+
+
+def test_part_of_another_version_is_discarded(stub, tmp_path):
+    outfilepath = tmp_path / 'all.zip'
+    for etag in ('"an older version"', None):
+        with open(download.part_path(str(outfilepath)), 'wb') as partfile:
+            partfile.write(b'x' * 1000)
+        if etag:
+            with open(download.etag_path(str(outfilepath)), 'w') as tagfile:
+                tagfile.write(etag)
+        received = fetch_asset(stub, outfilepath, segments=1)
+        assert received == stub.config.asset_size
+        assert outfilepath.read_bytes() == expected(stub)
@@ -0,0 +1,37 @@
+import time
+
+from odk2odm import odm_requests
+from odk2odm.odm_client import OdmClient, TokenAuth, jwt_expiry
+
+AUT = ('user', 'password')
+
+
+def test_jwt_expiry(stub):
+    token = TokenAuth(stub.url, *AUT)
+    expiry = jwt_expiry(token.token())
+    assert abs(expiry - time.time() - stub.config.token_lifetime) < 60
+    assert jwt_expiry('not a jwt') is None
+
+
+def test_token_is_refreshed_before_it_expires(stub):
+    stub.config.token_lifetime = 0.4
+    token = TokenAuth(stub.url, *AUT)
+    first = token.token()
+    assert token.token() == first
+    # Refreshed halfway through such a short life
+    time.sleep(0.25)
+    assert token.token() != first
+    assert token.refreshes == 2
+    res = odm_requests.get_tasks(stub.url, token, 1)
+    assert res.status_code == 200
+
+
+def test_client_refreshes_a_rejected_token(stub):
+    client = OdmClient(stub.url, *AUT)
+    assert client.get('/api/projects/1/tasks/').status_code == 200
+    # The server forgets its tokens, e.g. after a restart
+    stub.tokens.clear()
+    res = client.get('/api/projects/1/tasks/')
+    assert res.status_code == 200
+    assert [r.status_code for r in res.history] == [401]
+    assert client.auth.refreshes == 2
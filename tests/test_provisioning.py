@@ -0,0 +1,33 @@
+import base64
+import json
+import zlib
+
+from odk2odm import odk_requests
+from odk2odm import provisioning
+
+AUT = ('user', 'password')
+
+
+def decode(settings):
+    return json.loads(zlib.decompress(base64.b64decode(settings)))
+
+
+def test_qr_codes(stub, tmp_path):
+    codes = provisioning.qr_codes(stub.url, AUT, 1, outdir=str(tmp_path),
+                                  processes=1)
+    assert [code.app_user_id for code in codes] == [100, 101, 102, 103, 104]
+    settings = decode(codes[0].settings)
+    assert settings['general']['server_url'] == \
+        f'{stub.url}/v1/key/token0/projects/1'
+    # Written to outdir instead of being returned
+    assert codes[0].png is None
+    with open(codes[0].path, 'rb') as infile:
+        assert infile.read().startswith(b'\x89PNG')
+
+
+def test_get_qr_code_leaves_the_defaults_alone(stub):
+    general = dict(odk_requests.general)
+    png, status = odk_requests.get_qr_code(stub.url, AUT, 1, 'token0')
+    assert status == 200
+    assert png.startswith(b'\x89PNG')
+    assert odk_requests.general == general
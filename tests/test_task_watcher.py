@@ -0,0 +1,101 @@
+import pytest
+
+from odk2odm import task_watcher
+from odk2odm.odm_client import TokenAuth
+from odk2odm.task_watcher import COMPLETED, QUEUED, RUNNING, TaskWatcher
+
+AUT = ('user', 'password')
+
+
+class Clock(object):
+    """Stands in for the time module, so the watcher never really waits"""
+    def __init__(self, on_sleep=None):
+        self.now = 1000.0
+        self.waits = []
+        self.on_sleep = on_sleep
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.waits.append(seconds)
+        self.now += seconds
+        if self.on_sleep:
+            self.on_sleep(self)
+
+
+def task(task_id, status, progress=0):
+    return {'id': task_id, 'status': status, 'running_progress': progress}
+
+
+def watcher(stub, monkeypatch, clock=None, **kwargs):
+    monkeypatch.setattr(task_watcher, 'time', clock or Clock())
+    return TaskWatcher(stub.url, TokenAuth(stub.url, *AUT), 1,
+                       min_interval=5, max_interval=20, **kwargs)
+
+
+def test_next_interval_backs_off_while_nothing_changes(stub, monkeypatch):
+    stub.tasks['a'] = task('a', QUEUED)
+    w = watcher(stub, monkeypatch)
+    assert w.next_interval(w.poll()) == 5
+    waits = [w.next_interval(w.poll()) for _ in range(5)]
+    assert waits == [7.5, 11.25, 16.875, 20, 20]
+    stub.tasks['a'] = task('a', RUNNING)
+    assert w.next_interval(w.poll()) == 5
+    assert w.requests == 7
+
+
+def test_next_interval_waits_no_longer_than_the_time_left(stub, monkeypatch):
+    clock = Clock()
+    stub.tasks['a'] = task('a', RUNNING, 0.8)
+    w = watcher(stub, monkeypatch, clock)
+    w.max_interval = 300
+    w.poll()
+    assert w.time_left() is None
+    # 0.1 in 100 seconds, so the remaining 0.1 takes another 100
+    clock.now += 100
+    stub.tasks['a'] = task('a', RUNNING, 0.9)
+    w.poll()
+    clock.now += 40
+    assert w.time_left() == pytest.approx(60)
+    w.interval = 200
+    assert w.next_interval(False) == pytest.approx(60)
+    # Never shorter than min_interval, even when overdue
+    clock.now += 100
+    assert w.next_interval(False) == 5
+
+
+def test_watch_until_finished(stub, monkeypatch):
+    def finish(clock):
+        if len(clock.waits) == 3:
+            stub.tasks['a'] = task('a', COMPLETED, 1)
+
+    changes = []
+    stub.tasks['a'] = task('a', QUEUED)
+    stub.tasks['b'] = task('b', COMPLETED, 1)
+    clock = Clock(finish)
+    w = watcher(stub, monkeypatch, clock, task_ids=['a'],
+                on_change=lambda t, previous: changes.append(
+                    (t['id'], previous, t['status'])))
+    tasks = w.watch()
+    assert list(tasks) == ['a']
+    assert changes == [('a', None, QUEUED), ('a', QUEUED, COMPLETED)]
+    assert clock.waits == [5, 7.5, 11.25]
+    assert w.finished()
+
+
+def test_watch_stops_at_the_timeout(stub, monkeypatch):
+    stub.tasks['a'] = task('a', QUEUED)
+    clock = Clock()
+    w = watcher(stub, monkeypatch, clock)
+    w.watch(timeout=30)
+    assert clock.waits == [5, 7.5, 11.25]
+    assert not w.finished()
+
+
+def test_watch_raises_for_missing_tasks(stub, monkeypatch):
+    stub.tasks['a'] = task('a', QUEUED)
+    w = watcher(stub, monkeypatch, task_ids=['a', 'gone'])
+    with pytest.raises(ValueError, match='gone'):
+        w.watch()
+    assert w.requests == 1
@@ -0,0 +1,61 @@
+from odk2odm import transfer
+from odk2odm.odm_client import TokenAuth
+
+AUT = ('user', 'password')
+
+
+def run_transfer(stub, **kwargs):
+    token = TokenAuth(stub.url, *AUT)
+    task_id, downloaded, uploaded = transfer.transfer_form_to_task(
+        stub.url, AUT, 1, 'form_0', stub.url, token, 1, **kwargs)
+    return stub.tasks[task_id], stub.uploaded_names[task_id], uploaded
+
+
+def test_transfer_commits_the_task(stub, no_backoff):
+    stub.config.truncate_first = 1
+    stub.config.fail_first = 1
+    task, names, uploaded = run_transfer(stub)
+    assert (uploaded.files, uploaded.failed) == (12, 0)
+    assert sorted(names) == sorted(f'img_{i:06d}_{a}.jpg'
+                                   for i in range(6) for a in range(2))
+    # Committed
+    assert task['status'] == 10
+
+
+def test_transfer_does_not_commit_without_every_listing(stub):
+    stub.config.unlistable = (2,)
+    task, names, uploaded = run_transfer(stub)
+    assert (uploaded.files, uploaded.failed) == (10, 0)
+    assert task['status'] is None
+
+
+def test_transfer_survives_failing_uploaders(stub, no_backoff, monkeypatch):
+    def broken(*args, **kwargs):
+        raise KeyError('token')
+    monkeypatch.setattr(transfer.odm_requests, 'post_upload', broken)
+    task, names, uploaded = run_transfer(stub, queue_size=2,
+                                         upload_threads=1)
+    assert (uploaded.files, uploaded.failed) == (0, 12)
+    assert task['status'] is None
+
+
+def test_transfer_sends_identical_photos_once(stub):
+    stub.config.resubmitted = 2
+    task, names, uploaded = run_transfer(stub)
+    assert len(names) == 8
+    assert task['status'] == 10
+
+
+def test_transfer_renames_photos_sharing_a_filename(stub):
+    stub.config.shared_names = True
+    task, names, uploaded = run_transfer(stub)
+    assert len(names) == 12
+    assert len(set(names)) == 12
+    assert 'photo_0.jpg' in names and 'photo_0_5.jpg' in names
+
+
+def test_transfer_without_dedup_sends_every_photo(stub):
+    stub.config.resubmitted = 2
+    task, names, uploaded = run_transfer(stub, dedup=False)
+    assert len(names) == 12
+    assert len(set(names)) == 12